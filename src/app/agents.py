@@ -1,21 +1,27 @@
+import contextvars
 import os
 import re
 import shutil
+import threading
 
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
 os.environ["CHROMA_ANONYMIZED_TELEMETRY"] = "False"
 
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from embeddings import E5Embeddings, get_shared_embedding_model
-
-import chromadb
-from langchain_chroma import Chroma
+from embeddings import get_shared_embedding_model
+from llm_backend import get_chat_model
+from async_runtime import to_thread
+import perf
+
+from vector_store_pool import get_store_pool
+from student_lookup import match_student_query, lookup_student, has_student_record_intent
+from lexical_index import load_index as load_lexical_index
 from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langchain.agents import create_react_agent, AgentExecutor
 from langchain.tools import Tool
 from langchain_core.prompts import PromptTemplate
+from langchain_core.documents import Document
 
 load_dotenv()
 
@@ -52,62 +58,135 @@ def _handle_error(error) -> str:
     
     return f"Lỗi: {error_str[:200]}"
 
-def create_rag_tool(vector_db_folder, tool_name, captured_docs=None):
+_SCORE_THRESHOLD = 0.78
 
-    db_path = os.path.join(PROCESSED_DIR, vector_db_folder)
-    embedding_model = _SHARED_EMBEDDING_MODEL
-    _SCORE_THRESHOLD = 0.78
+# Hybrid retrieval: BM25 (lexical_index) + dense, gộp bằng Reciprocal Rank Fusion.
+# Một kết quả lexical chỉ được tin (vượt "ngưỡng") khi nằm trong top đầu và khớp
+# phần lớn trọng số idf của câu hỏi (mã quy định, mã môn, email...).
+_HYBRID_ENABLED = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+_RRF_K = 60
+_LEXICAL_ACCEPT_RANK = 2
+_LEXICAL_MIN_COVERAGE = 0.6
 
-    def retrieve_func(query):
-        if not os.path.exists(db_path):
-            if captured_docs is not None:
-                captured_docs.clear()
-            return "Chưa có dữ liệu trong nhóm này."
+# Direct RAG: câu hỏi không đụng tới dữ liệu cá nhân sinh viên → gọi thẳng vector
+# store, bỏ qua vòng ReAct (tiết kiệm 1 lượt gọi LLM chỉ để chọn search_regulations).
+_DIRECT_RAG_ENABLED = os.getenv("AGENT_DIRECT_RAG", "1") == "1"
+# Direct SQL: tra cứu sinh viên theo MSSV / họ tên bằng truy vấn tham số hoá,
+# LLM viết SQL chỉ còn là fallback cho các câu pattern không nhận ra.
+_DIRECT_SQL_ENABLED = os.getenv("AGENT_DIRECT_SQL", "1") == "1"
 
-        try:
-            client = chromadb.PersistentClient(path=db_path)
-            db = Chroma(
-                client=client,
-                embedding_function=embedding_model,
-                collection_name="langchain",
-            )
-        except Exception as e:
-            print(f"Lỗi Chroma ({vector_db_folder}): {e}")
-            return "Lỗi DB."
+_fast_path_stats = {"direct_sql": 0, "direct_rag": 0, "react": 0}
+_fast_path_lock = threading.Lock()
 
-        results_with_scores = db.similarity_search_with_relevance_scores(query, k=5)
 
-        print(f"\n{'='*60}")
-        print(f"[RAG] Query: \"{query[:80]}...\"" if len(query) > 80 else f"[RAG] Query: \"{query}\"")
-        print(f"   Threshold: {_SCORE_THRESHOLD}")
-        if results_with_scores:
-            for i, (doc, score) in enumerate(results_with_scores):
-                status = "✅" if score >= _SCORE_THRESHOLD else "❌"
-                snippet = doc.page_content[:100].replace('\n', ' ')
-                print(f"   {status} Doc {i+1}: score={score:.4f} | \"{snippet}...\"")
-        else:
-            print("   Không có kết quả nào từ vector DB.")
-        print(f"{'='*60}\n")
+def _count_path(path: str):
+    with _fast_path_lock:
+        _fast_path_stats[path] += 1
 
-        filtered = [(doc, score) for doc, score in results_with_scores if score >= _SCORE_THRESHOLD]
 
-        if filtered:
-            docs = [doc for doc, _ in filtered[:3]] 
-            if captured_docs is not None:
-                captured_docs.clear()
-                captured_docs.extend(docs)
-            return "\n\n".join([d.page_content for d in docs])
-        else:
-            if results_with_scores:
-                top_doc, top_score = results_with_scores[0]
-                print(f"   Fallback: lấy top-1 (score={top_score:.4f}) — không hiển thị nguồn")
-                if captured_docs is not None:
-                    captured_docs.clear()
-                return top_doc.page_content
-            else:
-                if captured_docs is not None:
-                    captured_docs.clear()
-                return "Không tìm thấy thông tin liên quan trong dữ liệu TDTU."
+def get_fast_path_stats() -> dict:
+    with _fast_path_lock:
+        return dict(_fast_path_stats)
+
+
+def retrieve_documents(vector_db_folder, query):
+    """
+    Truy vấn vector store, trả về (text, docs, is_fallback):
+      - docs: các Document vượt ngưỡng (dùng để hiển thị nguồn)
+      - is_fallback: True nếu text là top-1 dưới ngưỡng (không hiển thị nguồn)
+    """
+    db_path = os.path.join(PROCESSED_DIR, vector_db_folder)
+    if not os.path.exists(db_path):
+        return "Chưa có dữ liệu trong nhóm này.", [], False
+
+    try:
+        db = get_store_pool().get_store(db_path, _SHARED_EMBEDDING_MODEL)
+    except Exception as e:
+        print(f"Lỗi Chroma ({vector_db_folder}): {e}")
+        return "Lỗi DB.", [], False
+
+    with perf.stage("retrieval_dense"):
+        results_with_scores = db.similarity_search_with_relevance_scores(query, k=5)
+
+    print(f"\n{'='*60}")
+    print(f"[RAG] Query: \"{query[:80]}...\"" if len(query) > 80 else f"[RAG] Query: \"{query}\"")
+    print(f"   Threshold: {_SCORE_THRESHOLD}")
+    if results_with_scores:
+        for i, (doc, score) in enumerate(results_with_scores):
+            status = "✅" if score >= _SCORE_THRESHOLD else "❌"
+            snippet = doc.page_content[:100].replace('\n', ' ')
+            print(f"   {status} Doc {i+1}: score={score:.4f} | \"{snippet}...\"")
+    else:
+        print("   Không có kết quả nào từ vector DB.")
+
+    with perf.stage("retrieval_lexical"):
+        lexical_hits = _lexical_search(db, db_path, query) if _HYBRID_ENABLED else []
+    for i, (doc, bm25, coverage) in enumerate(lexical_hits):
+        snippet = doc.page_content[:100].replace('\n', ' ')
+        print(f"   [BM25] Doc {i+1}: score={bm25:.2f} coverage={coverage:.2f} | \"{snippet}...\"")
+    print(f"{'='*60}\n")
+
+    ranked = _fuse_results(results_with_scores, lexical_hits)
+    accepted = [doc for doc, ok in ranked if ok]
+
+    if accepted:
+        docs = accepted[:3]
+        return "\n\n".join([d.page_content for d in docs]), docs, False
+    if ranked:
+        top_doc = ranked[0][0]
+        print("   Fallback: lấy top-1 (dưới ngưỡng) — không hiển thị nguồn")
+        return top_doc.page_content, [], True
+    return "Không tìm thấy thông tin liên quan trong dữ liệu TDTU.", [], False
+
+
+def _lexical_search(db, db_path, query, k=5):
+    """[(Document, bm25_score, coverage)] từ index BM25 của store (rỗng nếu chưa có index)."""
+    index = load_lexical_index(db_path)
+    if index is None:
+        return []
+    try:
+        hits = index.search(query, k=k)
+        if not hits:
+            return []
+        got = db.get(ids=[h[0] for h in hits], include=["documents", "metadatas"])
+    except Exception as e:
+        print(f"   [BM25] Lỗi: {e}")
+        return []
+    by_id = {
+        doc_id: Document(page_content=text or "", metadata=meta or {})
+        for doc_id, text, meta in zip(got["ids"], got["documents"], got["metadatas"])
+    }
+    return [(by_id[doc_id], score, cov) for doc_id, score, cov in hits if doc_id in by_id]
+
+
+def _fuse_results(dense, lexical):
+    """RRF trên 2 danh sách; trả về [(Document, vượt_ngưỡng)] theo điểm fused giảm dần."""
+    fused = {}
+    for rank, (doc, score) in enumerate(dense):
+        entry = fused.setdefault(doc.page_content, [doc, 0.0, False])
+        entry[1] += 1.0 / (_RRF_K + rank + 1)
+        entry[2] = entry[2] or score >= _SCORE_THRESHOLD
+    for rank, (doc, _, coverage) in enumerate(lexical):
+        entry = fused.setdefault(doc.page_content, [doc, 0.0, False])
+        entry[1] += 1.0 / (_RRF_K + rank + 1)
+        entry[2] = entry[2] or (rank < _LEXICAL_ACCEPT_RANK and coverage >= _LEXICAL_MIN_COVERAGE)
+    ordered = sorted(fused.values(), key=lambda e: e[1], reverse=True)
+    return [(doc, ok) for doc, _, ok in ordered]
+
+
+# Docs mà RAG tool lấy được trong lượt ReAct hiện tại. Mỗi lần gọi ReAct tự đặt 1 list riêng,
+# nên các request chạy đồng thời trên event loop không xoá / trộn citation của nhau.
+_captured_rag_docs = contextvars.ContextVar("captured_rag_docs", default=None)
+
+
+def create_rag_tool(vector_db_folder, tool_name):
+
+    def retrieve_func(query):
+        text, docs, _ = retrieve_documents(vector_db_folder, query)
+        captured = _captured_rag_docs.get()
+        if captured is not None:
+            captured[:] = docs
+        return text
 
     return Tool(
         name=tool_name,
@@ -118,17 +197,13 @@ def create_rag_tool(vector_db_folder, tool_name, captured_docs=None):
 class HybridAgent:
     def __init__(self, name, vector_db_folder, role_instruction):
         self.name = name
+        self.vector_db_folder = vector_db_folder
         self.role_instruction = role_instruction
         print(f"--- [INIT] Agent: {self.name} ---")
         
-        self.llm = ChatGroq(
-            model=os.getenv("LLM_MODEL"),
-            api_key=os.getenv("API_KEY"),
-            temperature=0
-        )
-
-        self._rag_docs = []
+        self.llm = get_chat_model("groq_llama")
 
+        self.has_sql = False
         self.tools = []
         if os.path.exists(SQL_DB_PATH):
             try:
@@ -141,10 +216,11 @@ class HybridAgent:
                     
                     if tool.name in ["sql_db_query", "sql_db_schema"]:
                         self.tools.append(tool)
+                self.has_sql = True
             except Exception as e:
                 print(f"[{self.name}] Không thể khởi tạo SQL tools: {e}")
         
-        self.tools.append(create_rag_tool(vector_db_folder, "search_regulations", self._rag_docs))
+        self.tools.append(create_rag_tool(vector_db_folder, "search_regulations"))
 
         template = """
         You are a specialized AI agent for Ton Duc Thang University (TDTU) data system.
@@ -210,9 +286,9 @@ class HybridAgent:
         response, _ = self.answer_with_context(query)
         return response
 
-    def _build_structured_contexts(self) -> list:
+    def _build_structured_contexts(self, docs) -> list:
         structured_contexts = []
-        for doc in self._rag_docs:
+        for doc in docs:
             meta = doc.metadata if hasattr(doc, 'metadata') else {}
             _raw = meta.get("page_title") or meta.get("title") or ""
             if re.match(r'^page_\d+\.(png|jpg|jpeg|pdf)$', _raw, re.IGNORECASE):
@@ -235,47 +311,128 @@ class HybridAgent:
             })
         return structured_contexts
 
-    def answer_with_context(self, query):
+    def _answer_direct_rag(self, clean_q, retrieved=None):
+        text, docs, is_fallback = retrieved or retrieve_documents(self.vector_db_folder, clean_q)
+        if docs:
+            return text, self._build_structured_contexts(docs)
+        if is_fallback:
+            return text, [{"content": text, "source": "", "page_title": ""}]
+        return text, []
+
+    def _answer_direct_sql(self, clean_q):
+        """Trả về (response, contexts) hoặc None nếu không áp dụng được fast path."""
+        match = match_student_query(clean_q)
+        if match is None:
+            return None
+        try:
+            with perf.stage("sql"):
+                rows = lookup_student(SQL_DB_PATH, *match)
+        except Exception as e:
+            print(f"   [{self.name}] Direct SQL lỗi: {e}. Fallback ReAct.")
+            return None
+        if not rows:
+            # Có thể là khớp nhầm ("Sinh viên Năm Nhất ...") → để RAG/ReAct trả lời.
+            print(f"   [{self.name}] Direct SQL ({match[0]}={match[1]}): không có dòng nào, fallback.")
+            return None
+        print(f"   [{self.name}] Direct SQL ({match[0]}={match[1]})")
+        return rows, [{"content": rows, "source": "", "page_title": ""}]
+
+    def _takes_direct_rag(self, clean_q) -> bool:
+        """True nếu câu hỏi sẽ đi Direct RAG (không khớp Direct SQL, không cần ReAct)."""
+        if _DIRECT_SQL_ENABLED and self.has_sql and match_student_query(clean_q) is not None:
+            return False
+        return _DIRECT_RAG_ENABLED and not has_student_record_intent(clean_q)
+
+    def _answer_fast_path(self, clean_q, retrieved=None):
+        """(response, contexts) nếu trả lời được không cần ReAct, ngược lại None."""
+        if _DIRECT_SQL_ENABLED and self.has_sql:
+            direct = self._answer_direct_sql(clean_q)
+            if direct is not None:
+                _count_path("direct_sql")
+                return direct
+
+        if _DIRECT_RAG_ENABLED and not has_student_record_intent(clean_q):
+            _count_path("direct_rag")
+            print(f"   [{self.name}] Direct RAG (bỏ qua ReAct)")
+            return self._answer_direct_rag(clean_q, retrieved)
+        return None
+
+    def _react_output(self, result, rag_docs):
         structured_contexts = []
+        output = result.get("output", "")
+        if "For troubleshooting, visit:" in output:
+            output = output.split("For troubleshooting, visit:")[0].strip()
+        
+        steps = result.get("intermediate_steps", [])
+        
+        if rag_docs:
+            structured_contexts = self._build_structured_contexts(rag_docs)
+        else:
+            for action, observation in steps:
+                obs_str = str(observation)
+                if observation and len(obs_str) > 20:
+                    if obs_str.startswith("Lỗi:") or "Could not parse LLM output" in obs_str or "For troubleshooting, visit:" in obs_str:
+                        continue
+                    structured_contexts.append({
+                        "content":    obs_str,
+                        "source":     "",
+                        "page_title": "",
+                    })
+        
+        if not output or "Agent stopped" in output or "iteration limit" in output:
+            for action, observation in reversed(steps):
+                obs_str = str(observation)
+                if observation and len(obs_str) > 50:
+                    if "For troubleshooting, visit:" in obs_str or "Could not parse LLM output" in obs_str:
+                        continue
+                    if obs_str.startswith("Lỗi:"):
+                        continue
+                    return obs_str, structured_contexts
+        
+        return (output if output else "Không tìm thấy thông tin."), structured_contexts
+
+    def answer_with_context(self, query):
         try:
-            self._rag_docs.clear()  
             clean_q = query.strip().replace("`", "")
+            direct = self._answer_fast_path(clean_q)
+            if direct is not None:
+                return direct
 
-            result = self.agent_executor.invoke({"input": clean_q})
-            
-            output = result.get("output", "")
-            if "For troubleshooting, visit:" in output:
-                output = output.split("For troubleshooting, visit:")[0].strip()
-            
-            steps = result.get("intermediate_steps", [])
-            
-            if self._rag_docs:
-                structured_contexts = self._build_structured_contexts()
-            else:
-                for action, observation in steps:
-                    obs_str = str(observation)
-                    if observation and len(obs_str) > 20:
-                        if obs_str.startswith("Lỗi:") or "Could not parse LLM output" in obs_str or "For troubleshooting, visit:" in obs_str:
-                            continue
-                        structured_contexts.append({
-                            "content":    obs_str,
-                            "source":     "",
-                            "page_title": "",
-                        })
-            
-            if not output or "Agent stopped" in output or "iteration limit" in output:
-                for action, observation in reversed(steps):
-                    obs_str = str(observation)
-                    if observation and len(obs_str) > 50:
-                        if "For troubleshooting, visit:" in obs_str or "Could not parse LLM output" in obs_str:
-                            continue
-                        if obs_str.startswith("Lỗi:"):
-                            continue
-                        return obs_str, structured_contexts
-            
-            return (output if output else "Không tìm thấy thông tin."), structured_contexts
+            _count_path("react")
+            rag_docs = []
+            token = _captured_rag_docs.set(rag_docs)
+            try:
+                with perf.stage("react"):
+                    result = self.agent_executor.invoke({"input": clean_q})
+            finally:
+                _captured_rag_docs.reset(token)
+            return self._react_output(result, rag_docs)
+        except Exception as e:
+            return f"Agent Error: {str(e)}", []
+
+    async def aanswer_with_context(self, query, prefetch=None):
+        """Như answer_with_context: fast path chạy trên executor dùng chung, ReAct qua ainvoke.
+        prefetch: speculative.Prefetch; kết quả retrieval đã prefetch được dùng cho Direct RAG."""
+        try:
+            clean_q = query.strip().replace("`", "")
+            retrieved = None
+            if prefetch is not None and self._takes_direct_rag(clean_q):
+                retrieved = await prefetch.take(self.vector_db_folder, clean_q)
+            direct = await to_thread(self._answer_fast_path, clean_q, retrieved)
+            if direct is not None:
+                return direct
+
+            _count_path("react")
+            rag_docs = []
+            token = _captured_rag_docs.set(rag_docs)
+            try:
+                with perf.stage("react"):
+                    result = await self.agent_executor.ainvoke({"input": clean_q})
+            finally:
+                _captured_rag_docs.reset(token)
+            return self._react_output(result, rag_docs)
         except Exception as e:
-            return f"Agent Error: {str(e)}", structured_contexts
+            return f"Agent Error: {str(e)}", []
         
 def get_agents():
     return {
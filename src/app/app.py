@@ -5,6 +5,7 @@ import time
 import json
 import sqlite3
 import base64
+import uuid
 from datetime import datetime
 from auth import (
     init_db, login_user, register_user,
@@ -25,7 +26,7 @@ try:
         process_query_streaming,
         process_query_compare,
         get_available_providers,
-        clear_cache,
+        drop_session_cache,
         PROVIDER_LABELS,
         PROVIDER_META,
     )
@@ -442,6 +443,14 @@ if 'current_conversation_id' not in st.session_state:
     st.session_state.current_conversation_id = None
 if 'conversation_list' not in st.session_state:
     st.session_state.conversation_list = []
+if 'cache_session_id' not in st.session_state:
+    st.session_state.cache_session_id = uuid.uuid4().hex
+
+
+def reset_session_cache():
+    """Bỏ cache của đoạn chat hiện tại (không ảnh hưởng người dùng khác) và mở namespace mới."""
+    drop_session_cache(st.session_state.cache_session_id)
+    st.session_state.cache_session_id = uuid.uuid4().hex
 
 if 'last_feedback_idx' not in st.session_state:
     st.session_state.last_feedback_idx = -1
@@ -491,7 +500,7 @@ with st.sidebar:
 
         if st.button("Đoạn chat mới", key="new_conv_btn",
                      use_container_width=True, type="primary"):
-            clear_cache()
+            reset_session_cache()
             st.session_state.current_conversation_id = None
             st.session_state.messages = []
             st.session_state.current_page = 'chatbot'
@@ -519,7 +528,7 @@ with st.sidebar:
                         use_container_width=True,
                         type="primary" if is_active else "secondary",
                     ):
-                        clear_cache()
+                        reset_session_cache()
                         st.session_state.current_conversation_id = conv['id']
                         st.session_state.messages = load_messages(conv['id'])
                         st.session_state.current_page = 'chatbot'
@@ -549,7 +558,7 @@ with st.sidebar:
                         if st.button(" Xóa", key=f"del_conv_{conv['id']}", use_container_width=True):
                             delete_conversation(conv['id'])
                             if is_active:
-                                clear_cache()
+                                reset_session_cache()
                                 st.session_state.current_conversation_id = None
                                 st.session_state.messages = []
                             st.session_state.conversation_list = get_conversations(
@@ -601,7 +610,7 @@ with st.sidebar:
 
     if st.session_state.logged_in:
         if st.button("Đăng xuất", key="logout_btn", use_container_width=True):
-            clear_cache()
+            reset_session_cache()
             st.session_state.logged_in = False
             st.session_state.user_info = None
             st.session_state.current_conversation_id = None
@@ -959,7 +968,9 @@ def render_chatbot_page():
                 unsafe_allow_html=True
             )
 
-            early_response, contexts, stream = process_query_streaming(pending, provider, chat_history=chat_history)
+            early_response, contexts, stream = process_query_streaming(
+                pending, provider, chat_history=chat_history, session_id=st.session_state.cache_session_id
+            )
 
             if early_response is not None:
                 typing_slot.empty()
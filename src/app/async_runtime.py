@@ -0,0 +1,72 @@
+"""
+Process-wide asyncio runtime for the query pipeline.
+
+- One bounded ThreadPoolExecutor (PIPELINE_WORKERS, default 8) for blocking
+  work: Chroma queries, PhoBERT, E5, SQLite. It is also the event loop's
+  default executor, so LangChain's sync fallbacks land in the same pool.
+- One background event loop thread. Synchronous callers (Streamlit, scripts)
+  submit coroutines to it with run_sync() / iterate_sync() instead of
+  creating a loop or a thread per request.
+
+Context variables (perf traces, embedding request stats) are copied from the
+caller into every coroutine and executor job, so instrumentation behaves as in
+the synchronous code.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_WORKERS = int(os.getenv("PIPELINE_WORKERS", "8"))
+
+executor = ThreadPoolExecutor(max_workers=_WORKERS, thread_name_prefix="pipeline")
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(executor)
+            threading.Thread(target=loop.run_forever, name="pipeline-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+async def to_thread(fn, *args, **kwargs):
+    """Chạy hàm blocking trên executor dùng chung, giữ nguyên contextvars."""
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def _in_context(items, awaitable):
+    for var, value in items:
+        var.set(value)
+    return await awaitable
+
+
+def run_sync(coro):
+    """Chạy coroutine trên loop nền và chờ kết quả (gọi từ code đồng bộ)."""
+    items = list(contextvars.copy_context().items())
+    return asyncio.run_coroutine_threadsafe(_in_context(items, coro), get_loop()).result()
+
+
+def iterate_sync(agen):
+    """Biến async generator thành generator đồng bộ (mỗi phần tử lấy qua loop nền)."""
+    items = list(contextvars.copy_context().items())
+    loop = get_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(_in_context(items, agen.__anext__()), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
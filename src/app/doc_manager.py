@@ -2,10 +2,9 @@
 import io
 import os
 import sys
+import uuid
 from collections import defaultdict
 
-import chromadb
-from langchain_chroma import Chroma
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 _THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,7 +12,10 @@ _ROOT_DIR = os.path.dirname(os.path.dirname(_THIS_DIR))
 if _THIS_DIR not in sys.path:
     sys.path.insert(0, _THIS_DIR)
 
-from embeddings import get_shared_embedding_model
+from embeddings import get_ingestion_embedding_model
+from vector_store_pool import get_store_pool
+from lexical_index import build_index_from_collection
+import store_versions
 
 PROCESSED_DIR = os.path.join(_ROOT_DIR, 'data', 'processed')
 
@@ -40,12 +42,19 @@ def _get_raw_collection(db_key: str):
     """Trả về raw chromadb Collection (tạo mới nếu chưa có)."""
     db_path = STORES[db_key]
     os.makedirs(db_path, exist_ok=True)
-    client = chromadb.PersistentClient(path=db_path)
+    client = get_store_pool().get_client(db_path)
     return client.get_or_create_collection(
         name="langchain",
         metadata={"hnsw:space": "cosine"},
     )
 
+def _refresh_lexical_index(db_key: str):
+    """Dựng lại sidecar BM25 sau mỗi lần thêm/xoá để hybrid retrieval thấy dữ liệu mới."""
+    try:
+        build_index_from_collection(STORES[db_key], _get_raw_collection(db_key))
+    except Exception as e:
+        print(f"[Lexical] Không thể cập nhật index {db_key}: {e}")
+
 def list_sources(db_key: str) -> list:
 
     col = _get_raw_collection(db_key)
@@ -68,15 +77,17 @@ def list_sources(db_key: str) -> list:
 def add_texts(texts: list, metadatas: list, db_key: str) -> int:
     db_path = STORES[db_key]
     os.makedirs(db_path, exist_ok=True)
-    emb = get_shared_embedding_model()
-    client = chromadb.PersistentClient(path=db_path)
-    db = Chroma(
-        client=client,
-        embedding_function=emb,
-        collection_name="langchain",
-        collection_metadata={"hnsw:space": "cosine"},
+    emb = get_ingestion_embedding_model()
+    col = _get_raw_collection(db_key)
+    col.add(
+        ids=[str(uuid.uuid4()) for _ in texts],
+        embeddings=emb.embed_documents(texts),
+        documents=texts,
+        metadatas=metadatas,
     )
-    db.add_texts(texts=texts, metadatas=metadatas)
+    get_store_pool().mark_written(db_path)
+    _refresh_lexical_index(db_key)
+    store_versions.bump(db_path)  # sau khi BM25 đã thấy dữ liệu mới
     return len(texts)
 
 
@@ -133,6 +144,9 @@ def delete_source(source_value: str, db_key: str) -> int:
     ids = results["ids"]
     if ids:
         col.delete(ids=ids)
+        get_store_pool().mark_written(STORES[db_key])
+        _refresh_lexical_index(db_key)
+        store_versions.bump(STORES[db_key])
     return len(ids)
 
 
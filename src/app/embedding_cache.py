@@ -0,0 +1,168 @@
+"""
+Content-addressed on-disk cache of passage embeddings.
+
+Key: sha256(model id, prefix, text). Vectors are appended to one flat binary
+file (float32 or float16) and read back through a numpy memmap; a small SQLite
+table maps key -> row. SQLite's write lock (BEGIN IMMEDIATE) serialises
+appends, so several ingestion processes can share one cache directory.
+
+CachedEmbeddings wraps any LangChain Embeddings so every ingestion path
+(build_specialized_dbs, process_stdportal_jsonl, embed_data, doc_manager)
+reads through the cache and only runs the model for unseen text.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_SQL_BATCH = 500
+
+
+def make_key(model_id: str, prefix: str, text: str) -> str:
+    return hashlib.sha256(f"{model_id}\0{prefix}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+
+    def __init__(self, cache_dir: str, dtype: str = "float32"):
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db_path = os.path.join(cache_dir, "index.sqlite3")
+        self._vec_path = os.path.join(cache_dir, "vectors.bin")
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._mmap_rows = 0
+
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO meta VALUES ('dtype', ?)", (dtype,))
+        conn.commit()
+        meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+        conn.close()
+        # dtype của cache đã tồn tại được ưu tiên hơn tham số.
+        self.dtype = np.dtype(meta["dtype"])
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+
+    def _rows(self):
+        if self.dim is None or not os.path.exists(self._vec_path):
+            return None
+        row_bytes = self.dim * self.dtype.itemsize
+        n_rows = os.path.getsize(self._vec_path) // row_bytes
+        if self._mmap is None or n_rows > self._mmap_rows:
+            self._mmap = np.memmap(self._vec_path, dtype=self.dtype, mode="r", shape=(n_rows, self.dim))
+            self._mmap_rows = n_rows
+        return self._mmap
+
+    def get_many(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        conn = self._connect()
+        try:
+            if self.dim is None:
+                row = conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+                if row is None:
+                    return {}
+                self.dim = int(row[0])
+            found = {}
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                marks = ",".join("?" * len(batch))
+                found.update(conn.execute(f"SELECT key, row FROM vectors WHERE key IN ({marks})", batch).fetchall())
+        finally:
+            conn.close()
+        if not found:
+            return {}
+        with self._lock:
+            rows = self._rows()
+            return {
+                key: np.array(rows[row], dtype=np.float32)
+                for key, row in found.items() if rows is not None and row < rows.shape[0]
+            }
+
+    def put_many(self, keys: list, vectors: list):
+        if not keys:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+            if row is None:
+                conn.execute("INSERT INTO meta VALUES ('dim', ?)", (str(matrix.shape[1]),))
+                self.dim = matrix.shape[1]
+            else:
+                self.dim = int(row[0])
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {matrix.shape[1]} khác dim của cache ({self.dim})")
+
+            present = set()
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                marks = ",".join("?" * len(batch))
+                present.update(k for (k,) in conn.execute(f"SELECT key FROM vectors WHERE key IN ({marks})", batch))
+            new = [(k, v) for k, v in zip(keys, matrix) if k not in present]
+            if new:
+                next_row = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM vectors").fetchone()[0]
+                row_bytes = self.dim * self.dtype.itemsize
+                mode = "r+b" if os.path.exists(self._vec_path) else "wb"
+                with open(self._vec_path, mode) as f:
+                    f.seek(next_row * row_bytes)
+                    f.write(np.stack([v for _, v in new]).astype(self.dtype).tobytes())
+                conn.executemany(
+                    "INSERT INTO vectors VALUES (?, ?)",
+                    [(k, next_row + i) for i, (k, _) in enumerate(new)],
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Đọc embedding passage qua EmbeddingCache. `model_factory` chỉ được gọi khi
+    thực sự có text chưa cache → rebuild không đổi gì thì không cần load model.
+    """
+
+    def __init__(self, model_factory, model_id: str, prefix: str, cache: EmbeddingCache):
+        self._model_factory = model_factory
+        self._model = None
+        self.model_id = model_id
+        self.prefix = prefix
+        self.cache = cache
+        self.stats = {"cached": 0, "computed": 0}
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self._model_factory()
+        return self._model
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [make_key(self.model_id, self.prefix, t) for t in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.model.embed_documents(list(missing.values()))
+            self.cache.put_many(list(missing.keys()), vectors)
+            found.update(zip(missing.keys(), (np.asarray(v, dtype=np.float32) for v in vectors)))
+
+        self.stats["computed"] += len(missing)
+        self.stats["cached"] += len(texts) - len(missing)
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        return self.model.embed_query(text)
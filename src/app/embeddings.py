@@ -5,24 +5,274 @@ E5 (intfloat/multilingual-e5-base) requires mandatory prefixes:
   - 'passage: ' when indexing documents (embed_documents)
   - 'query: '   when searching (embed_query)
 Skipping the prefix degrades retrieval accuracy by ~5-10%.
+
+Models are loaded lazily through a process-wide registry keyed by
+(model name, device, normalization), so only one copy of the weights lives in
+the process no matter how many modules ask for it.
+
+Ingestion paths use get_ingestion_embedding_model(), which reads passage
+embeddings through the on-disk EmbeddingCache (embedding_cache.py) and only
+loads/runs the model for text that has never been embedded.
+
+Query embeddings go through a process-level LRU keyed by the normalized query
+text, so the same question is embedded once per request (cache lookup, cache
+store and retrieval all reuse the vector) and once across repeated requests.
+
+EMBEDDING_BACKEND selects the encoder: torch (sentence-transformers, default),
+onnx or onnx-int8 (ONNX Runtime on files written by
+data_processing/export_e5_onnx.py). Prefixing and caching are identical for
+every backend.
 """
 
+import abc
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+DEFAULT_MODEL_NAME = "intfloat/multilingual-e5-base"
+_DEFAULT_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+_DEFAULT_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_FILES = {"onnx": "model.onnx", "onnx-int8": "model.int8.onnx"}
+_ONNX_BATCH_SIZE = 32
+_ONNX_MAX_LENGTH = 512
+
+_registry = {}
+_registry_info = {}
+_registry_lock = threading.Lock()
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(_BASE_DIR, "data", "models", "e5_onnx"))
+EMBEDDING_CACHE_DIR = os.getenv(
+    "EMBEDDING_CACHE_DIR", os.path.join(_BASE_DIR, "data", "processed", "embedding_cache")
+)
+_EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")
+_embedding_cache = None
+_ingestion_models = {}
+
+_QUERY_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+_query_cache_stats = {"hits": 0, "misses": 0}
+_request_stats = ContextVar("embedding_request_stats", default=None)
+
+
+def normalize_query_text(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _record(hit: bool):
+    with _query_cache_lock:
+        _query_cache_stats["hits" if hit else "misses"] += 1
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["reused" if hit else "embedded"] += 1
 
-class E5Embeddings(HuggingFaceEmbeddings):
+
+class _E5Prefixing(abc.ABC):
+    """Prefix 'passage: ' / 'query: ' và LRU query, dùng chung cho mọi backend; lớp con cài _encode."""
+
+    @abc.abstractmethod
+    def _encode(self, texts: list) -> list:
+        """Embed danh sách text đã có prefix."""
+
+    def _cache_id(self) -> str:
+        return self.model_name
 
     def embed_documents(self, texts: list) -> list:
-        prefixed = [f"passage: {t}" for t in texts]
-        return super().embed_documents(prefixed)
+        return self._encode([f"passage: {t}" for t in texts])
 
     def embed_query(self, text: str) -> list:
-        return super().embed_query(f"query: {text}")
+        normalized = normalize_query_text(text)
+        key = (self._cache_id(), normalized)
+        with _query_cache_lock:
+            cached = _query_cache.get(key)
+            if cached is not None:
+                _query_cache.move_to_end(key)
+        if cached is not None:
+            _record(hit=True)
+            return list(cached)
+
+        vector = self._encode([f"query: {normalized}"])[0]
+        with _query_cache_lock:
+            _query_cache[key] = tuple(vector)
+            while len(_query_cache) > _QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+        _record(hit=False)
+        return vector
+
+    def embed_queries(self, texts: list) -> list:
+        """Embed nhiều câu hỏi 1 lượt (prefix 'query: '), không qua LRU — dùng cho dựng index offline."""
+        return self._encode([f"query: {normalize_query_text(t)}" for t in texts])
+
+
+class E5Embeddings(_E5Prefixing, HuggingFaceEmbeddings):
+
+    def _encode(self, texts: list) -> list:
+        return HuggingFaceEmbeddings.embed_documents(self, texts)
+
+
+class OnnxE5Embeddings(_E5Prefixing, Embeddings):
+    """E5 chạy bằng ONNX Runtime (fp32 hoặc int8), mean pooling như sentence-transformers."""
+
+    def __init__(self, model_name: str, onnx_path: str, normalize: bool = True, backend: str = "onnx"):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        self.model_name = model_name
+        self.backend = backend
+        self.normalize = normalize
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(onnx_path))
+        self.session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    def _cache_id(self) -> str:
+        return f"{self.model_name}|{self.backend}"
+
+    def _encode(self, texts: list) -> list:
+        vectors = []
+        for start in range(0, len(texts), _ONNX_BATCH_SIZE):
+            batch = self.tokenizer(texts[start:start + _ONNX_BATCH_SIZE], padding=True, truncation=True,
+                                   max_length=_ONNX_MAX_LENGTH, return_tensors="np")
+            feeds = {k: v.astype(np.int64) for k, v in batch.items() if k in self._inputs}
+            hidden = self.session.run(None, feeds)[0]
+            mask = batch["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if self.normalize:
+                pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+
+def onnx_model_path(model_name: str = DEFAULT_MODEL_NAME, backend: str = "onnx-int8") -> str:
+    return os.path.join(EMBEDDING_ONNX_DIR, model_name.replace("/", "__"), ONNX_FILES[backend])
+
+
+@contextmanager
+def embedding_request_context():
+    """Gom số lần embed / dùng lại vector query trong phạm vi một request."""
+    stats = {"embedded": 0, "reused": 0}
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+def query_embedding_cache_stats() -> dict:
+    with _query_cache_lock:
+        return {**_query_cache_stats, "entries": len(_query_cache), "capacity": _QUERY_CACHE_SIZE}
+
+
+def _resident_memory_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _resolve_backend(model_name: str, backend: str = None) -> str:
+    backend = backend or _DEFAULT_BACKEND
+    if backend != "torch" and not os.path.isfile(onnx_model_path(model_name, backend)):
+        print(f"[Embedding] Không tìm thấy {onnx_model_path(model_name, backend)}"
+              f" (chạy export_e5_onnx.py). Dùng backend torch.")
+        return "torch"
+    return backend
+
+
+def get_embedding_model(model_name: str = DEFAULT_MODEL_NAME, device: str = None,
+                        normalize: bool = True, backend: str = None):
+    """Trả về model dùng chung trong process; chỉ load lần đầu tiên được yêu cầu."""
+    key = (model_name, device or _DEFAULT_DEVICE, normalize, backend or _DEFAULT_BACKEND)
+    model = _registry.get(key)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        model = _registry.get(key)
+        if model is not None:
+            return model
+        mem_before = _resident_memory_mb()
+        t0 = time.perf_counter()
+        resolved = _resolve_backend(model_name, key[3])
+        if resolved == "torch":
+            model = E5Embeddings(
+                model_name=key[0],
+                model_kwargs={"device": key[1]},
+                encode_kwargs={"normalize_embeddings": key[2]},
+            )
+        else:
+            model = OnnxE5Embeddings(key[0], onnx_model_path(key[0], resolved), normalize=key[2], backend=resolved)
+        load_seconds = time.perf_counter() - t0
+        mem_after = _resident_memory_mb()
+        info = {"load_seconds": round(load_seconds, 2), "rss_mb": mem_after, "backend": resolved}
+        if mem_before is not None and mem_after is not None:
+            info["rss_delta_mb"] = round(mem_after - mem_before, 1)
+        _registry[key] = model
+        _registry_info[key] = info
+        mem_str = f", +{info['rss_delta_mb']:.0f} MB RSS" if "rss_delta_mb" in info else ""
+        print(f"[Embedding] Đã tải {key[0]} ({resolved}, {key[1]}) trong {load_seconds:.1f}s{mem_str}")
+        return model
+
+
+def embedding_registry_stats() -> dict:
+    with _registry_lock:
+        return {f"{name}|{device}|norm={norm}|{backend}": dict(info)
+                for (name, device, norm, backend), info in _registry_info.items()}
+
+
+def get_shared_embedding_model():
+    return get_embedding_model()
+
+
+def query_embedding_id(model) -> str:
+    """Định danh không gian vector query của model (khác nhau giữa các backend) — khoá cho cache lưu vector."""
+    return model._cache_id()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    with _registry_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, _EMBEDDING_CACHE_DTYPE)
+        return _embedding_cache
+
+
+def with_embedding_cache(model_factory, model_id: str, prefix: str = "") -> CachedEmbeddings:
+    """Bọc một Embeddings bất kỳ (vd. MiniLM trong embed_data.py) bằng cache trên đĩa."""
+    return CachedEmbeddings(model_factory, model_id, prefix, get_embedding_cache())
 
 
-def get_shared_embedding_model() -> E5Embeddings:
-    return E5Embeddings(
-        model_name="intfloat/multilingual-e5-base",
-        model_kwargs={"device": "cpu"},
-        encode_kwargs={"normalize_embeddings": True},
-    )
+def get_ingestion_embedding_model(model_name: str = DEFAULT_MODEL_NAME, device: str = None,
+                                  normalize: bool = True, backend: str = None) -> CachedEmbeddings:
+    """E5 cho các luồng nạp dữ liệu: embedding passage đọc qua cache, model chỉ load khi cần."""
+    backend = _resolve_backend(model_name, backend)
+    key = (model_name, normalize, backend)
+    model = _ingestion_models.get(key)
+    if model is None:
+        # Vector ONNX lệch nhẹ so với torch → khoá cache riêng; torch giữ model_id cũ.
+        suffix = "" if backend == "torch" else f"|{backend}"
+        model = with_embedding_cache(
+            lambda: get_embedding_model(model_name, device, normalize, backend),
+            model_id=f"{model_name}|norm={normalize}{suffix}",
+            prefix="passage: ",
+        )
+        _ingestion_models[key] = model
+    return model
@@ -1,43 +1,149 @@
-import torch
 import os
 import json
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch.nn.functional as F
-from underthesea import word_tokenize
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from transformers import AutoTokenizer
+from segmentation import segment_batch
 
 os.environ["PYTORCH_ALLOW_INSECURE_LOAD"] = "1"
 
+# INTENT_BACKEND: torch (PyTorch fp32) | onnx (ONNX Runtime fp32) | onnx-int8 (dynamic int8)
+# File ONNX do model_training/export_onnx.py sinh ra trong <model_path>/onnx/.
+_BACKEND = os.getenv("INTENT_BACKEND", "torch")
+ONNX_DIRNAME = "onnx"
+ONNX_FILES = {"onnx": "model.onnx", "onnx-int8": "model.int8.onnx"}
+
+_MAX_LENGTH = 128
+_BATCH_SIZE = int(os.getenv("INTENT_BATCH_SIZE", "32"))
+# Micro-batching: gom các predict() đồng thời (nhiều session Streamlit) trong vài ms
+# rồi chạy chung một forward pass.
+_MICRO_BATCH_ENABLED = os.getenv("INTENT_MICRO_BATCH", "0") == "1"
+_MICRO_BATCH_WAIT_MS = float(os.getenv("INTENT_MICRO_BATCH_WAIT_MS", "5"))
+
+
 class IntentClassifier:
-    def __init__(self, model_path):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"--- Đang tải Model Phân loại lên {self.device.upper()}... ---")
-        
+    def __init__(self, model_path, micro_batch=None, backend=None):
+        self.backend = backend or _BACKEND
+        onnx_path = os.path.join(model_path, ONNX_DIRNAME, ONNX_FILES.get(self.backend, ""))
+        if self.backend != "torch" and not os.path.isfile(onnx_path):
+            print(f"Không tìm thấy {onnx_path} (chạy export_onnx.py). Dùng backend torch.")
+            self.backend = "torch"
+
         try:
+            t0 = time.perf_counter()
             self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-            self.model = AutoModelForSequenceClassification.from_pretrained(model_path)
-            self.model.to(self.device)
-            self.model.eval()
-            
+            if self.backend == "torch":
+                self._load_torch(model_path)
+            else:
+                self._load_onnx(onnx_path)
+            print(f"--- Model Phân loại: backend {self.backend} trên {self.device.upper()}"
+                  f" ({time.perf_counter() - t0:.1f}s) ---")
+
             with open(os.path.join(model_path, 'label_map.json'), 'r', encoding='utf-8') as f:
                 self.id2label = json.load(f)
                 self.id2label = {int(k): v for k, v in self.id2label.items()}
-                
+
             print("✅ Model Phân loại đã sẵn sàng.")
         except Exception as e:
             print(f"Lỗi tải model: {e}")
             raise e
 
+        use_batcher = _MICRO_BATCH_ENABLED if micro_batch is None else micro_batch
+        self._batcher = MicroBatcher(self.predict_batch, _BATCH_SIZE, _MICRO_BATCH_WAIT_MS) if use_batcher else None
+
+    def _load_torch(self, model_path):
+        import torch
+        from transformers import AutoModelForSequenceClassification
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        self.model.to(self.device)
+        self.model.eval()
+
+    def _load_onnx(self, onnx_path):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        threads = int(os.getenv("INTENT_ONNX_THREADS", "0"))
+        if threads:
+            options.intra_op_num_threads = threads
+        self.device = "cpu"
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self._onnx_inputs = {i.name for i in self.session.get_inputs()}
+
+    def _forward(self, batch_ids) -> np.ndarray:
+        """Xác suất softmax [batch, n_labels] cho một batch input_ids (pad động)."""
+        if self.backend == "torch":
+            import torch
+            inputs = self.tokenizer.pad({"input_ids": batch_ids}, return_tensors="pt")
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            with torch.inference_mode():
+                return torch.softmax(self.model(**inputs).logits, dim=-1).cpu().numpy()
+
+        inputs = self.tokenizer.pad({"input_ids": batch_ids}, return_tensors="np")
+        feeds = {k: v.astype(np.int64) for k, v in inputs.items() if k in self._onnx_inputs}
+        logits = self.session.run(None, feeds)[0]
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
     def predict(self, text):
-        text_segmented = word_tokenize(text, format="text")
-        
-        inputs = self.tokenizer(text_segmented, return_tensors="pt", truncation=True, max_length=128)
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            probs = F.softmax(outputs.logits, dim=-1)
-            confidence, predicted_id = torch.max(probs, dim=-1)
-
-        label = self.id2label[predicted_id.item()]
-        score = confidence.item() * 100
-        return label, score
\ No newline at end of file
+        if self._batcher is not None:
+            return self._batcher.submit(text).result()
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts, batch_size=_BATCH_SIZE):
+        """[(label, score%)] theo đúng thứ tự `texts`; padding theo câu dài nhất của từng batch."""
+        segmented = segment_batch(texts)
+        encoded = [self.tokenizer(s, truncation=True, max_length=_MAX_LENGTH)["input_ids"] for s in segmented]
+        # Sắp theo độ dài để các câu trong một batch dài gần bằng nhau → ít padding.
+        order = sorted(range(len(texts)), key=lambda i: len(encoded[i]))
+
+        results = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            probs = self._forward([encoded[i] for i in idx])
+            for i, label_id, score in zip(idx, probs.argmax(axis=-1).tolist(), probs.max(axis=-1).tolist()):
+                results[i] = (self.id2label[label_id], score * 100)
+        return results
+
+
+class MicroBatcher:
+    """Luồng nền gom request trong `wait_ms` (tối đa `max_batch`) rồi gọi `batch_fn` một lần."""
+
+    def __init__(self, batch_fn, max_batch=_BATCH_SIZE, wait_ms=_MICRO_BATCH_WAIT_MS):
+        self._batch_fn = batch_fn
+        self._max_batch = max_batch
+        self._wait = wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self.stats = {"batches": 0, "items": 0}
+        self._thread = threading.Thread(target=self._loop, name="intent-micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self._wait
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                results = self._batch_fn([text for text, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
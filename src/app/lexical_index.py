@@ -0,0 +1,206 @@
+"""
+BM25 sidecar index for the specialist vector stores.
+
+Dense E5 retrieval misses exact terms (regulation numbers, course codes,
+department emails). Each store therefore gets a small inverted index built at
+ingest time and stored next to the Chroma files in `<store>/lexical_index/`.
+Every build writes a new generation directory and then switches to it by
+atomically replacing the small pointer file `meta.json`:
+
+  meta.json              {"current": "<generation>", n_docs, avgdl, n_terms}
+  <generation>/
+    terms.json           sorted vocabulary
+    ids.json             Chroma ids, position = doc index
+    offsets.npy          int64 [V+1], postings range of each term
+    postings_docs.npy    int32 doc indices
+    postings_tf.npy      uint16 term frequencies
+    doc_len.npy          int32 tokens per doc
+
+A reader therefore always sees one complete generation, and files that are
+memory-mapped are never replaced in place (which fails on Windows). Each build
+keeps the newest _KEEP_GENERATIONS generations (by count, not by use) and
+removes older ones best-effort; a directory that is still open and cannot be
+deleted is left for a later build to retry.
+
+Tokens are Vietnamese syllables, lowercased, kept both with and without
+diacritics so that "học phí" and "hoc phi" hit the same postings.
+"""
+
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from text_normalize import fold_diacritics
+
+INDEX_DIRNAME = "lexical_index"
+
+_BM25_K1 = 1.5
+_BM25_B = 0.75
+_KEEP_GENERATIONS = 2                  # generation hiện tại + 1 cũ cho reader đang dở
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def tokenize(text: str) -> list:
+    syllables = _TOKEN_PATTERN.findall(unicodedata.normalize("NFC", text or "").lower())
+    folded = [fold_diacritics(s) for s in syllables]
+    return syllables + [f for s, f in zip(syllables, folded) if f != s]
+
+
+def build_index(store_dir: str, ids: list, texts: list):
+    """Ghi generation mới của index BM25 cho một store từ toàn bộ (id, text) của collection."""
+    root_dir = os.path.join(store_dir, INDEX_DIRNAME)
+    generation = f"g{time.time_ns()}-{os.getpid()}"
+    index_dir = os.path.join(root_dir, generation)
+    os.makedirs(index_dir)
+
+    postings = defaultdict(list)
+    doc_len = np.zeros(len(texts), dtype=np.int32)
+    for doc_idx, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        doc_len[doc_idx] = sum(counts.values())
+        for term, tf in counts.items():
+            postings[term].append((doc_idx, min(tf, 65535)))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, term in enumerate(terms):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    docs = np.empty(int(offsets[-1]), dtype=np.int32)
+    tfs = np.empty(int(offsets[-1]), dtype=np.uint16)
+    for i, term in enumerate(terms):
+        entries = postings[term]
+        docs[offsets[i]:offsets[i + 1]] = [d for d, _ in entries]
+        tfs[offsets[i]:offsets[i + 1]] = [tf for _, tf in entries]
+
+    def _save_json(path, obj):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+
+    _save_json(os.path.join(index_dir, "terms.json"), terms)
+    _save_json(os.path.join(index_dir, "ids.json"), list(ids))
+    np.save(os.path.join(index_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(index_dir, "postings_docs.npy"), docs)
+    np.save(os.path.join(index_dir, "postings_tf.npy"), tfs)
+    np.save(os.path.join(index_dir, "doc_len.npy"), doc_len)
+
+    avgdl = float(doc_len.mean()) if len(doc_len) else 0.0
+    meta = {"current": generation, "n_docs": len(texts), "avgdl": avgdl, "n_terms": len(terms)}
+    tmp = os.path.join(root_dir, f"meta.json.{generation}.tmp")
+    _save_json(tmp, meta)
+    _replace(tmp, os.path.join(root_dir, "meta.json"))
+    _prune_generations(root_dir, generation)
+
+
+def _replace(src: str, dst: str, attempts: int = 5):
+    # Trên Windows os.replace lỗi nếu reader đang mở dst đúng lúc đó → thử lại vài lần.
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+def _prune_generations(root_dir: str, current: str):
+    """Xoá generation cũ; thư mục còn bị mmap (Windows) thì để lần build sau xoá."""
+    generations = sorted(
+        (name for name in os.listdir(root_dir)
+         if name.startswith("g") and os.path.isdir(os.path.join(root_dir, name)) and name != current),
+        reverse=True,
+    )
+    for name in generations[_KEEP_GENERATIONS - 1:]:
+        shutil.rmtree(os.path.join(root_dir, name), ignore_errors=True)
+
+
+def build_index_from_collection(store_dir: str, collection):
+    """Dựng lại index từ raw chromadb Collection (dùng sau khi thêm/xoá tài liệu)."""
+    data = collection.get(include=["documents"])
+    build_index(store_dir, data["ids"], [d or "" for d in data["documents"]])
+
+
+class LexicalIndex:
+
+    def __init__(self, index_dir: str, meta: dict):
+        with open(os.path.join(index_dir, "terms.json"), encoding="utf-8") as f:
+            self._term_index = {t: i for i, t in enumerate(json.load(f))}
+        with open(os.path.join(index_dir, "ids.json"), encoding="utf-8") as f:
+            self.ids = json.load(f)
+        load = lambda name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+        self._offsets = load("offsets")
+        self._docs = load("postings_docs")
+        self._tfs = load("postings_tf")
+        self._doc_len = load("doc_len")
+        self.n_docs = meta["n_docs"]
+        self._avgdl = meta["avgdl"] or 1.0
+
+    def search(self, query: str, k: int = 5) -> list:
+        """
+        Trả về [(chroma_id, score, coverage)], coverage ∈ [0, 1] là tỉ lệ trọng số idf
+        của query được khớp (dùng để quyết định có tin kết quả lexical hay không).
+        """
+        if not self.n_docs:
+            return []
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        coverage = np.zeros(self.n_docs, dtype=np.float32)
+        total_idf = 0.0
+        for term in set(tokenize(query)):
+            idx = self._term_index.get(term)
+            if idx is None:
+                # Từ không có trong corpus vẫn tính vào mẫu số coverage.
+                total_idf += math.log(1 + (self.n_docs + 0.5) / 0.5)
+                continue
+            start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+            docs = self._docs[start:end]
+            tf = self._tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            total_idf += idf
+            norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * self._doc_len[docs] / self._avgdl)
+            scores[docs] += idf * tf * (_BM25_K1 + 1) / (tf + norm)
+            coverage[docs] += idf
+
+        k = min(k, self.n_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (self.ids[i], float(scores[i]), float(coverage[i] / total_idf) if total_idf else 0.0)
+            for i in top if scores[i] > 0
+        ]
+
+
+def load_index(store_dir: str):
+    """Index đã load (cache theo generation trong meta.json), hoặc None nếu store chưa có index."""
+    store_dir = os.path.abspath(store_dir)
+    root_dir = os.path.join(store_dir, INDEX_DIRNAME)
+    try:
+        with open(os.path.join(root_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Index dựng trước khi có generation: file nằm ngay trong lexical_index/.
+    generation = meta.get("current", "")
+    with _cache_lock:
+        cached = _cache.get(store_dir)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        index_dir = os.path.join(root_dir, generation) if generation else root_dir
+        try:
+            index = LexicalIndex(index_dir, meta)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[Lexical] Không đọc được index {index_dir}: {e}")
+            return None
+        _cache[store_dir] = (generation, index)
+        return index
@@ -0,0 +1,376 @@
+"""
+Single place where chat models are constructed.
+
+LLM_BACKEND selects the implementation:
+  - live (default): ChatGroq / ChatGoogleGenerativeAI as before
+  - fake: deterministic offline model (FakeChatModel) so benchmarks and
+    pipeline tests run without API keys or network. FAKE_LLM_LATENCY_MS adds
+    a fixed delay per call to approximate a remote model.
+  - record: call the live model and save every completion (with streamed
+    chunk timing) to the cassette at LLM_CASSETTE_PATH
+  - replay: serve completions from the cassette, no network. Latency follows
+    LLM_REPLAY_LATENCY: "recorded" (default), "0", or a fixed number of ms.
+    LLM_REPLAY_MISS=fake answers unseen prompts with FakeChatModel instead of
+    raising.
+
+Every model carries perf.llm_usage_callback so LLM calls and token counts
+show up in benchmark traces.
+
+Models are pooled: get_chat_model() returns one shared instance per
+(backend, provider, temperature), so the router, the synthesizer and the five
+agents reuse the same client. Groq models share one keep-alive httpx client
+pair (LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_KEEPALIVE_S), and warm_up() opens
+those connections at startup so TLS setup is not paid by the first request.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import perf
+from llm_cassette import Cassette, make_key
+from router_heuristics import guess_agents
+
+try:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    _GEMINI_AVAILABLE = True
+except ImportError:
+    _GEMINI_AVAILABLE = False
+
+PROVIDERS = ("groq_llama", "gemini")
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CASSETTE_PATH = os.getenv(
+    "LLM_CASSETTE_PATH", os.path.join(_ROOT_DIR, "data", "processed", "llm_cassette.sqlite3")
+)
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+_pool = {}
+_pool_lock = threading.Lock()
+_http = None
+_http_lock = threading.Lock()
+
+
+def get_backend() -> str:
+    return os.getenv("LLM_BACKEND", "live").lower()
+
+
+def gemini_available() -> bool:
+    """langchain_google_genai đã cài và có GOOGLE_API_KEY."""
+    return _GEMINI_AVAILABLE and bool(os.getenv("GOOGLE_API_KEY"))
+
+
+def _last_field(prompt: str, label: str) -> str:
+    idx = prompt.rfind(label)
+    rest = prompt[idx + len(label):].strip() if idx != -1 else ""
+    return rest.splitlines()[0].strip().strip('"') if rest else ""
+
+
+def _between(prompt: str, start: str, end: str) -> str:
+    i = prompt.rfind(start)
+    if i == -1:
+        return ""
+    j = prompt.find(end, i + len(start))
+    return prompt[i + len(start): j if j != -1 else None].strip()
+
+
+def fake_completion(prompt: str) -> str:
+    """Câu trả lời xác định theo loại prompt (rewrite+router / router / rewriter / ReAct / synthesizer)."""
+    if "JSON Response:" in prompt and "Follow-up Question:" in prompt:
+        question = _last_field(prompt, "Follow-up Question:")
+        agents = guess_agents(question) or ["GENERAL"]
+        return json.dumps({"standalone": question,
+                           "plan": [{"agent": a, "query": question} for a in agents[:2]]}, ensure_ascii=False)
+
+    if "JSON Response:" in prompt:
+        question = _last_field(prompt, "User Question:")
+        agents = guess_agents(question) or ["GENERAL"]
+        return json.dumps({"plan": [{"agent": a, "query": question} for a in agents[:2]]}, ensure_ascii=False)
+
+    if "Câu hỏi độc lập:" in prompt:
+        return _last_field(prompt, "Câu hỏi follow-up:")
+
+    if "Tool Names:" in prompt:
+        scratchpad = prompt[prompt.rfind("Question:"):]
+        observations = re.findall(r"Observation:\s*(.*?)(?:\nThought:|$)", scratchpad, re.DOTALL)
+        if observations:
+            return f"Thought: Đã có dữ liệu.\nFinal Answer: {observations[-1].strip()}"
+        question = _last_field(prompt, "Question:")
+        return f"Thought: Cần tra cứu quy định.\nAction: search_regulations\nAction Input: {question}"
+
+    if "Response (Vietnamese):" in prompt:
+        responses = _between(prompt, "Agent Responses:", "=== DATA PROCESSING RULES ===")
+        return responses or "Tôi chưa tìm thấy thông tin này trong dữ liệu của TDTU."
+
+    return ""
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text.split()))
+
+
+class FakeChatModel(BaseChatModel):
+    latency_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-tdtu"
+
+    def _prompt_text(self, messages) -> str:
+        return "\n".join(str(m.content) for m in messages)
+
+    def _respond(self, messages, stop=None) -> tuple:
+        prompt = self._prompt_text(messages)
+        text = fake_completion(prompt)
+        for s in stop or []:
+            if s in text:
+                text = text[:text.index(s)]
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return prompt, text
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt, text = self._respond(messages, stop)
+        usage = {"prompt_tokens": _approx_tokens(prompt), "completion_tokens": _approx_tokens(text)}
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text))],
+            llm_output={"token_usage": usage},
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        _, text = self._respond(messages, stop)
+        for piece in re.findall(r"\S+\s*", text):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+
+def get_cassette() -> Cassette:
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(CASSETTE_PATH)
+        return _cassette
+
+
+def _message_usage(message) -> dict:
+    meta = getattr(message, "usage_metadata", None) or {}
+    if meta:
+        return {"prompt_tokens": meta.get("input_tokens", 0), "completion_tokens": meta.get("output_tokens", 0)}
+    return dict((getattr(message, "response_metadata", None) or {}).get("token_usage") or {})
+
+
+class CassetteChatModel(BaseChatModel):
+    """Ghi (inner != None) hoặc phát lại (inner == None) completion qua Cassette."""
+
+    provider: str
+    model_name: str
+    cassette: Any
+    inner: Optional[Any] = None
+    replay_latency: str = "recorded"
+    fallback: Optional[Any] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-record" if self.inner is not None else "cassette-replay"
+
+    def _key(self, messages, stop) -> tuple:
+        prompt = "\n".join(f"{m.type}: {m.content}" for m in messages)
+        return make_key(self.provider, self.model_name, prompt, stop), prompt
+
+    def _delay(self, recorded: float) -> float:
+        if self.replay_latency == "recorded":
+            return recorded
+        return float(self.replay_latency) / 1000.0
+
+    def _lookup(self, messages, stop):
+        key, _ = self._key(messages, stop)
+        entry = self.cassette.get(key)
+        if entry is None and self.fallback is None:
+            raise LookupError(f"Cassette không có completion cho prompt {key[:12]} ({self.provider})")
+        return entry
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.inner is not None:
+            key, prompt = self._key(messages, stop)
+            t0 = time.perf_counter()
+            message = self.inner.invoke(messages, stop=stop, **kwargs)
+            latency = time.perf_counter() - t0
+            usage = _message_usage(message)
+            self.cassette.put(key, self.provider, self.model_name, prompt, message.content,
+                              usage=usage, latency=latency)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=message.content))],
+                              llm_output={"token_usage": usage})
+
+        entry = self._lookup(messages, stop)
+        if entry is None:
+            return self.fallback._generate(messages, stop=stop, **kwargs)
+        time.sleep(self._delay(entry["latency"]))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=entry["completion"]))],
+                          llm_output={"token_usage": entry["usage"]})
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.inner is not None:
+            key, prompt = self._key(messages, stop)
+            chunks, parts = [], []
+            t0 = last = time.perf_counter()
+            for chunk in self.inner.stream(messages, stop=stop, **kwargs):
+                now = time.perf_counter()
+                chunks.append([now - last, chunk.content])
+                parts.append(chunk.content)
+                last = now
+                out = ChatGenerationChunk(message=AIMessageChunk(content=chunk.content))
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.content, chunk=out)
+                yield out
+            self.cassette.put(key, self.provider, self.model_name, prompt, "".join(parts),
+                              chunks=chunks, latency=time.perf_counter() - t0)
+            return
+
+        entry = self._lookup(messages, stop)
+        if entry is None:
+            yield from self.fallback._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return
+        chunks = entry["chunks"]
+        if not chunks:
+            # Bản ghi từ invoke: chia đều latency cho các từ.
+            pieces = re.findall(r"\S+\s*", entry["completion"]) or [entry["completion"]]
+            chunks = [[entry["latency"] / len(pieces), p] for p in pieces]
+        fixed = None if self.replay_latency == "recorded" else self._delay(0.0) / len(chunks)
+        for delay, text in chunks:
+            time.sleep(delay if fixed is None else fixed)
+            out = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=out)
+            yield out
+
+
+def _model_name(provider: str) -> str:
+    if provider == "groq_llama":
+        return os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+    return os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+
+
+def _groq_base_url() -> str:
+    return os.getenv("GROQ_API_BASE", "https://api.groq.com").rstrip("/")
+
+
+def _http_clients() -> tuple:
+    """(httpx.Client, httpx.AsyncClient) dùng chung, giữ kết nối keep-alive tới API."""
+    global _http
+    with _http_lock:
+        if _http is None:
+            import httpx
+            limits = httpx.Limits(
+                max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20")),
+                keepalive_expiry=float(os.getenv("LLM_HTTP_KEEPALIVE_S", "120")),
+            )
+            timeout = httpx.Timeout(float(os.getenv("LLM_HTTP_TIMEOUT_S", "60")), connect=10.0)
+            _http = (httpx.Client(limits=limits, timeout=timeout),
+                     httpx.AsyncClient(limits=limits, timeout=timeout))
+        return _http
+
+
+def _live_model(provider: str, temperature: float, callbacks=None):
+    if provider == "groq_llama":
+        from langchain_groq import ChatGroq
+        http_client, http_async_client = _http_clients()
+        return ChatGroq(
+            model=_model_name(provider),
+            api_key=os.getenv("API_KEY"),
+            temperature=temperature,
+            callbacks=callbacks,
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+
+    if not _GEMINI_AVAILABLE:
+        raise ImportError("langchain-google-genai chưa được cài. Chạy: pip install langchain-google-genai")
+    return ChatGoogleGenerativeAI(
+        model=_model_name(provider),
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        temperature=temperature,
+        callbacks=callbacks,
+    )
+
+
+def _fake_model(callbacks=None):
+    return FakeChatModel(latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "0")), callbacks=callbacks)
+
+
+def get_chat_model(provider: str = "groq_llama", temperature: float = 0):
+    """Chat model dùng chung theo provider ('groq_llama', 'gemini'), temperature và LLM_BACKEND."""
+    if provider not in PROVIDERS:
+        raise ValueError(f"Provider không hợp lệ: '{provider}'. Chọn: groq_llama, gemini")
+
+    key = (get_backend(), provider, temperature)
+    with _pool_lock:
+        model = _pool.get(key)
+        if model is None:
+            model = _pool[key] = _build_chat_model(*key)
+        return model
+
+
+def _build_chat_model(backend: str, provider: str, temperature: float):
+    callbacks = [perf.llm_usage_callback]
+    if backend == "fake":
+        return _fake_model(callbacks)
+    if backend == "record":
+        return CassetteChatModel(
+            provider=provider, model_name=_model_name(provider), cassette=get_cassette(),
+            inner=_live_model(provider, temperature), callbacks=callbacks,
+        )
+    if backend == "replay":
+        return CassetteChatModel(
+            provider=provider, model_name=_model_name(provider), cassette=get_cassette(),
+            replay_latency=os.getenv("LLM_REPLAY_LATENCY", "recorded"),
+            fallback=_fake_model() if os.getenv("LLM_REPLAY_MISS", "error") == "fake" else None,
+            callbacks=callbacks,
+        )
+    return _live_model(provider, temperature, callbacks)
+
+
+def _warm_groq():
+    url = f"{_groq_base_url()}/openai/v1/models"
+    headers = {"Authorization": f"Bearer {os.getenv('API_KEY', '')}"}
+    http_client, http_async_client = _http_clients()
+    http_client.get(url, headers=headers)
+
+    from async_runtime import run_sync
+    run_sync(http_async_client.get(url, headers=headers))  # client async gắn với loop nền của pipeline
+
+
+def warm_up(providers=PROVIDERS, background: bool = True):
+    """Dựng sẵn model và mở kết nối HTTP tới API (không tốn token); chỉ với backend live/record."""
+    if get_backend() not in ("live", "record"):
+        return
+
+    def run():
+        for provider in providers:
+            t0 = time.perf_counter()
+            try:
+                get_chat_model(provider)
+                if provider == "groq_llama":
+                    _warm_groq()
+                print(f"[LLM] Warm-up {provider}: {(time.perf_counter() - t0) * 1000:.0f} ms")
+            except Exception as e:
+                print(f"[LLM] Warm-up {provider} lỗi: {e}")
+
+    if background:
+        threading.Thread(target=run, name="llm-warmup", daemon=True).start()
+    else:
+        run()
@@ -0,0 +1,89 @@
+"""
+Record/replay store for LLM completions ("cassette").
+
+Key: sha256(provider, model, stop sequences, rendered prompt). Each entry keeps
+the completion, token usage, total latency and — for streamed calls — the
+chunk list with the delay before every chunk, so replay can reproduce both
+the answer and its timing. Stored in one SQLite file: several benchmark or
+load-test processes can record into the same cassette.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+
+def make_key(provider: str, model: str, prompt: str, stop=None) -> str:
+    payload = json.dumps([provider, model, list(stop or []), prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+        self._stats_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key        TEXT PRIMARY KEY,
+                provider   TEXT,
+                model      TEXT,
+                prompt     TEXT,
+                completion TEXT NOT NULL,
+                chunks     TEXT,
+                usage      TEXT,
+                latency    REAL
+            )""")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, key: str):
+        row = self._conn().execute(
+            "SELECT completion, chunks, usage, latency FROM completions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        completion, chunks, usage, latency = row
+        return {
+            "completion": completion,
+            "chunks": json.loads(chunks) if chunks else None,
+            "usage": json.loads(usage) if usage else {},
+            "latency": latency or 0.0,
+        }
+
+    def put(self, key: str, provider: str, model: str, prompt: str, completion: str,
+            chunks=None, usage=None, latency: float = 0.0):
+        conn = self._conn()
+        # Bản ghi streaming (có timing từng chunk) không bị bản ghi invoke ghi đè.
+        existing = conn.execute("SELECT chunks FROM completions WHERE key = ?", (key,)).fetchone()
+        if existing is not None and existing[0] and chunks is None:
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, provider, model, prompt, completion,
+             json.dumps(chunks, ensure_ascii=False) if chunks is not None else None,
+             json.dumps(usage or {}), latency),
+        )
+        conn.commit()
+        self._count("recorded")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM completions").fetchone()[0]
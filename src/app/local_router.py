@@ -0,0 +1,149 @@
+"""
+Local multi-label router: kNN over E5 query embeddings of labeled questions.
+
+Index (`data/processed/local_router/`, built by model_training/train_router.py):
+
+  vectors.npy   float32 [N, dim], L2-normalized "query: " embeddings
+  labels.npy    uint8   [N, len(AGENTS)], multi-hot agent labels
+  meta.json     agents order, sample count, sources (written last)
+
+A question is routed by similarity-weighted voting among its k nearest
+labeled questions. The result is trusted only when the nearest neighbour is
+close enough and the winning vote is clear; otherwise main.py falls back to
+the LLM router, whose decisions are logged (ROUTER_LOG_PATH, only with
+LLM_BACKEND=live) and fed back into the next index build.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+AGENTS = ("ACADEMIC", "FINANCIAL", "ADMISSION", "STUDENT_LIFE", "GENERAL")
+LABEL_ALIASES = {"STUDENT_AFFAIRS": "STUDENT_LIFE"}
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+INDEX_DIR = os.getenv("LOCAL_ROUTER_DIR", os.path.join(_BASE_DIR, "data", "processed", "local_router"))
+ROUTER_LOG_PATH = os.getenv("ROUTER_LOG_PATH", os.path.join(_BASE_DIR, "data", "processed", "router_log.jsonl"))
+
+_K = int(os.getenv("LOCAL_ROUTER_K", "7"))
+_MIN_SIMILARITY = float(os.getenv("LOCAL_ROUTER_MIN_SIM", "0.9"))
+_MIN_TOP_VOTE = float(os.getenv("LOCAL_ROUTER_MIN_VOTE", "0.6"))
+_MULTI_LABEL_VOTE = 0.35
+
+_cache = {}
+_cache_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+def normalize_labels(raw) -> list:
+    """'ACADEMIC, FINANCIAL' / ['STUDENT_AFFAIRS'] → danh sách agent hợp lệ (bỏ nhãn lạ)."""
+    if isinstance(raw, str):
+        raw = raw.split(",")
+    labels = []
+    for label in raw or []:
+        label = LABEL_ALIASES.get(label.strip().upper(), label.strip().upper())
+        if label in AGENTS and label not in labels:
+            labels.append(label)
+    return labels
+
+
+def build_index(index_dir: str, label_sets: list, vectors, sources: dict = None):
+    os.makedirs(index_dir, exist_ok=True)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    labels = np.zeros((len(label_sets), len(AGENTS)), dtype=np.uint8)
+    for i, label_set in enumerate(label_sets):
+        for label in label_set:
+            labels[i, AGENTS.index(label)] = 1
+    np.save(os.path.join(index_dir, "vectors.npy"), matrix)
+    np.save(os.path.join(index_dir, "labels.npy"), labels)
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"agents": list(AGENTS), "n": len(label_sets), "sources": sources or {}}, f, indent=2)
+
+
+class LocalRouter:
+
+    def __init__(self, vectors: np.ndarray, labels: np.ndarray, k: int = _K,
+                 min_similarity: float = _MIN_SIMILARITY, min_top_vote: float = _MIN_TOP_VOTE):
+        self.vectors = vectors
+        self.labels = labels.astype(np.float32)
+        self.k = min(k, len(vectors))
+        self.min_similarity = min_similarity
+        self.min_top_vote = min_top_vote
+
+    @classmethod
+    def load(cls, index_dir: str):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if tuple(meta["agents"]) != AGENTS:
+            raise ValueError(f"Thứ tự agent trong index khác AGENTS: {meta['agents']}")
+        return cls(np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r"),
+                   np.load(os.path.join(index_dir, "labels.npy")))
+
+    def predict(self, q_emb) -> tuple:
+        """(agents, độ tương đồng top-1, phiếu của agent mạnh nhất)."""
+        q = np.asarray(q_emb, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        sims = self.vectors @ q
+        top = np.argpartition(-sims, self.k - 1)[:self.k]
+        weights = np.maximum(sims[top], 0.0)
+        votes = (weights[:, None] * self.labels[top]).sum(axis=0) / max(float(weights.sum()), 1e-12)
+        order = np.argsort(-votes)
+        agents = [AGENTS[i] for i in order if votes[i] >= _MULTI_LABEL_VOTE]
+        return agents, float(sims[top].max()), float(votes[order[0]])
+
+    def is_confident(self, agents: list, similarity: float, vote: float) -> bool:
+        """False → cần hỏi LLM router."""
+        return bool(agents) and similarity >= self.min_similarity and vote >= self.min_top_vote
+
+
+def load_router(index_dir: str = INDEX_DIR):
+    """Router đã load (cache theo mtime của meta.json), hoặc None nếu chưa dựng index."""
+    try:
+        mtime = os.stat(os.path.join(index_dir, "meta.json")).st_mtime_ns
+    except OSError:
+        return None
+    with _cache_lock:
+        cached = _cache.get(index_dir)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            router = LocalRouter.load(index_dir)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[LocalRouter] Không đọc được index {index_dir}: {e}")
+            return None
+        _cache[index_dir] = (mtime, router)
+        return router
+
+
+def log_decision(question: str, agents: list, path: str = ROUTER_LOG_PATH):
+    """Ghi quyết định của LLM router để lần dựng index sau học thêm."""
+    if not agents:
+        return
+    line = json.dumps({"question": question, "agents": agents}, ensure_ascii=False)
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"[LocalRouter] Không ghi được log router: {e}")
+
+
+def read_decision_log(path: str = ROUTER_LOG_PATH) -> list:
+    """[(question, agents)] từ log; dòng hỏng bị bỏ qua."""
+    if not os.path.exists(path):
+        return []
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            agents = normalize_labels(record.get("agents"))
+            if record.get("question") and agents:
+                samples.append((record["question"], agents))
+    return samples
@@ -3,27 +3,33 @@ import json
 import sys
 import time
 import hashlib
+import re
+import sqlite3
+import asyncio
+import threading
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
-from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
-try:
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    _GEMINI_AVAILABLE = True
-except ImportError:
-    _GEMINI_AVAILABLE = False
-
-
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(project_root)
 
-from agents import get_agents, _SHARED_EMBEDDING_MODEL
+from agents import get_agents, get_fast_path_stats, retrieve_documents
+from student_lookup import has_student_record_intent
 from intent_classifier import IntentClassifier
+from semantic_cache import SemanticCache, PersistentCacheStore, AnswerCache, CacheNamespace, SessionCaches, exact_key
+from embeddings import (embedding_request_context, query_embedding_cache_stats, get_shared_embedding_model,
+                        query_embedding_id)
+from llm_backend import get_chat_model, warm_up, gemini_available, get_backend
+from local_router import load_router, log_decision
+from router_heuristics import needs_rewrite
+from async_runtime import to_thread, run_sync, iterate_sync
+import speculative
+import store_versions
+import perf
 
 load_dotenv()
 
@@ -39,62 +45,179 @@ except Exception as e:
     classifier = None  
 
 # Lớp 2: Groq Router
-llm_router = ChatGroq(
-    model=os.getenv("LLM_MODEL"),
-    api_key=os.getenv("API_KEY"),
-    temperature=0
-)
+llm_router = get_chat_model("groq_llama")
 
 specialist_agents = get_agents()
 print("Layer 2 sẵn sàng.")
 
+# Router cục bộ (kNN trên câu hỏi đã gán nhãn); LLM router chỉ dùng khi kNN không đủ tự tin.
+_LOCAL_ROUTER_ENABLED = os.getenv("LOCAL_ROUTER", "1") == "1"
+if _LOCAL_ROUTER_ENABLED and load_router() is None:
+    print("Router cục bộ chưa có index (chạy src/model_training/train_router.py). Dùng LLM router.")
+
 
-_CACHE_MAX_SIZE = 128
+# SEMANTIC_CACHE=0 tắt hẳn cache câu hỏi → agent responses (mọi tier, cả trong bộ nhớ).
+_SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "1") == "1"
+_CACHE_MAX_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "128"))
 _CACHE_SIMILARITY_THRESHOLD = 0.95  # cosine similarity >= 0.95 
-_cache_entries: list = []
-_cache_embedding_model = _SHARED_EMBEDDING_MODEL  
+_cache_embedding_model = get_shared_embedding_model()
+
+# Tier khớp chính xác (câu hỏi đã chuẩn hoá) được tra trước khi embed; SEMANTIC_CACHE_EXACT_FOLD=1 bỏ cả dấu.
+_CACHE_EXACT = os.getenv("SEMANTIC_CACHE_EXACT", "1") == "1"
+_CACHE_EXACT_FOLD = os.getenv("SEMANTIC_CACHE_EXACT_FOLD", "0") == "1"
+
+# Tier trên đĩa dùng chung giữa các process / lần khởi động lại (SEMANTIC_CACHE_PERSIST=0 để tắt).
+# Backend khác live (fake / record / replay) dùng thư mục con riêng: câu trả lời giả lập
+# hay phát lại từ cassette không bao giờ thành cache HIT của app thật.
+_CACHE_PERSIST = os.getenv("SEMANTIC_CACHE_PERSIST", "1") == "1"
+_CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR", os.path.join(project_root, "data", "processed", "semantic_cache"))
+if get_backend() != "live":
+    _CACHE_DIR = os.path.join(_CACHE_DIR, f"backend_{get_backend()}")
+_persistent_cache = None
+if _CACHE_PERSIST:
+    try:
+        _persistent_cache = PersistentCacheStore(
+            _CACHE_DIR,
+            model_id=query_embedding_id(_cache_embedding_model),
+            max_entries=int(os.getenv("SEMANTIC_CACHE_PERSIST_MAX", "10000")),
+        )
+    except (OSError, sqlite3.Error) as e:
+        print(f"Không mở được cache trên đĩa ({_CACHE_DIR}): {e}. Chỉ dùng cache trong bộ nhớ.")
+
+
+def _entry_is_current(payload: dict) -> bool:
+    """Entry còn hợp lệ nếu mọi store nó dựa vào chưa bị ghi kể từ lúc cache (upload/xoá/rebuild)."""
+    if store_versions.is_current(payload.get("versions")):
+        return True
+    perf.count("cache_stale")
+    print(f"   [Cache] Bỏ entry cũ (store đã đổi: {sorted(payload.get('versions') or {})})")
+    return False
+
+
+_semantic_cache = SemanticCache(
+    _CACHE_MAX_SIZE, _CACHE_SIMILARITY_THRESHOLD,
+    persistent=_persistent_cache,
+    sync_interval=float(os.getenv("SEMANTIC_CACHE_SYNC_S", "1.0")),
+    is_valid=_entry_is_current,
+)
+if _persistent_cache is not None:
+    print(f"Semantic cache: nạp {len(_semantic_cache)} entry từ đĩa.")
+
+# Tier câu trả lời cuối: (câu hỏi độc lập, provider, phiên bản prompt, LLM backend) → answer + contexts.
+_ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") == "1"
+_ANSWER_REPLAY_WORDS = int(os.getenv("ANSWER_REPLAY_WORDS", "3"))
+_ANSWER_REPLAY_DELAY_MS = float(os.getenv("ANSWER_REPLAY_DELAY_MS", "0"))
+try:
+    _answer_cache = AnswerCache(
+        int(os.getenv("ANSWER_CACHE_SIZE", "256")),
+        db_path=os.path.join(_CACHE_DIR, "answers.sqlite3") if _CACHE_PERSIST else None,
+        max_entries=int(os.getenv("SEMANTIC_CACHE_PERSIST_MAX", "10000")),
+        is_valid=_entry_is_current,
+    )
+except (OSError, sqlite3.Error) as e:
+    print(f"Không mở được answer cache trên đĩa: {e}. Chỉ dùng bộ nhớ.")
+    _answer_cache = AnswerCache(int(os.getenv("ANSWER_CACHE_SIZE", "256")), is_valid=_entry_is_current)
+
+# Namespace theo phiên cho câu hỏi phụ thuộc ngữ cảnh (chỉ trong bộ nhớ, capacity riêng mỗi phiên).
+_session_caches = SessionCaches(
+    capacity=int(os.getenv("SESSION_CACHE_SIZE", "32")),
+    threshold=_CACHE_SIMILARITY_THRESHOLD,
+    answer_capacity=int(os.getenv("SESSION_ANSWER_CACHE_SIZE", "32")),
+    max_sessions=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "512")),
+    is_valid=_entry_is_current,
+)
+
+
+def _embed_question(question: str) -> np.ndarray:
+    return np.array(_cache_embedding_model.embed_query(question), dtype=np.float32)
 
 
-def _cache_lookup(question: str):
-    if not _cache_entries:
+def _exact_lookup(question: str, namespace: CacheNamespace = None):
+    """Tier khớp chính xác: không cần E5 forward pass."""
+    if not _CACHE_EXACT:
         return None
+    key = exact_key(question, _CACHE_EXACT_FOLD)
+    for tier in (namespace.semantic if namespace else None, _semantic_cache):
+        entry = tier.lookup_exact(key) if tier is not None else None
+        if entry is not None:
+            perf.count("cache_exact_hit")
+            scope = "global" if tier is _semantic_cache else "phiên"
+            print(f"   Cache HIT [{scope}] (khớp chính xác)")
+            return entry["agent_responses"], entry["contexts"], entry.get("versions")
+    return None
 
-    q_emb = np.array(_cache_embedding_model.embed_query(question), dtype=np.float32)
 
-    best_score = -1.0
-    best_idx = -1
-    for i, entry in enumerate(_cache_entries):
-        score = float(np.dot(q_emb, entry["embedding"]))
-        if score > best_score:
-            best_score = score
-            best_idx = i
-
-    if best_score >= _CACHE_SIMILARITY_THRESHOLD:
-        entry = _cache_entries[best_idx]
-        _cache_entries.append(_cache_entries.pop(best_idx))
-        print(f"   Cache HIT (similarity: {best_score:.3f})")
-        return entry["agent_responses"], entry["contexts"]
+def _cache_lookup(question: str, q_emb: np.ndarray = None, namespace: CacheNamespace = None):
+    """Tra namespace của phiên (nếu có) rồi tới tier global."""
+    _semantic_cache.sync()
+    tiers = [t for t in (namespace.semantic if namespace else None, _semantic_cache) if t is not None and len(t)]
+    if not tiers:
+        perf.count("cache_miss")
+        return None
 
+    if q_emb is None:
+        q_emb = _embed_question(question)
+    best_score = -1.0
+    for tier in tiers:
+        entry, score = tier.lookup(q_emb)
+        if entry is not None:
+            perf.count("cache_hit")
+            scope = "global" if tier is _semantic_cache else "phiên"
+            print(f"   Cache HIT [{scope}] (similarity: {score:.3f})")
+            return entry["agent_responses"], entry["contexts"], entry.get("versions")
+        best_score = max(best_score, score)
+
+    perf.count("cache_miss")
     print(f"   Cache MISS (best similarity: {best_score:.3f})")
     return None
 
 
-def _cache_store(question: str, agent_responses: str, contexts: list):
-    q_emb = np.array(_cache_embedding_model.embed_query(question), dtype=np.float32)
-    _cache_entries.append({
-        "embedding":       q_emb,
+def _cache_store(question: str, agent_responses: str, contexts: list, q_emb: np.ndarray = None,
+                 tier: SemanticCache = None, versions: dict = None):
+    if not _SEMANTIC_CACHE_ENABLED:
+        return
+    if q_emb is None:
+        q_emb = _embed_question(question)
+    (tier or _semantic_cache).store(q_emb, {
         "agent_responses": agent_responses,
         "contexts":        contexts,
+        "versions":        versions,
+        "exact_key":       exact_key(question, _CACHE_EXACT_FOLD),
     })
-    while len(_cache_entries) > _CACHE_MAX_SIZE:
-        _cache_entries.pop(0)
 
 
-def clear_cache():
-    _cache_entries.clear()
+def clear_cache(persistent: bool = False):
+    """
+    Xoá mọi tier cache của process (ảnh hưởng tất cả người dùng); persistent=True xoá cả tier
+    trên đĩa. Kết thúc 1 đoạn chat thì dùng drop_session_cache.
+    """
+    _semantic_cache.clear(persistent=persistent)
+    _answer_cache.clear(persistent=persistent)
+    _session_caches.clear()
     print("   Cache đã xoá.")
 
-router_prompt = ChatPromptTemplate.from_template("""
+
+def drop_session_cache(session_id: str):
+    """Bỏ namespace cache của 1 phiên chat (new chat / đổi hội thoại / đăng xuất)."""
+    if _session_caches.drop(session_id):
+        print(f"   Cache phiên {session_id[:8]} đã xoá.")
+
+
+def _cache_scope(question: str, standalone: str, session_id: str = None) -> tuple:
+    """
+    (context_free, namespace của phiên). Câu hỏi độc lập, không chứa dữ liệu cá nhân → tier global;
+    câu đã rewrite theo lịch sử hoặc hỏi dữ liệu cá nhân → chỉ lưu trong namespace của phiên.
+    """
+    context_free = standalone.strip() == question.strip() and not has_student_record_intent(standalone)
+    return context_free, _session_caches.get(session_id)
+
+
+def _report_embedding_usage(stats: dict):
+    lru = query_embedding_cache_stats()
+    print(f"   [Embedding] request: {stats['embedded']} lần embed, {stats['reused']} lần dùng lại"
+          f" | LRU: {lru['hits']} hit / {lru['misses']} miss")
+
+_ROUTER_RULES = """
 You are an intelligent routing system for TDTU AI Assistant (Ton Duc Thang University - Đại học Tôn Đức Thắng).
 Your task: Analyze the user's question and route it to the most appropriate specialized agent(s).
 
@@ -231,7 +354,9 @@ Output:
   ]
 }}
 ```
+"""
 
+router_prompt = ChatPromptTemplate.from_template(_ROUTER_RULES + """
 === OUTPUT FORMAT ===
 
 **CRITICAL**: Return ONLY valid JSON. No markdown, no explanation.
@@ -265,6 +390,41 @@ Câu hỏi độc lập:""")
 
 question_rewriter_chain = question_rewriter_prompt | llm_router | StrOutputParser()
 
+# Rewrite + route trong 1 lần gọi LLM: câu hỏi độc lập và plan cho câu hỏi đó.
+rewrite_route_prompt = ChatPromptTemplate.from_template(_ROUTER_RULES + """
+=== CONVERSATION CONTEXT ===
+
+The user question is a follow-up in this conversation:
+{chat_history}
+
+Step 1: Rewrite the follow-up into a standalone Vietnamese question, replacing pronouns and unclear
+references (tôi, nó, đó, ngành học của tôi, điểm của tôi...) with concrete information from the history.
+If it is already clear, keep it verbatim.
+Step 2: Route the STANDALONE question using the rules above.
+
+=== OUTPUT FORMAT ===
+
+**CRITICAL**: Return ONLY valid JSON. No markdown, no explanation.
+
+Format:
+```json
+{{
+  "standalone": "standalone question",
+  "plan": [
+    {{"agent": "AGENT_NAME", "query": "specific question for this agent"}}
+  ]
+}}
+```
+
+Follow-up Question: {question}
+
+JSON Response:
+""")
+rewrite_route_chain = rewrite_route_prompt | llm_router | StrOutputParser()
+
+_COMBINED_REWRITE_ROUTE = os.getenv("COMBINED_REWRITE_ROUTE", "1") == "1"
+_REWRITE_PRECHECK = os.getenv("REWRITE_PRECHECK", "1") == "1"
+
 
 def _format_chat_history(chat_history: list) -> str:
     lines = []
@@ -274,25 +434,55 @@ def _format_chat_history(chat_history: list) -> str:
     return "\n".join(lines)
 
 
-def _rewrite_question(question: str, chat_history: list) -> str:
-    """Viết lại câu hỏi follow-up thành standalone nếu có lịch sử."""
+async def _arewrite_question(question: str, chat_history: list) -> tuple:
+    """
+    (câu hỏi độc lập, plan hoặc None). Không có lịch sử hoặc câu hỏi không chứa tham chiếu
+    → giữ nguyên, không gọi LLM. Chế độ gộp (COMBINED_REWRITE_ROUTE) trả về luôn plan để bỏ qua router.
+    """
     if not chat_history:
-        return question
+        return question, None
+    if _REWRITE_PRECHECK and not needs_rewrite(question):
+        perf.count("rewrite_skipped")
+        print("   [Rewrite] Bỏ qua (câu hỏi không có tham chiếu)")
+        return question, None
     history_str = _format_chat_history(chat_history)
+
+    if _COMBINED_REWRITE_ROUTE:
+        try:
+            with perf.stage("rewrite_route"):
+                output = await rewrite_route_chain.ainvoke({
+                    "chat_history": history_str,
+                    "question": question,
+                })
+            parsed = _parse_json_object(output)
+            rewritten = str(parsed.get("standalone") or "").strip() or question
+            steps = [
+                {"agent": s["agent"], "query": s.get("query") or rewritten}
+                for s in parsed.get("plan") or [] if isinstance(s, dict) and s.get("agent")
+            ]
+            if rewritten != question:
+                print(f"   [Rewrite+Route] '{question}' → '{rewritten}'")
+            if steps:
+                _log_route(rewritten, [s["agent"] for s in steps])
+            return rewritten, steps or None
+        except Exception as e:
+            print(f"   [Rewrite+Route] Lỗi: {e}. Rewrite riêng.")
+
     try:
-        rewritten = question_rewriter_chain.invoke({
-            "chat_history": history_str,
-            "question": question,
-        }).strip()
+        with perf.stage("rewrite"):
+            rewritten = (await question_rewriter_chain.ainvoke({
+                "chat_history": history_str,
+                "question": question,
+            })).strip()
         if rewritten and rewritten != question:
             print(f"   [Rewrite] '{question}' → '{rewritten}'")
-        return rewritten or question
+        return rewritten or question, None
     except Exception as e:
         print(f"   [Rewrite] Lỗi: {e}. Dùng câu hỏi gốc.")
-        return question
+        return question, None
 
 
-synthesizer_prompt = ChatPromptTemplate.from_template("""
+_SYNTHESIZER_TEMPLATE = """
 Bạn là Trợ lý ảo của Trường Đại học Tôn Đức Thắng (TDTU).
 NHIỆM VỤ: Đọc kết quả từ các agent và trả lời chính xác, thân thiện cho sinh viên.
 QUY TẮC BẮT BUỘC:
@@ -375,9 +565,23 @@ Before responding, verify:
 -  No hallucination (stick to provided data)
 
 Response (Vietnamese):
-""")
+"""
+synthesizer_prompt = ChatPromptTemplate.from_template(_SYNTHESIZER_TEMPLATE)
+# Sửa prompt → đổi phiên bản → câu trả lời cũ trong answer cache tự hết hiệu lực.
+SYNTHESIZER_PROMPT_VERSION = hashlib.sha256(_SYNTHESIZER_TEMPLATE.encode("utf-8")).hexdigest()[:12]
 
 synthesizer_chain = synthesizer_prompt | llm_router | StrOutputParser()
+_synthesizer_chains = {"groq_llama": synthesizer_chain}  # dựng 1 lần / provider, dùng chung model trong pool
+_synthesizer_lock = threading.Lock()
+
+
+def _synthesizer_chain(provider: str):
+    with _synthesizer_lock:
+        chain = _synthesizer_chains.get(provider)
+        if chain is None:
+            chain = _synthesizer_chains[provider] = synthesizer_prompt | get_llm(provider) | StrOutputParser()
+        return chain
+
 
 def deduplicate_contexts(contexts):
     if not contexts:
@@ -401,7 +605,7 @@ def deduplicate_contexts(contexts):
     return unique_contexts
 
 
-def _parse_plan(router_output: str) -> list:
+def _parse_json_object(router_output: str) -> dict:
     json_start = router_output.find('{')
     if json_start == -1:
         raise ValueError("Không tìm thấy JSON trong output của router")
@@ -415,13 +619,51 @@ def _parse_plan(router_output: str) -> list:
             if depth == 0:
                 json_end = i + 1
                 break
-    plan = json.loads(router_output[json_start:json_end])
-    return plan.get("plan", [])
+    return json.loads(router_output[json_start:json_end])
+
+
+def _parse_plan(router_output: str) -> list:
+    return _parse_json_object(router_output).get("plan", [])
+
+
+def _log_route(question: str, agents: list):
+    """Chỉ ghi quyết định của LLM thật: nhãn từ fake/replay sẽ dạy lại router bằng heuristic."""
+    if get_backend() == "live":
+        log_decision(question, agents)
+
+
+def _local_route(question: str) -> tuple:
+    """(plan cùng định dạng router_chain hoặc None nếu cần LLM router, agent kNN dự đoán)."""
+    if not _LOCAL_ROUTER_ENABLED:
+        return None, []
+    router = load_router()
+    if router is None:
+        return None, []
+    with perf.stage("router_local"):
+        agents, similarity, vote = router.predict(_embed_question(question))
+    if not router.is_confident(agents, similarity, vote):
+        perf.count("router_llm")
+        print(f"   [Layer 2 - Local] Không đủ tự tin ({agents}, sim={similarity:.3f}, vote={vote:.2f})")
+        return None, agents
+    perf.count("router_local")
+    print(f"   [Layer 2 - Local] {agents} (sim={similarity:.3f}, vote={vote:.2f})")
+    return [{"agent": agent, "query": question} for agent in agents], agents
+
+
+def _start_prefetch(question: str, bert_label: str, knn_agents: list):
+    """Prefetch retrieval cho các store khả năng cao trong lúc chờ LLM router (SPECULATIVE_RETRIEVAL=1)."""
+    if not speculative.ENABLED:
+        return None
+    candidates = speculative.candidate_agents(question, bert_label, knn_agents)
+    folders = [specialist_agents[a].vector_db_folder for a in candidates if a in specialist_agents]
+    if not folders:
+        return None
+    return speculative.Prefetch(question, folders, retrieve_documents)
 
 
-def _run_agents(steps: list) -> tuple:
+async def _arun_agents(steps: list, prefetch=None) -> tuple:
 
-    def run_step(step):
+    async def run_step(step):
         agent_name = step.get("agent")
         sub_query  = step.get("query")
         agent = specialist_agents.get(agent_name)
@@ -429,7 +671,7 @@ def _run_agents(steps: list) -> tuple:
             print(f"   -> Không tìm thấy agent: {agent_name}")
             return agent_name, "", []
         print(f"   -> Gọi {agent_name}: '{sub_query}'")
-        resp, ctx = agent.answer_with_context(sub_query)
+        resp, ctx = await agent.aanswer_with_context(sub_query, prefetch)
         return agent_name, resp, ctx
 
     agent_responses = ""
@@ -437,55 +679,84 @@ def _run_agents(steps: list) -> tuple:
 
     if len(steps) == 1:
         # Single agent: không cần prefix, gửi response trực tiếp
-        agent_name, resp, ctx = run_step(steps[0])
+        agent_name, resp, ctx = await run_step(steps[0])
         if resp:
             agent_responses = resp
         retrieved_contexts.extend(ctx)
     else:
-        # Multiple agents: thêm prefix để phân biệt nguồn
-        with ThreadPoolExecutor(max_workers=len(steps)) as executor:
-            futures = {executor.submit(run_step, step): step for step in steps}
-            for future in as_completed(futures):
-                agent_name, resp, ctx = future.result()
-                if resp:
-                    agent_responses += f"- Thông tin từ {agent_name}: {resp}\n"
-                retrieved_contexts.extend(ctx)
+        # Multiple agents: chạy đồng thời trên event loop, thêm prefix để phân biệt nguồn
+        for agent_name, resp, ctx in await asyncio.gather(*(run_step(step) for step in steps)):
+            if resp:
+                agent_responses += f"- Thông tin từ {agent_name}: {resp}\n"
+            retrieved_contexts.extend(ctx)
 
     return agent_responses, retrieved_contexts
 
 
-def _prepare_agent_responses(question: str) -> tuple:
+def _plan_versions(steps: list, versions: dict) -> dict:
+    """Version (đọc trước retrieval) của các vector store mà plan truy vấn."""
+    folders = [specialist_agents[s["agent"]].vector_db_folder for s in steps if s.get("agent") in specialist_agents]
+    return store_versions.snapshot(folders, versions)
+
+
+async def _aprepare_agent_responses(question: str, plan: list = None) -> tuple:
+    """(early, agent_responses, contexts, versions): versions = {store: version} mà kết quả dựa vào."""
 
     #  Layer 1: PhoBERT 
     if classifier is None:
         bert_label, bert_score = "IN_SCOPE", 0.0
         print("   [Layer 1 - PhoBERT] Skipped (model not loaded)")
     else:
-        bert_label, bert_score = classifier.predict(question)
+        with perf.stage("layer1"):
+            bert_label, bert_score = await to_thread(classifier.predict, question)
         print(f"   [Layer 1 - PhoBERT] Nhãn: {bert_label} (Tin cậy: {bert_score:.1f}%)")
 
     if bert_label == "OUT_OF_SCOPE" and bert_score > 50.0:
-        return "Xin lỗi, mình chỉ chuyên về thông tin của Đại học Tôn Đức Thắng thôi ạ.", "", []
+        return "Xin lỗi, mình chỉ chuyên về thông tin của Đại học Tôn Đức Thắng thôi ạ.", "", [], {}
 
     if bert_label == "GREETING" and bert_score > 50.0:
-        return "Chào bạn! Mình là Trợ lý ảo TDTU. Mình có thể giúp gì?", "", []
+        return "Chào bạn! Mình là Trợ lý ảo TDTU. Mình có thể giúp gì?", "", [], {}
+
+    # Đọc version trước mọi retrieval (kể cả prefetch): store bị ghi trong lúc trả lời → entry lệch version, bị bỏ.
+    versions = await to_thread(store_versions.current)
 
     # Layer 2: Router
-    print("   [Layer 2 - Groq] Đang phân tích chuyên sâu...")
+    if plan:
+        steps, knn_agents = plan, []
+        print("   [Layer 2] Dùng plan từ bước rewrite")
+    else:
+        steps, knn_agents = await to_thread(_local_route, question)
+    prefetch = None
+    if steps is None:
+        prefetch = _start_prefetch(question, bert_label, knn_agents)
+        print("   [Layer 2 - Groq] Đang phân tích chuyên sâu...")
     try:
-        router_output = router_chain.invoke({"question": question})
-        steps = _parse_plan(router_output)
+        if steps is None:
+            with perf.stage("router"):
+                router_output = await router_chain.ainvoke({"question": question})
+            steps = _parse_plan(router_output)
+            _log_route(question, [s.get("agent") for s in steps if s.get("agent")])
     except Exception as e:
         print(f" Lỗi Router: {e}. -> Fallback to GENERAL agent")
-        resp, ctx = specialist_agents["GENERAL"].answer_with_context(question)
-        return resp, "", ctx
+        resp, ctx = await specialist_agents["GENERAL"].aanswer_with_context(question, prefetch)
+        if prefetch is not None:
+            prefetch.finish(1)
+        return resp, "", ctx, _plan_versions([{"agent": "GENERAL"}], versions)
 
     if not steps:
-        return "Xin lỗi, tôi không tìm thấy thông tin phù hợp.", "", []
+        if prefetch is not None:
+            prefetch.finish(0)
+        return "Xin lỗi, tôi không tìm thấy thông tin phù hợp.", "", [], {}
 
     print(f"   Detected Plan: {len(steps)} bước")
-    agent_responses, contexts = _run_agents(steps)
-    return None, agent_responses, contexts
+    with perf.stage("agents"):
+        agent_responses, contexts = await _arun_agents(steps, prefetch)
+    if prefetch is not None:
+        prefetch.finish(len(steps))
+    paths = get_fast_path_stats()
+    print(f"   [Agents] Direct SQL: {paths['direct_sql']} | Direct RAG: {paths['direct_rag']}"
+          f" | ReAct: {paths['react']} (tích luỹ)")
+    return None, agent_responses, contexts, _plan_versions(steps, versions)
 
 
 def process_query(question: str) -> str:
@@ -494,90 +765,177 @@ def process_query(question: str) -> str:
     return response
 
 
-def process_query_with_context(question: str, provider: str = "groq_llama", chat_history: list = None) -> tuple:
-
-    print(f"\n User [{provider}]: {question}")
+def _lookup_cached(standalone: str, namespace: CacheNamespace = None) -> tuple:
+    if not _SEMANTIC_CACHE_ENABLED:
+        return None, None
+    with perf.stage("cache_lookup"):
+        _semantic_cache.sync()
+        cached = _exact_lookup(standalone, namespace)
+        if cached is not None:
+            return cached, None
+        has_entries = len(_semantic_cache) or (namespace is not None and len(namespace.semantic))
+        q_emb = _embed_question(standalone) if has_entries else None
+        return _cache_lookup(standalone, q_emb, namespace), q_emb
 
-    standalone = _rewrite_question(question, chat_history or [])
-    was_rewritten = (standalone.strip() != question.strip())
 
-    cached = _cache_lookup(standalone)
+async def _aretrieve_for_question(standalone: str, context_free: bool, plan: list = None,
+                                  namespace: CacheNamespace = None) -> tuple:
+    """
+    Cache lookup → (nếu MISS) Layer 1-3 → cache store. Câu hỏi chỉ được embed 1 lần.
+    Trả về (early, agent_responses, contexts, versions).
+    """
+    cached, q_emb = await to_thread(_lookup_cached, standalone, namespace)
     if cached is not None:
-        agent_responses, contexts = cached
-        unique_contexts = contexts
-    else:
-        early, agent_responses, contexts = _prepare_agent_responses(standalone)
-        if early is not None:
-            return early, []
-        unique_contexts = deduplicate_contexts(contexts)
-        if len(contexts) != len(unique_contexts):
-            print(f"   [Dedup] {len(contexts)} → {len(unique_contexts)} contexts")
-        if not was_rewritten:
-            _cache_store(standalone, agent_responses, unique_contexts)
-        else:
-            print("   [Cache] Bỏ qua lưu cache (câu hỏi chứa ngữ cảnh cá nhân)")
-
-    if provider == "groq_llama":
-        synth_chain = synthesizer_chain  # chain mặc định
+        return (None, *cached)
+
+    early, agent_responses, contexts, versions = await _aprepare_agent_responses(standalone, plan)
+    if early is not None:
+        return early, "", [], {}
+    unique_contexts = deduplicate_contexts(contexts)
+    if len(contexts) != len(unique_contexts):
+        print(f"   [Dedup] {len(contexts)} → {len(unique_contexts)} contexts")
+    if context_free:
+        with perf.stage("cache_store"):
+            await to_thread(_cache_store, standalone, agent_responses, unique_contexts, q_emb, None, versions)
+    elif namespace is not None:
+        print("   [Cache] Lưu vào cache của phiên (câu hỏi phụ thuộc ngữ cảnh)")
+        with perf.stage("cache_store"):
+            await to_thread(_cache_store, standalone, agent_responses, unique_contexts, q_emb,
+                            namespace.semantic, versions)
     else:
-        try:
-            llm = get_llm(provider)
-            synth_chain = synthesizer_prompt | llm | StrOutputParser()
-        except Exception as e:
-            print(f"   Không thể dùng provider '{provider}': {e}. Fallback LLaMA.")
-            synth_chain = synthesizer_chain
+        print("   [Cache] Bỏ qua lưu cache (câu hỏi chứa ngữ cảnh cá nhân)")
+    return None, agent_responses, unique_contexts, versions
+
+
+def _synthesizer_for(provider: str) -> tuple:
+    """(provider thực sự dùng, chain)."""
+    try:
+        return provider, _synthesizer_chain(provider)
+    except Exception as e:
+        print(f"   Không thể dùng provider '{provider}': {e}. Fallback LLaMA.")
+        return "groq_llama", synthesizer_chain
+
+
+async def _aretrieve(standalone: str, context_free: bool, plan: list = None,
+                     namespace: CacheNamespace = None) -> tuple:
+    with embedding_request_context() as emb_stats:
+        result = await _aretrieve_for_question(standalone, context_free, plan, namespace)
+    _report_embedding_usage(emb_stats)
+    return result
+
+
+def _answer_lookup(key: str, namespace: CacheNamespace = None):
+    if not _ANSWER_CACHE_ENABLED:
+        return None
+    cached = namespace.answers.get(key) if namespace is not None else None
+    if cached is None:
+        cached = _answer_cache.get(key)
+    perf.count("answer_cache_hit" if cached is not None else "answer_cache_miss")
+    if cached is not None:
+        print("   Answer cache HIT (bỏ qua retrieval + synthesizer)")
+    return cached
+
+
+def _answer_store(key: str, answer: str, contexts: list, context_free: bool, namespace: CacheNamespace = None,
+                  versions: dict = None):
+    if not _ANSWER_CACHE_ENABLED or not answer:
+        return
+    if context_free:
+        _answer_cache.put(key, answer, contexts, versions)
+    elif namespace is not None:
+        namespace.answers.put(key, answer, contexts, versions)
+
+
+async def _areplay_answer(answer: str):
+    """Phát lại câu trả lời đã cache thành từng đoạn vài từ, như stream của LLM."""
+    parts = re.split(r"(\s+)", answer)
+    step = _ANSWER_REPLAY_WORDS * 2
+    for i in range(0, len(parts), step):
+        yield "".join(parts[i:i + step])
+        if _ANSWER_REPLAY_DELAY_MS:
+            await asyncio.sleep(_ANSWER_REPLAY_DELAY_MS / 1000)
+
+
+async def aprocess_query_with_context(question: str, provider: str = "groq_llama", chat_history: list = None,
+                                      session_id: str = None) -> tuple:
+
+    print(f"\n User [{provider}]: {question}")
 
+    standalone, plan = await _arewrite_question(question, chat_history or [])
+    context_free, namespace = _cache_scope(question, standalone, session_id)
+    answer_key = AnswerCache.make_key(standalone, provider, SYNTHESIZER_PROMPT_VERSION, get_backend())
+    cached = await to_thread(_answer_lookup, answer_key, namespace)
+    if cached is not None:
+        return cached
+
+    early, agent_responses, unique_contexts, versions = await _aretrieve(standalone, context_free, plan, namespace)
+    if early is not None:
+        return early, []
+
+    used_provider, synth_chain = _synthesizer_for(provider)
     print(f"   Synthesizing ({provider})...")
-    final_answer = synth_chain.invoke({
-        "question": question,
-        "agent_responses": agent_responses,
-    })
+    with perf.stage("synthesis"):
+        final_answer = await synth_chain.ainvoke({
+            "question": question,
+            "agent_responses": agent_responses,
+        })
 
+    if used_provider == provider:
+        await to_thread(_answer_store, answer_key, final_answer, unique_contexts, context_free, namespace, versions)
     return final_answer, unique_contexts
 
 
-def process_query_streaming(question: str, provider: str = "groq_llama", chat_history: list = None) -> tuple:
+async def aprocess_query_streaming(question: str, provider: str = "groq_llama", chat_history: list = None,
+                                   session_id: str = None) -> tuple:
+    """Như process_query_streaming nhưng phần tử thứ 3 là async generator (astream)."""
 
     print(f"\nUser (stream) [{provider}]: {question}")
 
-    standalone = _rewrite_question(question, chat_history or [])
-    was_rewritten = (standalone.strip() != question.strip())
-
-    cached = _cache_lookup(standalone)
+    standalone, plan = await _arewrite_question(question, chat_history or [])
+    context_free, namespace = _cache_scope(question, standalone, session_id)
+    answer_key = AnswerCache.make_key(standalone, provider, SYNTHESIZER_PROMPT_VERSION, get_backend())
+    cached = await to_thread(_answer_lookup, answer_key, namespace)
     if cached is not None:
-        agent_responses, unique_contexts = cached
-    else:
-        early, agent_responses, contexts = _prepare_agent_responses(standalone)
-        if early is not None:
-            return early, [], None
-        unique_contexts = deduplicate_contexts(contexts)
-        if not was_rewritten:
-            _cache_store(standalone, agent_responses, unique_contexts)
-        else:
-            print("   [Cache] Bỏ qua lưu cache (câu hỏi chứa ngữ cảnh cá nhân)")
-
-    if provider == "groq_llama":
-        synth_chain = synthesizer_chain  
-    else:
-        try:
-            llm = get_llm(provider)
-            synth_chain = synthesizer_prompt | llm | StrOutputParser()
-        except Exception as e:
-            print(f"   Không thể dùng provider '{provider}': {e}. Fallback LLaMA.")
-            synth_chain = synthesizer_chain
+        answer, contexts = cached
+        return None, contexts, _areplay_answer(answer)
 
+    early, agent_responses, unique_contexts, versions = await _aretrieve(standalone, context_free, plan, namespace)
+    if early is not None:
+        return early, [], None
+
+    used_provider, synth_chain = _synthesizer_for(provider)
     print(f"   Synthesizing (stream) với {provider}...")
 
-    def _stream_gen():
-        for token in synth_chain.stream({
-            "question": question,
-            "agent_responses": agent_responses,
-        }):
-            yield token
+    async def _stream_gen():
+        parts = []
+        with perf.stage("synthesis"):
+            async for token in synth_chain.astream({
+                "question": question,
+                "agent_responses": agent_responses,
+            }):
+                parts.append(token)
+                yield token
+        # Chỉ lưu khi stream chạy hết (người dùng không dừng giữa chừng).
+        if used_provider == provider:
+            await to_thread(_answer_store, answer_key, "".join(parts), unique_contexts, context_free, namespace,
+                            versions)
 
     return None, unique_contexts, _stream_gen()
 
 
+def process_query_with_context(question: str, provider: str = "groq_llama", chat_history: list = None,
+                               session_id: str = None) -> tuple:
+    return run_sync(aprocess_query_with_context(question, provider, chat_history, session_id))
+
+
+def process_query_streaming(question: str, provider: str = "groq_llama", chat_history: list = None,
+                            session_id: str = None) -> tuple:
+    early, contexts, stream = run_sync(aprocess_query_streaming(question, provider, chat_history, session_id))
+    if stream is None:
+        return early, contexts, None
+    return early, contexts, iterate_sync(stream)
+
+
 PROVIDER_LABELS = {
     "groq_llama":  f"LLaMA ({os.getenv('LLM_MODEL', 'llama-3.1-8b-instant')})",
     "gemini":      f"Gemini ({os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')})",
@@ -602,40 +960,34 @@ PROVIDER_META = {
 def get_available_providers() -> list[str]:
     """Chỉ trả về các provider còn lại: groq_llama, gemini."""
     providers = ["groq_llama"]
-    if _GEMINI_AVAILABLE and os.getenv("GOOGLE_API_KEY"):
+    if gemini_available():
         providers.append("gemini")
     return providers
 
 
 def get_llm(provider: str):
     """
-    Factory: trả về LLM object theo provider.
+    Trả về LLM object (dùng chung trong pool) theo provider.
     Hỗ trợ: 'groq_llama', 'gemini'
     """
-    if provider == "groq_llama":
-        return ChatGroq(
-            model=os.getenv("LLM_MODEL", "llama-3.1-8b-instant"),
-            api_key=os.getenv("API_KEY"),
-            temperature=0,
-        )
-    elif provider == "gemini":
-        if not _GEMINI_AVAILABLE:
-            raise ImportError("langchain-google-genai chưa được cài. Chạy: pip install langchain-google-genai")
-        return ChatGoogleGenerativeAI(
-            model=os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
-            google_api_key=os.getenv("GOOGLE_API_KEY"),
-            temperature=0,
-        )
-    else:
-        raise ValueError(f"Provider không hợp lệ: '{provider}'. Chọn: groq_llama, gemini")
+    return get_chat_model(provider)
 
 
-def process_query_compare(question: str, providers: list[str] | None = None) -> dict:
+# Dựng sẵn chain synthesizer cho mọi provider khả dụng và mở kết nối HTTP (nền) trước request đầu tiên.
+for _provider in get_available_providers():
+    try:
+        _synthesizer_chain(_provider)
+    except Exception as e:
+        print(f"Không dựng được synthesizer cho '{_provider}': {e}")
+warm_up(get_available_providers())
+
+
+async def aprocess_query_compare(question: str, providers: list[str] | None = None) -> dict:
     if providers is None:
         providers = get_available_providers()
 
     print(f"\n[Compare] Đang xử lý retrieval cho: '{question}'")
-    early, agent_responses, contexts = _prepare_agent_responses(question)
+    early, agent_responses, contexts, _ = await _aprepare_agent_responses(question)
     unique_contexts = deduplicate_contexts(contexts)
 
     if early is not None:
@@ -650,13 +1002,12 @@ def process_query_compare(question: str, providers: list[str] | None = None) ->
             for p in providers
         }
 
-    def _synthesize(provider: str) -> tuple:
+    async def _synthesize(provider: str) -> tuple:
         label = PROVIDER_LABELS.get(provider, provider)
         try:
-            llm = get_llm(provider)
-            chain = synthesizer_prompt | llm | StrOutputParser()
+            chain = _synthesizer_chain(provider)
             t0 = time.time()
-            resp = chain.invoke({"question": question, "agent_responses": agent_responses})
+            resp = await chain.ainvoke({"question": question, "agent_responses": agent_responses})
             elapsed = time.time() - t0
             print(f"   [{label}] xong trong {elapsed:.1f}s")
             return provider, resp, elapsed, None
@@ -666,20 +1017,21 @@ def process_query_compare(question: str, providers: list[str] | None = None) ->
 
     print(f"   Synthesis song song với {len(providers)} mô hình: {providers}")
     results = {}
-    with ThreadPoolExecutor(max_workers=len(providers)) as executor:
-        futures = {executor.submit(_synthesize, p): p for p in providers}
-        for future in as_completed(futures):
-            provider, resp, elapsed, err = future.result()
-            results[provider] = {
-                "response": resp,
-                "contexts": unique_contexts,
-                "elapsed":  elapsed,
-                "label":    PROVIDER_LABELS.get(provider, provider),
-                "error":    err,
-            }
+    for provider, resp, elapsed, err in await asyncio.gather(*(_synthesize(p) for p in providers)):
+        results[provider] = {
+            "response": resp,
+            "contexts": unique_contexts,
+            "elapsed":  elapsed,
+            "label":    PROVIDER_LABELS.get(provider, provider),
+            "error":    err,
+        }
 
     return results
 
+
+def process_query_compare(question: str, providers: list[str] | None = None) -> dict:
+    return run_sync(aprocess_query_compare(question, providers))
+
 if __name__ == "__main__":
     print("=== HỆ THỐNG DUAL-LAYER MULTI-AGENT ===")
     while True:
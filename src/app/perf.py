@@ -0,0 +1,101 @@
+"""
+Lightweight per-request instrumentation for the query pipeline.
+
+    with trace_request() as trace:
+        process_query_with_context(q)
+    trace.stages   -> {"layer1": 0.012, "router": 0.41, ...}   (seconds)
+    trace.counters -> {"llm_calls": 3, "prompt_tokens": ..., "cache_hit": 1}
+
+stage()/count() are no-ops outside trace_request(), so the app pays nothing
+when no benchmark is running. The trace travels with contextvars;
+async_runtime copies it into every coroutine and executor job, so work run
+through run_sync()/to_thread() reports into it. Stages that run concurrently
+are summed.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+_current = ContextVar("perf_trace", default=None)
+
+
+class RequestTrace:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.wall_seconds = 0.0
+
+    def add_stage(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name: str, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+@contextmanager
+def trace_request():
+    trace = RequestTrace()
+    token = _current.set(trace)
+    t0 = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.wall_seconds = time.perf_counter() - t0
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, time.perf_counter() - t0)
+
+
+def count(name: str, n=1):
+    trace = _current.get()
+    if trace is not None:
+        trace.add_count(name, n)
+
+
+def _token_usage(response) -> dict:
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage
+    for generations in response.generations:
+        for gen in generations:
+            message = getattr(gen, "message", None)
+            meta = getattr(message, "usage_metadata", None) or {}
+            if meta:
+                return {"prompt_tokens": meta.get("input_tokens", 0),
+                        "completion_tokens": meta.get("output_tokens", 0)}
+            meta = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+            if meta:
+                return meta
+    return {}
+
+
+class LLMUsageCallback(BaseCallbackHandler):
+    """Đếm số lượt gọi LLM và token vào trace của request hiện tại."""
+
+    def on_llm_end(self, response, **kwargs):
+        count("llm_calls")
+        usage = _token_usage(response)
+        count("prompt_tokens", int(usage.get("prompt_tokens", 0) or 0))
+        count("completion_tokens", int(usage.get("completion_tokens", 0) or 0))
+
+
+llm_usage_callback = LLMUsageCallback()
@@ -0,0 +1,78 @@
+"""
+Keyword routing heuristics mirroring the "Keyword Priority" rules of the
+router prompt in main.py. Used where an LLM call is not wanted: the fake LLM
+backend for offline benchmarks and cheap agent guesses before the router
+answers. needs_rewrite() is the matching pre-check for follow-up rewriting.
+"""
+
+import re
+import unicodedata
+
+from text_normalize import fold_diacritics
+
+AGENT_KEYWORDS = {
+    "FINANCIAL": [
+        "hoc bong", "hoc phi", "khen thuong", "mien giam", "dong tien", "cong no",
+        "tai chinh", "le phi", "chi phi", "muc phi", "vay von",
+    ],
+    "ADMISSION": [
+        "tuyen sinh", "xet tuyen", "diem chuan", "nhap hoc", "trung tuyen", "ho so xet tuyen",
+        "diem san", "chi tieu",
+    ],
+    "STUDENT_LIFE": [
+        "cong tac sinh vien", "ctsv", "noi quy", "ky luat", "ung xu", "ky tuc xa", "ktx",
+        "bao hiem", "cau lac bo", "tinh nguyen", "ngoai khoa",
+    ],
+    "ACADEMIC": [
+        "gpa", "tin chi", "hoc phan", "quy che dao tao", "dao tao", "tot nghiep", "chuan dau ra",
+        "tap su", "thu khen", "bao luu", "phuc khao", "cam thi", "diem ren luyen", "no mon",
+        "diem trung binh", "hoc vu",
+    ],
+    "GENERAL": [
+        "lien he", "dia chi", "email", "so dien thoai", "website", "thanh lap", "khuon vien",
+    ],
+}
+
+
+def _fold(text: str) -> str:
+    return " " + re.sub(r"[^a-z0-9]+", " ", fold_diacritics(text).lower()).strip() + " "
+
+
+def keyword_scores(question: str) -> dict:
+    """Số keyword khớp cho từng agent (chỉ chứa agent có ít nhất 1 keyword)."""
+    text = _fold(question)
+    scores = {}
+    for agent, keywords in AGENT_KEYWORDS.items():
+        n = sum(1 for k in keywords if f" {k} " in text)
+        if n:
+            scores[agent] = n
+    return scores
+
+
+def guess_agents(question: str) -> list:
+    """Danh sách agent đoán theo keyword, mạnh nhất trước; rỗng nếu không khớp gì."""
+    scores = keyword_scores(question)
+    return sorted(scores, key=lambda a: scores[a], reverse=True)
+
+
+# Đại từ / chỉ từ / từ nối gợi ý câu hỏi phụ thuộc lịch sử hội thoại (so khớp có dấu).
+_REFERENCE_WORDS = {
+    "nó", "đó", "đấy", "ấy", "này", "kia", "vậy", "họ", "đây",
+    "tôi", "mình", "em", "tớ", "trên",
+}
+_REFERENCE_OPENERS = ("còn", "thế còn", "vậy còn", "vậy thì", "thế thì", "ngoài ra", "và")
+_REFERENCE_PHRASES = ("thì sao", "như vậy", "như thế", "cũng vậy", "nói trên", "kể trên", "vừa rồi", "lúc nãy")
+_MIN_STANDALONE_WORDS = 5
+
+
+def needs_rewrite(question: str) -> bool:
+    """False nếu câu hỏi chắc chắn đã độc lập (không đại từ/tham chiếu, đủ dài) → bỏ qua rewrite."""
+    text = " ".join(re.findall(r"\w+", unicodedata.normalize("NFC", question or "").lower()))
+    words = text.split()
+    if len(words) < _MIN_STANDALONE_WORDS:
+        return True
+    if _REFERENCE_WORDS.intersection(words):
+        return True
+    if any(text == o or text.startswith(o + " ") for o in _REFERENCE_OPENERS):
+        return True
+    return any(f" {p} " in f" {text} " for p in _REFERENCE_PHRASES)
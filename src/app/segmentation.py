@@ -0,0 +1,127 @@
+"""
+Memoized Vietnamese word segmentation (underthesea.word_tokenize, format="text").
+
+Segmentation is deterministic for a given underthesea version, so results are
+kept in a bounded LRU keyed by the NFC-normalized text. A memo can be saved to
+and loaded from a JSON file: training and evaluation scripts persist one next
+to their dataset so reruns skip segmentation entirely. The file records the
+underthesea version and is ignored when it does not match.
+
+    segment("Học phí bao nhiêu")         -> "Học_phí bao_nhiêu"
+    segment_batch([...])                  -> same order, duplicates segmented once
+"""
+
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from underthesea import word_tokenize
+
+_DEFAULT_CAPACITY = int(os.getenv("SEGMENTATION_CACHE_SIZE", "4096"))
+
+
+def _underthesea_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("underthesea")
+    except Exception:
+        return "unknown"
+
+
+class SegmentationMemo:
+
+    def __init__(self, capacity: int = _DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def segment_batch(self, texts: list) -> list:
+        keys = [unicodedata.normalize("NFC", t or "") for t in texts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = value
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        computed = {k: word_tokenize(k, format="text") for k in missing}
+
+        with self._lock:
+            self.stats["hits"] += len(keys) - len(missing)
+            self.stats["misses"] += len(missing)
+            for key, value in computed.items():
+                self._entries[key] = value
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        found.update(computed)
+        return [found[k] for k in keys]
+
+    def segment(self, text: str) -> str:
+        return self.segment_batch([text])[0]
+
+    def load(self, path: str) -> int:
+        """Nạp memo từ file (bỏ qua nếu khác phiên bản underthesea); trả về số mục đã nạp."""
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[Segmentation] Không đọc được {path}: {e}")
+            return 0
+        if data.get("underthesea") != _underthesea_version():
+            print(f"[Segmentation] {path} tạo bởi underthesea {data.get('underthesea')}, bỏ qua.")
+            return 0
+        entries = data.get("entries", {})
+        with self._lock:
+            for key, value in entries.items():
+                self._entries[key] = value
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return len(entries)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            data = {"underthesea": _underthesea_version(), "entries": dict(self._entries)}
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+
+_memo = SegmentationMemo()
+
+
+def segment(text: str) -> str:
+    return _memo.segment(text)
+
+
+def segment_batch(texts: list) -> list:
+    return _memo.segment_batch(texts)
+
+
+def reserve_segmentation_capacity(min_capacity: int):
+    """Nới capacity memo dùng chung để giữ được cả 1 dataset."""
+    _memo.capacity = max(_memo.capacity, min_capacity)
+
+
+def load_segmentation_cache(path: str, min_capacity: int = 0) -> int:
+    """Nạp file memo vào memo dùng chung (nới capacity nếu cần chứa cả dataset)."""
+    reserve_segmentation_capacity(min_capacity)
+    return _memo.load(path)
+
+
+def save_segmentation_cache(path: str):
+    _memo.save(path)
+
+
+def segmentation_stats() -> dict:
+    return {**_memo.stats, "entries": len(_memo), "capacity": _memo.capacity}
@@ -0,0 +1,619 @@
+"""
+Semantic answer cache.
+
+Embeddings of cached questions live in one preallocated float32 matrix, so a
+lookup is a single matrix-vector product + argmax instead of a Python loop.
+LRU order is kept in an OrderedDict of slot ids; evicting the oldest entry
+frees its slot for reuse without shifting anything. The matrix grows by
+doubling up to `capacity` rows, so a large capacity costs nothing until used.
+Payloads carrying an "exact_key" (see exact_key()) are also indexed by that
+key, so lookup_exact() can answer a verbatim repeat before the question is
+embedded at all; both indexes share the same slots, LRU and eviction.
+
+PersistentCacheStore is an optional write-through tier on local disk: entry
+metadata and payloads (JSON) in SQLite, vectors in a flat float32 ring file read
+through a numpy memmap. A SemanticCache attached to it loads the newest entries
+at startup and picks up entries written by other worker processes every
+`sync_interval` seconds. Writers serialise on SQLite's write lock (BEGIN
+IMMEDIATE), so several processes on one host can share a cache directory.
+
+AnswerCache is the tier above: final synthesized answers keyed exactly by
+(normalized standalone question, provider, prompt version, LLM backend), so a
+repeated question skips retrieval and the synthesizer call altogether.
+
+Both tiers above are the global namespace, shared by every user, and only hold
+context-free questions. SessionCaches keeps a separate small in-memory
+namespace per chat session for rewritten or personal questions; starting a new
+chat drops just that namespace.
+
+Every tier accepts an is_valid(payload) callback; main.py uses it to drop
+entries whose source stores changed since they were cached (store_versions).
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from text_normalize import fold_diacritics as _fold_diacritics
+
+_INITIAL_ROWS = 256
+_PUNCTUATION = re.compile(r"[\W_]+")
+
+
+class PersistentCacheStore:
+    """
+    Lưu entry cache trên đĩa. Entry id tăng dần (AUTOINCREMENT); vector của entry
+    nằm ở hàng (id - 1) % max_entries của vectors.bin, nên file không lớn quá
+    max_entries hàng và entry cũ nhất bị ghi đè (FIFO) khi đầy.
+
+    Vector được ghi vào ring sau khi dòng SQLite đã COMMIT, và mỗi dòng giữ CRC32
+    của vector: reader bỏ qua dòng mà hàng trong ring chưa (hoặc không còn) khớp,
+    nên không bao giờ ghép payload với vector của entry khác.
+    """
+
+    def __init__(self, cache_dir: str, model_id: str, max_entries: int = 10000):
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db_path = os.path.join(cache_dir, "index.sqlite3")
+        self._vec_path = os.path.join(cache_dir, "vectors.bin")
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._mmap_rows = 0
+        self._last_id = 0
+
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, created REAL NOT NULL, "
+                         "vec_crc INTEGER)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            if "vec_crc" not in columns:
+                conn.execute("ALTER TABLE entries ADD COLUMN vec_crc INTEGER")
+            conn.execute("BEGIN IMMEDIATE")
+            meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+            if meta.get("model") != model_id or int(meta.get("max_entries", self.max_entries)) != self.max_entries:
+                # Model embedding hoặc kích thước ring khác → vector cũ không dùng được nữa.
+                if meta:
+                    print(f"[SemanticCache] Cache trên đĩa tạo với cấu hình khác ({meta.get('model')}), xoá.")
+                conn.execute("DELETE FROM entries")
+                conn.execute("DELETE FROM meta")
+                conn.execute("INSERT INTO meta VALUES ('model', ?)", (model_id,))
+                conn.execute("INSERT INTO meta VALUES ('max_entries', ?)", (str(self.max_entries),))
+                if os.path.exists(self._vec_path):
+                    os.remove(self._vec_path)
+                meta = {}
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+
+    def _rows(self):
+        if self.dim is None or not os.path.exists(self._vec_path):
+            return None
+        n_rows = os.path.getsize(self._vec_path) // (self.dim * 4)
+        if self._mmap is None or n_rows > self._mmap_rows:
+            self._mmap = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+            self._mmap_rows = n_rows
+        return self._mmap
+
+    def _read(self, rows_sql: list) -> list:
+        """[(id, vector, payload)] cho các dòng (id, payload, vec_crc) đọc từ SQLite."""
+        if not rows_sql:
+            return []
+        with self._lock:
+            if self.dim is None:
+                conn = self._connect()
+                try:
+                    row = conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+                finally:
+                    conn.close()
+                if row is None:
+                    return []
+                self.dim = int(row[0])
+            vectors = self._rows()
+            newest = max(entry_id for entry_id, _, _ in rows_sql)
+            entries = []
+            for entry_id, payload, vec_crc in rows_sql:
+                row = (entry_id - 1) % self.max_entries
+                # Hàng đã bị entry mới hơn ghi đè trong lúc đọc → bỏ qua.
+                if vectors is None or row >= vectors.shape[0] or entry_id <= newest - self.max_entries:
+                    continue
+                vector = np.array(vectors[row], dtype=np.float32)
+                # Vector chưa ghi xong / bị ghi đè (vec_crc NULL: dòng tạo trước khi có cột này).
+                if vec_crc is not None and zlib.crc32(vector.tobytes()) != vec_crc:
+                    continue
+                entries.append((entry_id, vector, json.loads(payload)))
+            self._last_id = max(self._last_id, newest)
+            return entries
+
+    def load(self, limit: int) -> list:
+        """Các entry mới nhất (tối đa limit), cũ trước mới sau."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT id, payload, vec_crc FROM entries ORDER BY id DESC LIMIT ?",
+                                (limit,)).fetchall()
+            last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM entries").fetchone()[0]
+        finally:
+            conn.close()
+        entries = self._read(rows[::-1])
+        self._last_id = max(self._last_id, last)
+        return entries
+
+    def poll(self) -> list:
+        """Entry được ghi (bởi bất kỳ process nào) từ lần load/poll trước."""
+        with self._lock:
+            last_id = self._last_id
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT id, payload, vec_crc FROM entries WHERE id > ? ORDER BY id",
+                                (last_id,)).fetchall()
+        finally:
+            conn.close()
+        return self._read(rows)
+
+    def append(self, vector: np.ndarray, payload) -> int:
+        vector = np.asarray(vector, dtype=np.float32)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+            if row is None:
+                conn.execute("INSERT INTO meta VALUES ('dim', ?)", (str(vector.shape[0]),))
+                dim = vector.shape[0]
+            else:
+                dim = int(row[0])
+            if vector.shape[0] != dim:
+                raise ValueError(f"Embedding dim {vector.shape[0]} khác dim của cache ({dim})")
+            entry_id = conn.execute(
+                "INSERT INTO entries (payload, created, vec_crc) VALUES (?, ?, ?)",
+                (json.dumps(payload, ensure_ascii=False), time.time(), zlib.crc32(vector.tobytes())),
+            ).lastrowid
+            conn.execute("DELETE FROM entries WHERE id <= ?", (entry_id - self.max_entries,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        # Chỉ ghi đè hàng trong ring khi COMMIT đã thành công: ROLLBACK không để lại
+        # entry cũ trỏ vào vector mới. Poll chen vào trước lúc này thấy CRC lệch → bỏ qua.
+        with self._lock:
+            self.dim = dim
+            mode = "r+b" if os.path.exists(self._vec_path) else "wb"
+            with open(self._vec_path, mode) as f:
+                f.seek(((entry_id - 1) % self.max_entries) * dim * 4)
+                f.write(vector.tobytes())
+        return entry_id
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM entries")
+        finally:
+            conn.close()
+
+    def __len__(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        finally:
+            conn.close()
+
+
+class SemanticCache:
+
+    def __init__(self, capacity: int = 128, threshold: float = 0.95,
+                 persistent: PersistentCacheStore = None, sync_interval: float = 1.0, is_valid=None):
+        self.capacity = max(1, int(capacity))
+        self.threshold = threshold
+        self._is_valid = is_valid              # payload -> bool; entry hết hạn bị bỏ khi lookup trúng
+        self._lock = threading.Lock()
+        self._matrix = None                    # (rows, dim), cấp phát khi biết dim
+        self._active = np.zeros(0, dtype=bool)
+        self._payloads = []
+        self._used = 0                         # số slot đã từng dùng (prefix của matrix)
+        self._lru = OrderedDict()              # slot -> None, cũ nhất ở đầu
+        self._free = []
+        self._exact = {}                       # exact_key -> slot
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.exact_hits = 0
+
+        self._persistent = persistent
+        self._sync_interval = sync_interval
+        self._next_sync = 0.0
+        self._own_ids = set()                  # entry process này vừa ghi, poll() sẽ trả lại
+        self._sync_lock = threading.Lock()     # 1 thread poll tại 1 thời điểm; store() ghi id trong lock
+        if persistent is not None:
+            for _, vector, payload in persistent.load(self.capacity):
+                self._insert(vector, payload)
+            self._next_sync = time.monotonic() + sync_interval
+
+    def __len__(self):
+        return len(self._lru)
+
+    def _grow(self, dim: int):
+        rows = 0 if self._matrix is None else self._matrix.shape[0]
+        new_rows = min(self.capacity, max(_INITIAL_ROWS, rows * 2))
+        matrix = np.zeros((new_rows, dim), dtype=np.float32)
+        active = np.zeros(new_rows, dtype=bool)
+        if rows:
+            matrix[:rows] = self._matrix
+            active[:rows] = self._active
+        self._matrix = matrix
+        self._active = active
+        self._payloads.extend([None] * (new_rows - rows))
+
+    def _take_slot(self, dim: int) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._used < self.capacity:
+            if self._matrix is None or self._used >= self._matrix.shape[0]:
+                self._grow(dim)
+            self._used += 1
+            return self._used - 1
+        slot, _ = self._lru.popitem(last=False)
+        return slot
+
+    def sync(self):
+        """Nạp entry mới do process khác ghi (tối đa 1 lần / sync_interval)."""
+        if self._persistent is None or time.monotonic() < self._next_sync:
+            return
+        # Thread khác đang poll thì nó sẽ nạp luôn các entry này → không chờ.
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() < self._next_sync:
+                return
+            self._next_sync = time.monotonic() + self._sync_interval
+            try:
+                entries = self._persistent.poll()
+            except (sqlite3.Error, OSError, ValueError) as e:
+                print(f"[SemanticCache] Không đọc được cache trên đĩa: {e}")
+                return
+            for entry_id, vector, payload in entries:
+                if entry_id in self._own_ids:
+                    self._own_ids.discard(entry_id)
+                    continue
+                self._insert(vector, payload)
+        finally:
+            self._sync_lock.release()
+
+    def lookup(self, q_emb: np.ndarray):
+        """Trả về (payload, score) nếu HIT, (None, best_score) nếu MISS."""
+        self.sync()
+        with self._lock:
+            if not self._lru:
+                self.misses += 1
+                return None, -1.0
+            n = self._used
+            scores = self._matrix[:n] @ q_emb
+            if len(self._lru) < n:
+                scores[~self._active[:n]] = -np.inf
+            while True:
+                slot = int(np.argmax(scores))
+                best = float(scores[slot])
+                if best < self.threshold:
+                    self.misses += 1
+                    return None, best
+                if self._is_valid is None or self._is_valid(self._payloads[slot]):
+                    self._lru.move_to_end(slot)
+                    self.hits += 1
+                    return self._payloads[slot], best
+                self._drop_slot(slot)
+                self.stale += 1
+                scores[slot] = -np.inf
+
+    def lookup_exact(self, key: str):
+        """Payload của entry có cùng exact_key, hoặc None — không cần embedding."""
+        self.sync()
+        with self._lock:
+            slot = self._exact.get(key)
+            if slot is None:
+                return None
+            payload = self._payloads[slot]
+            if self._is_valid is not None and not self._is_valid(payload):
+                self._drop_slot(slot)
+                self.stale += 1
+                return None
+            self._lru.move_to_end(slot)
+            self.exact_hits += 1
+            return payload
+
+    def _unindex(self, slot: int):
+        payload = self._payloads[slot]
+        key = payload.get("exact_key") if isinstance(payload, dict) else None
+        if key is not None and self._exact.get(key) == slot:
+            del self._exact[key]
+
+    def _drop_slot(self, slot: int):
+        self._unindex(slot)
+        self._lru.pop(slot, None)
+        self._active[slot] = False
+        self._payloads[slot] = None
+        self._free.append(slot)
+
+    def _insert(self, q_emb: np.ndarray, payload) -> int:
+        with self._lock:
+            slot = self._take_slot(q_emb.shape[0])
+            self._unindex(slot)                # slot bị evict: bỏ key cũ
+            key = payload.get("exact_key") if isinstance(payload, dict) else None
+            if key is not None:
+                self._exact[key] = slot
+            self._matrix[slot] = q_emb
+            self._active[slot] = True
+            self._payloads[slot] = payload
+            self._lru[slot] = None
+            return slot
+
+    def store(self, q_emb: np.ndarray, payload) -> int:
+        slot = self._insert(q_emb, payload)
+        if self._persistent is not None:
+            # Giữ _sync_lock qua append: không poll() nào của process này thấy dòng mới
+            # trước khi id của nó nằm trong _own_ids (tránh nạp lại chính entry vừa ghi).
+            with self._sync_lock:
+                try:
+                    self._own_ids.add(self._persistent.append(q_emb, payload))
+                except (sqlite3.Error, OSError, ValueError) as e:
+                    print(f"[SemanticCache] Không ghi được cache xuống đĩa: {e}")
+        return slot
+
+    def clear(self, persistent: bool = False):
+        """Xoá bộ nhớ; persistent=True xoá luôn tier trên đĩa (ảnh hưởng mọi process)."""
+        if persistent and self._persistent is not None:
+            self._persistent.clear()
+        with self._lock:
+            self._matrix = None
+            self._active = np.zeros(0, dtype=bool)
+            self._payloads = []
+            self._used = 0
+            self._lru.clear()
+            self._free = []
+            self._exact = {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "entries":    len(self._lru),
+                "capacity":   self.capacity,
+                "exact_hits": self.exact_hits,
+                "hits":       self.hits,
+                "misses":     self.misses,
+                "stale":      self.stale,
+            }
+        if self._persistent is not None:
+            stats["persistent_entries"] = len(self._persistent)
+        return stats
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text or "").split()).casefold()
+
+
+def exact_key(text: str, fold_diacritics: bool = False) -> str:
+    """
+    Dạng chuẩn của câu hỏi cho tier khớp chính xác: NFC, chữ thường, bỏ dấu câu, gộp khoảng
+    trắng ("Học phí  bao nhiêu?" == "học phí bao nhiêu"). fold_diacritics=True bỏ luôn dấu
+    tiếng Việt (như build_specialized_dbs._normalize_text) — gộp được câu gõ không dấu nhưng
+    cũng gộp các từ chỉ khác dấu.
+    """
+    text = normalize_question(text)
+    if fold_diacritics:
+        text = _fold_diacritics(text)
+    return " ".join(_PUNCTUATION.sub(" ", text).split())
+
+
+class AnswerCache:
+    """
+    Câu trả lời cuối (sau synthesizer) theo khoá chính xác: câu hỏi độc lập đã chuẩn hoá,
+    provider và phiên bản prompt. LRU trong bộ nhớ, tuỳ chọn ghi xuống SQLite để dùng
+    chung giữa các process (bảng giới hạn max_entries dòng mới nhất).
+    """
+
+    def __init__(self, capacity: int = 256, db_path: str = None, max_entries: int = 10000, is_valid=None):
+        self.capacity = max(1, int(capacity))
+        self._is_valid = is_valid              # {"answer", "contexts", "versions"} -> bool
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.execute("CREATE TABLE IF NOT EXISTS answers ("
+                             "key TEXT PRIMARY KEY, answer TEXT NOT NULL, contexts TEXT NOT NULL, created REAL NOT NULL, "
+                             "versions TEXT)")
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(answers)")}
+                if "versions" not in columns:
+                    conn.execute("ALTER TABLE answers ADD COLUMN versions TEXT")
+            finally:
+                conn.close()
+
+    @staticmethod
+    def make_key(question: str, provider: str, prompt_version: str, backend: str = "live") -> str:
+        """backend (LLM_BACKEND) tách câu trả lời giả lập / phát lại khỏi câu trả lời của model thật."""
+        raw = f"{normalize_question(question)}\0{provider}\0{prompt_version}\0{backend}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+
+    def _remember(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def _valid(self, key: str, value: dict) -> bool:
+        if self._is_valid is None or self._is_valid(value):
+            return True
+        with self._lock:
+            self._entries.pop(key, None)
+            self.stale += 1
+        self._delete(key)
+        return False
+
+    def _read(self, key: str):
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT answer, contexts, versions FROM answers WHERE key = ?", (key,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[AnswerCache] Không đọc được {self._db_path}: {e}")
+            return None
+        if row is None:
+            return None
+        return {"answer": row[0], "contexts": json.loads(row[1]), "versions": json.loads(row[2] or "null")}
+
+    def _delete(self, key: str):
+        if not self._db_path:
+            return
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[AnswerCache] Không xoá được entry hết hạn: {e}")
+
+    def get(self, key: str):
+        """(answer, contexts) hoặc None (không có / đã hết hạn)."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is None and self._db_path:
+            value = self._read(key)
+            if value is not None:
+                self._remember(key, value)
+        if value is not None and self._valid(key, value):
+            with self._lock:
+                self.hits += 1
+            return value["answer"], value["contexts"]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, answer: str, contexts: list, versions: dict = None):
+        self._remember(key, {"answer": answer, "contexts": contexts, "versions": versions})
+        if not self._db_path:
+            return
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("INSERT OR REPLACE INTO answers (key, answer, contexts, created, versions) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             (key, answer, json.dumps(contexts, ensure_ascii=False), time.time(),
+                              json.dumps(versions) if versions is not None else None))
+                conn.execute("DELETE FROM answers WHERE rowid <= (SELECT MAX(rowid) FROM answers) - ?",
+                             (self.max_entries,))
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[AnswerCache] Không ghi được {self._db_path}: {e}")
+
+    def clear(self, persistent: bool = False):
+        with self._lock:
+            self._entries.clear()
+        if persistent and self._db_path:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM answers")
+            finally:
+                conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries":  len(self._entries),
+                "capacity": self.capacity,
+                "hits":     self.hits,
+                "misses":   self.misses,
+                "stale":    self.stale,
+            }
+
+
+class CacheNamespace:
+    """Tier retrieval + tier câu trả lời của 1 phiên chat (chỉ trong bộ nhớ)."""
+
+    def __init__(self, capacity: int, threshold: float, answer_capacity: int, is_valid=None):
+        self.semantic = SemanticCache(capacity, threshold, is_valid=is_valid)
+        self.answers = AnswerCache(answer_capacity, is_valid=is_valid)
+
+
+class SessionCaches:
+    """
+    Namespace cache theo phiên cho câu hỏi phụ thuộc ngữ cảnh (đã rewrite / dữ liệu cá nhân).
+    Mỗi phiên có capacity và LRU riêng; số phiên giữ trong bộ nhớ giới hạn bởi max_sessions
+    (phiên lâu không dùng bị bỏ trước).
+    """
+
+    def __init__(self, capacity: int = 32, threshold: float = 0.95,
+                 answer_capacity: int = 32, max_sessions: int = 512, is_valid=None):
+        self.capacity = capacity
+        self.is_valid = is_valid
+        self.threshold = threshold
+        self.answer_capacity = answer_capacity
+        self.max_sessions = max(1, int(max_sessions))
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, create: bool = True):
+        if not session_id:
+            return None
+        with self._lock:
+            namespace = self._sessions.get(session_id)
+            if namespace is not None:
+                self._sessions.move_to_end(session_id)
+            elif create:
+                namespace = self._sessions[session_id] = CacheNamespace(
+                    self.capacity, self.threshold, self.answer_capacity, self.is_valid)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            return namespace
+
+    def drop(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            namespaces = list(self._sessions.values())
+        semantic = [n.semantic.stats() for n in namespaces]
+        answers = [n.answers.stats() for n in namespaces]
+        return {
+            "sessions": len(namespaces),
+            "entries":  sum(s["entries"] for s in semantic),
+            "hits":     sum(s["hits"] for s in semantic),
+            "misses":   sum(s["misses"] for s in semantic),
+            "answer_entries": sum(s["entries"] for s in answers),
+            "answer_hits":    sum(s["hits"] for s in answers),
+        }
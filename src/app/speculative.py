@@ -0,0 +1,122 @@
+"""
+Speculative retrieval (SPECULATIVE_RETRIEVAL=1).
+
+When the local router is not confident, the Groq router call takes hundreds of
+milliseconds during which the vector stores sit idle. This module guesses the
+likely agents from signals that are already computed — the Layer 1 label, the
+keyword heuristics and the kNN router's (unconfident) vote — and starts
+retrieve_documents() for the full question on those stores in parallel with the
+router call.
+
+When the plan arrives, a step consumes a prefetched result only if its agent
+was prefetched and its sub-query is the original question (retrieval is a pure
+function of store and query, so the result is identical). Everything else is
+discarded and counted as wasted work:
+
+    launched   stores prefetched
+    used       prefetches consumed by an agent's direct RAG path
+    wasted     prefetches discarded (agent not in plan, sub-query rewritten,
+               or the agent answered through SQL/ReAct instead)
+    accuracy   used / launched
+    coverage   plan steps served from prefetch / plan steps
+    wasted_ms  retrieval time spent on discarded prefetches
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+import perf
+from async_runtime import to_thread
+from local_router import normalize_labels
+from router_heuristics import guess_agents
+
+ENABLED = os.getenv("SPECULATIVE_RETRIEVAL", "0") == "1"
+_MAX_STORES = int(os.getenv("SPECULATIVE_MAX_STORES", "2"))
+
+_stats = {"requests": 0, "launched": 0, "used": 0, "wasted": 0, "plan_steps": 0, "wasted_ms": 0.0}
+_stats_lock = threading.Lock()
+
+
+def candidate_agents(question: str, layer1_label: str = None, knn_agents: list = None,
+                     limit: int = _MAX_STORES) -> list:
+    """Agent đáng prefetch nhất: mỗi tín hiệu đề cử 1 phiếu, hoà thì ưu tiên kNN → keyword → Layer 1."""
+    votes = {}
+    for source in (knn_agents or [], guess_agents(question), normalize_labels([layer1_label or ""])):
+        for agent in source:
+            votes[agent] = votes.get(agent, 0) + 1
+    return sorted(votes, key=lambda a: votes[a], reverse=True)[:limit]
+
+
+def _same_query(a: str, b: str) -> bool:
+    return " ".join((a or "").split()).casefold() == " ".join((b or "").split()).casefold()
+
+
+class Prefetch:
+    """Các lần retrieve_documents() đang chạy cho 1 câu hỏi, theo vector store (folder)."""
+
+    def __init__(self, question: str, folders: list, retrieve):
+        self.question = question
+        self._tasks = {}
+        self._started = {}
+        self._elapsed = {}
+        self._used = set()
+        for folder in dict.fromkeys(folders):
+            task = asyncio.ensure_future(to_thread(self._timed, folder, retrieve, question))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # lỗi của prefetch bị bỏ: không log
+            self._tasks[folder] = task
+        perf.count("prefetch_launched", len(self._tasks))
+        print(f"   [Speculative] Prefetch {list(self._tasks)}")
+
+    def _timed(self, folder, retrieve, query):
+        self._started[folder] = time.perf_counter()
+        try:
+            return retrieve(folder, query)
+        finally:
+            self._elapsed[folder] = time.perf_counter() - self._started[folder]
+
+    def _spent(self, folder) -> float:
+        if folder in self._elapsed:
+            return self._elapsed[folder]
+        started = self._started.get(folder)
+        return time.perf_counter() - started if started else 0.0
+
+    async def take(self, folder: str, query: str):
+        """Kết quả retrieve_documents(folder, query) đã prefetch, hoặc None."""
+        task = self._tasks.get(folder)
+        if task is None or folder in self._used or not _same_query(query, self.question):
+            return None
+        try:
+            result = await task
+        except Exception as e:
+            print(f"   [Speculative] Prefetch {folder} lỗi: {e}")
+            return None
+        self._used.add(folder)
+        return result
+
+    def finish(self, plan_steps: int):
+        """Ghi metric; prefetch bị bỏ mà còn đang chạy được tính thời gian tới lúc này (không chờ)."""
+        wasted = [f for f in self._tasks if f not in self._used]
+        for folder in wasted:
+            self._tasks[folder].cancel()  # chỉ huỷ được nếu job chưa vào executor
+        wasted_ms = sum(self._spent(f) for f in wasted) * 1000
+        perf.count("prefetch_used", len(self._used))
+        perf.count("prefetch_wasted", len(wasted))
+        with _stats_lock:
+            _stats["requests"] += 1
+            _stats["launched"] += len(self._tasks)
+            _stats["used"] += len(self._used)
+            _stats["wasted"] += len(wasted)
+            _stats["plan_steps"] += plan_steps
+            _stats["wasted_ms"] += wasted_ms
+        print(f"   [Speculative] Dùng {sorted(self._used)} | bỏ {wasted} ({wasted_ms:.0f} ms)")
+
+
+def get_prefetch_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["accuracy"] = round(stats["used"] / stats["launched"], 4) if stats["launched"] else 0.0
+    stats["coverage"] = round(stats["used"] / stats["plan_steps"], 4) if stats["plan_steps"] else 0.0
+    stats["wasted_ms"] = round(stats["wasted_ms"], 1)
+    return stats
@@ -0,0 +1,98 @@
+"""
+Version counters for the vector stores, used to invalidate cached answers.
+
+Every writer (doc_manager uploads/deletions, build_specialized_dbs,
+process_stdportal_jsonl) calls bump(db_path) after changing a store. Cache
+entries record snapshot(folders) taken before retrieval, and is_current()
+rejects an entry as soon as any store it was built from has moved on, so
+uploading a PDF to financial_db only invalidates answers that used
+financial_db.
+
+Counters live in one small SQLite file (STORE_VERSIONS_PATH) so writes from
+other processes are seen too; reads are cached for STORE_VERSION_CHECK_S
+seconds.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+VERSIONS_PATH = os.getenv(
+    "STORE_VERSIONS_PATH", os.path.join(_ROOT_DIR, "data", "processed", "store_versions.sqlite3")
+)
+_CHECK_INTERVAL = float(os.getenv("STORE_VERSION_CHECK_S", "1.0"))
+
+_lock = threading.Lock()
+_cached = {}
+_cached_at = 0.0
+
+
+def store_name(db_path: str) -> str:
+    """Tên store ('academic_db') từ đường dẫn hoặc tên thư mục."""
+    return os.path.basename(os.path.normpath(db_path))
+
+
+def _connect(path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS versions (store TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    return conn
+
+
+def bump(db_path: str, path: str = VERSIONS_PATH) -> int:
+    """Tăng version của store sau khi ghi; trả về version mới."""
+    global _cached, _cached_at
+    name = store_name(db_path)
+    try:
+        conn = _connect(path)
+        try:
+            conn.execute("INSERT INTO versions VALUES (?, 1) "
+                         "ON CONFLICT(store) DO UPDATE SET version = version + 1", (name,))
+            version = conn.execute("SELECT version FROM versions WHERE store = ?", (name,)).fetchone()[0]
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        print(f"[StoreVersions] Không tăng được version của {name}: {e}")
+        return -1
+    with _lock:
+        _cached = {**_cached, name: version}  # không sửa tại chỗ: dict đã trả ra có thể đang là snapshot
+        _cached_at = 0.0  # lần đọc sau lấy lại toàn bộ từ đĩa
+    return version
+
+
+def current(path: str = VERSIONS_PATH) -> dict:
+    """{store: version} (store chưa từng được ghi sau khi có bộ đếm → không có trong dict, coi là 0)."""
+    global _cached, _cached_at
+    with _lock:
+        if time.monotonic() - _cached_at < _CHECK_INTERVAL:
+            return _cached
+    try:
+        conn = _connect(path)
+        try:
+            versions = dict(conn.execute("SELECT store, version FROM versions").fetchall())
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        print(f"[StoreVersions] Không đọc được {path}: {e}")
+        return _cached
+    with _lock:
+        _cached = versions
+        _cached_at = time.monotonic()
+        return versions
+
+
+def snapshot(db_paths, versions: dict = None) -> dict:
+    """{store: version} của các store trong db_paths, lấy từ versions (đọc trước retrieval) hoặc hiện tại."""
+    if versions is None:
+        versions = current()
+    return {store_name(p): versions.get(store_name(p), 0) for p in db_paths}
+
+
+def is_current(recorded: dict) -> bool:
+    """False nếu một store mà entry dựa vào đã đổi version (entry không có thông tin → luôn hợp lệ)."""
+    if not recorded:
+        return True
+    versions = current()
+    return all(versions.get(name, 0) == version for name, version in recorded.items())
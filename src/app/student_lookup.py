@@ -0,0 +1,113 @@
+"""
+Deterministic student lookups for HybridAgent.
+
+Questions that name a student by MSSV or by full name ("sinh viên Nguyễn Văn A")
+are answered with parameterized queries against student_data.db instead of
+letting the LLM write SQL. Output mirrors the `sql_db_query` tool: str() of a
+list of row tuples, or "" when nothing matches.
+
+has_student_record_intent() is the single check for "this question touches
+personal student data", built on the same patterns: agents.py uses it to skip
+Direct RAG and main.py to keep such questions out of the global caches.
+"""
+
+import re
+import sqlite3
+import threading
+
+# MSSV: mã khoa + 2 số khoá (15-29) + 1 ký tự hệ/ngành + 4 số — 52100064, 522H0001.
+_MSSV_PATTERN = re.compile(r"\b(\d(?:1[5-9]|2\d)[a-z0-9]\d{4})\b", re.IGNORECASE)
+# Dãy 8 chữ số ngay sau các từ này là số điện thoại / năm học, không phải MSSV.
+_NUMBER_CONTEXT_PATTERN = re.compile(
+    r"\b(?:hotline|sđt|sdt|số điện thoại|điện thoại|đt|fax|zalo|năm|năm học|khoá|khóa)\s*[:.]?\s*$",
+    re.IGNORECASE,
+)
+_NAME_PREFIX_PATTERN = re.compile(r"\b(?:sinh viên|sv)\s+", re.IGNORECASE)
+_TRAILING_PUNCT = ",.?!:;\"'()"
+# Danh từ chung hay đứng sau "sinh viên"/"sv" và viết hoa: "Sinh viên Năm Nhất", "SV Phòng Đào Tạo".
+_NON_NAME_WORDS = {
+    "năm", "phòng", "khoa", "ngành", "lớp", "trường", "viện", "ban", "trung", "hội", "đoàn",
+    "câu", "hệ", "chương", "đại", "cao", "quốc", "nhà", "tôn", "tdtu", "khoá", "khóa", "kỳ", "học",
+}
+
+_COLUMNS = "mssv, ho_ten, nganh_hoc, diem_tb_tich_luy, diem_ren_luyen, so_tin_chi_tich_luy, no_mon"
+# sqlite3 giữ cache prepared statement theo connection, nên 2 câu lệnh cố định
+# này chỉ được compile một lần cho mỗi thread.
+_QUERY_BY_MSSV = f"SELECT {_COLUMNS} FROM sinh_vien WHERE mssv = ?"
+_QUERY_BY_NAME = f"SELECT {_COLUMNS} FROM sinh_vien WHERE ho_ten LIKE ? LIMIT 10"
+
+# Dấu hiệu hỏi dữ liệu cá nhân dù không nêu được MSSV / họ tên đầy đủ.
+_RECORD_INTENT_PATTERNS = [
+    re.compile(r"\b(mssv|mã số sinh viên|mã sinh viên)\b", re.IGNORECASE),
+    re.compile(r"\b(của|về)\s+(tôi|em|mình|tớ)\b", re.IGNORECASE),
+    re.compile(r"\b(danh sách|bao nhiêu|những|các)\s+sinh viên\b.*\b(gpa|điểm|tín chỉ|nợ môn|ngành)\b", re.IGNORECASE),
+    re.compile(r"\bsinh viên nào\b", re.IGNORECASE),
+    re.compile(r"\bnợ môn\b", re.IGNORECASE),
+]
+_NAME_MENTION_PATTERN = re.compile(r"\b(?:sinh viên|sv)\s+(\w+)", re.IGNORECASE)
+
+_local = threading.local()
+
+
+def _extract_name(text: str) -> str | None:
+    for m in _NAME_PREFIX_PATTERN.finditer(text):
+        parts = []
+        for token in text[m.end():].split():
+            word = token.strip(_TRAILING_PUNCT)
+            if not word or not word[0].isupper() or not word.isalpha():
+                break
+            parts.append(word)
+            if token[-1] in _TRAILING_PUNCT:
+                break
+        # Tên 1 chữ ("sinh viên B") quá mơ hồ → để LLM xử lý.
+        if len(parts) >= 2 and parts[0].casefold() not in _NON_NAME_WORDS:
+            return " ".join(parts)
+    return None
+
+
+def match_student_query(text: str):
+    """Trả về ("mssv", value) | ("name", value) | None."""
+    for m in _MSSV_PATTERN.finditer(text):
+        if m.group(1).isdigit() and _NUMBER_CONTEXT_PATTERN.search(text[:m.start()]):
+            continue
+        return "mssv", m.group(1).upper()
+    name = _extract_name(text)
+    if name:
+        return "name", name
+    return None
+
+
+def has_student_record_intent(text: str) -> bool:
+    """Câu hỏi đụng tới dữ liệu cá nhân sinh viên (MSSV, họ tên, "của tôi", nợ môn, ...)."""
+    if match_student_query(text) is not None:
+        return True
+    if any(p.search(text) for p in _RECORD_INTENT_PATTERNS):
+        return True
+    # "sinh viên B": tên 1 chữ không đủ để tra thẳng nhưng vẫn là hỏi về 1 người cụ thể.
+    return any(m.group(1)[0].isupper() and m.group(1).casefold() not in _NON_NAME_WORDS
+               for m in _NAME_MENTION_PATTERN.finditer(text))
+
+
+def _get_connection(db_path: str):
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        conns[db_path] = conn
+    return conn
+
+
+def lookup_student(db_path: str, kind: str, value: str) -> str:
+    if kind == "mssv":
+        sql, params = _QUERY_BY_MSSV, (value,)
+    elif kind == "name":
+        sql, params = _QUERY_BY_NAME, (f"%{value}%",)
+    else:
+        raise ValueError(f"Kiểu tra cứu không hợp lệ: {kind}")
+
+    rows = _get_connection(db_path).execute(sql, params).fetchall()
+    if not rows:
+        return ""
+    return str([tuple(r) for r in rows])
@@ -0,0 +1,18 @@
+"""
+Vietnamese diacritic folding shared by ingestion (build_specialized_dbs), the
+BM25 sidecar (lexical_index), the keyword router (router_heuristics) and the
+exact-match cache key (semantic_cache).
+
+    fold_diacritics("Đăng ký học phần") -> "Dang ky hoc phan"
+
+"đ"/"Đ" are mapped explicitly because NFKD does not decompose them.
+"""
+
+import unicodedata
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt, giữ nguyên hoa/thường và các ký tự khác."""
+    text = (text or "").replace("đ", "d").replace("Đ", "D")
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in normalized if not unicodedata.combining(ch))
@@ -0,0 +1,142 @@
+"""
+Process-wide pool of Chroma stores.
+
+Opening a chromadb.PersistentClient re-reads the SQLite metadata and loads the
+HNSW segment from disk. The pool opens each store directory once, keeps the
+client / Chroma wrapper resident and reopens it only when the files on disk
+change (e.g. build_specialized_dbs.py was re-run by another process).
+"""
+
+import os
+import re
+import threading
+import time
+
+import chromadb
+from langchain_chroma import Chroma
+
+_CHECK_INTERVAL = float(os.getenv("CHROMA_POOL_CHECK_INTERVAL", "2.0"))  # giây
+# Chỉ các thư mục segment (tên UUID) của Chroma; bỏ qua sidecar như lexical_index/.
+_SEGMENT_DIR_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def _store_signature(db_path: str):
+    """Dấu vết trên đĩa của một store: đổi khi store bị rebuild/ghi bởi process khác."""
+    sqlite_path = os.path.join(db_path, "chroma.sqlite3")
+    try:
+        st = os.stat(sqlite_path)
+    except OSError:
+        return None
+    segments = []
+    try:
+        for name in sorted(os.listdir(db_path)):
+            seg_path = os.path.join(db_path, name)
+            if _SEGMENT_DIR_PATTERN.match(name) and os.path.isdir(seg_path):
+                segments.append((name, os.stat(seg_path).st_mtime_ns))
+    except OSError:
+        pass
+    return (st.st_ino, st.st_mtime_ns, st.st_size, tuple(segments))
+
+
+class _StoreHandle:
+    def __init__(self, client, signature):
+        self.client = client
+        self.signature = signature
+        self.checked_at = time.monotonic()
+        self.wrappers = {}   # collection_name -> Chroma
+
+
+class ChromaStorePool:
+
+    def __init__(self, check_interval: float = _CHECK_INTERVAL):
+        self._check_interval = check_interval
+        self._lock = threading.RLock()
+        self._handles = {}
+        self._stats = {"opens": 0, "hits": 0, "reloads": 0}
+
+    def _open_locked(self, db_path: str, reload: bool = False):
+        handle = _StoreHandle(chromadb.PersistentClient(path=db_path), _store_signature(db_path))
+        self._handles[db_path] = handle
+        self._stats["reloads" if reload else "opens"] += 1
+        return handle
+
+    def _reset_locked(self, db_path: str):
+        # chromadb giữ 1 System dùng chung cho mỗi path trong process; phải quên System
+        # này thì PersistentClient mới thực sự đọc lại HNSW từ đĩa. clear_system_cache()
+        # chỉ quên System (không stop): client/Chroma cũ mà thread khác còn đang query giữ
+        # server của System cũ nên chạy xong bình thường rồi được GC. Handle của các store
+        # khác cũng giữ server riêng nên vẫn dùng tiếp, chỉ store đã đổi được mở lại.
+        self._handles.pop(db_path, None)
+        try:
+            chromadb.api.client.SharedSystemClient.clear_system_cache()
+        except Exception as e:
+            print(f"[ChromaPool] Không thể xoá system cache: {e}")
+
+    def _get_handle_locked(self, db_path: str):
+        handle = self._handles.get(db_path)
+        if handle is None:
+            return self._open_locked(db_path)
+
+        now = time.monotonic()
+        if now - handle.checked_at < self._check_interval:
+            self._stats["hits"] += 1
+            return handle
+
+        handle.checked_at = now
+        signature = _store_signature(db_path)
+        if signature == handle.signature:
+            self._stats["hits"] += 1
+            return handle
+
+        print(f"[ChromaPool] Store thay đổi trên đĩa, mở lại: {db_path}")
+        self._reset_locked(db_path)
+        return self._open_locked(db_path, reload=True)
+
+    def get_client(self, db_path: str):
+        db_path = os.path.abspath(db_path)
+        with self._lock:
+            return self._get_handle_locked(db_path).client
+
+    def get_store(self, db_path: str, embedding_function, collection_name: str = "langchain",
+                  collection_metadata: dict | None = None) -> Chroma:
+        db_path = os.path.abspath(db_path)
+        with self._lock:
+            handle = self._get_handle_locked(db_path)
+            store = handle.wrappers.get(collection_name)
+            if store is None or store.embeddings is not embedding_function:
+                store = Chroma(
+                    client=handle.client,
+                    embedding_function=embedding_function,
+                    collection_name=collection_name,
+                    collection_metadata=collection_metadata,
+                )
+                handle.wrappers[collection_name] = store
+            return store
+
+    def mark_written(self, db_path: str):
+        """Gọi sau khi chính process này ghi vào store: cập nhật signature, không reload."""
+        db_path = os.path.abspath(db_path)
+        with self._lock:
+            handle = self._handles.get(db_path)
+            if handle is not None:
+                handle.signature = _store_signature(db_path)
+                handle.checked_at = time.monotonic()
+
+    def invalidate(self, db_path: str | None = None):
+        """Bỏ handle của 1 store (db_path=None: mọi store đang mở)."""
+        with self._lock:
+            paths = list(self._handles) if db_path is None else [os.path.abspath(db_path)]
+            for path in paths:
+                if path in self._handles:
+                    self._reset_locked(path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "resident": len(self._handles)}
+
+
+_POOL = ChromaStorePool()
+
+
+def get_store_pool() -> ChromaStorePool:
+    return _POOL
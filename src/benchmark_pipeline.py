@@ -0,0 +1,268 @@
+"""
+benchmark_pipeline.py
+=====================
+Đo latency theo từng stage của pipeline hỏi đáp (rewrite → cache → Layer 1 →
+router → agents/retrieval → synthesis), số lượt gọi LLM, token và tỉ lệ cache hit.
+
+Mặc định chạy offline với LLM giả lập (LLM_BACKEND=fake) để kết quả ổn định
+giữa các lần chạy; --llm live dùng Groq/Gemini thật. --llm record chạy live và
+ghi lại completion vào cassette, --llm replay phát lại cassette đó offline
+(kèm latency đã ghi, xem llm_backend.py).
+
+Cache trên đĩa (semantic + answer) của lần chạy nằm trong thư mục tạm (hoặc
+--cache-dir) và được xoá trước vòng đầu, nên không đọc/ghi cache của app.
+
+Chạy:
+    python src/benchmark_pipeline.py --limit 30                  # đo + lưu kết quả
+    python src/benchmark_pipeline.py --repeat 2                  # lần 2 đo đường cache hit
+    python src/benchmark_pipeline.py --save-baseline             # lưu làm baseline
+    python src/benchmark_pipeline.py --baseline evaluate/benchmark/baseline.json
+                                                                # so sánh, exit 1 nếu chậm hơn
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+app_path = os.path.join(project_root, "src", "app")
+
+for path in [app_path, project_root]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+DEFAULT_FILES = [
+    os.path.join(project_root, "data", "eval", "data.csv"),
+    os.path.join(project_root, "data", "eval", "data_labels.csv"),
+]
+OUT_DIR = os.path.join(project_root, "evaluate", "benchmark")
+PERCENTILES = (50, 95, 99)
+
+
+def load_questions(filepath: str = None, limit: int = None) -> list[str]:
+    candidates = [filepath] if filepath else DEFAULT_FILES
+    for path in candidates:
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8", newline="") as f:
+                rows = list(csv.DictReader(f))
+            questions = [
+                (row.get("question_text") or row.get("Question") or "").strip()
+                for row in rows
+            ]
+            questions = [q for q in questions if q]
+            return questions[:limit] if limit else questions
+    raise FileNotFoundError(f"Không tìm thấy file câu hỏi: {candidates}")
+
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {f"p{p}": 0.0 for p in PERCENTILES}
+    arr = np.asarray(values, dtype=np.float64) * 1000.0
+    return {f"p{p}": round(float(np.percentile(arr, p)), 2) for p in PERCENTILES}
+
+
+def run_benchmark(questions: list[str], provider: str, repeat: int = 1) -> tuple:
+    import perf
+    import main
+
+    # Số liệu không phụ thuộc cache còn sót từ lần chạy trước.
+    main.clear_cache(persistent=True)
+    records = []
+    for round_idx in range(repeat):
+        for i, question in enumerate(questions):
+            with perf.trace_request() as trace:
+                try:
+                    _, _, stream = main.process_query_streaming(question, provider)
+                    if stream is not None:
+                        for _ in stream:
+                            pass
+                    error = ""
+                except Exception as e:
+                    error = str(e)
+            records.append({
+                "round": round_idx,
+                "index": i,
+                "question": question,
+                "total": trace.wall_seconds,
+                "stages": dict(trace.stages),
+                "counters": dict(trace.counters),
+                "error": error,
+            })
+            print(f"  [{round_idx}:{i:>3}] {trace.wall_seconds * 1000:8.1f} ms | "
+                  f"LLM {trace.counters.get('llm_calls', 0)} | {question[:60]}")
+
+    return records, _global_stats(main)
+
+
+def _global_stats(main) -> dict:
+    from embeddings import query_embedding_cache_stats
+    from vector_store_pool import get_store_pool
+    from agents import get_fast_path_stats
+    from speculative import get_prefetch_stats
+    return {
+        "semantic_cache": main._semantic_cache.stats(),
+        "answer_cache": main._answer_cache.stats(),
+        "session_caches": main._session_caches.stats(),
+        "query_embedding_lru": query_embedding_cache_stats(),
+        "vector_store_pool": get_store_pool().stats(),
+        "agent_paths": get_fast_path_stats(),
+        "speculative_retrieval": get_prefetch_stats(),
+    }
+
+
+def summarize(records: list, global_stats: dict) -> dict:
+    stage_names = sorted({name for r in records for name in r["stages"]})
+    stages = {}
+    for name in stage_names:
+        values = [r["stages"][name] for r in records if name in r["stages"]]
+        stages[name] = {"count": len(values), **_percentiles(values)}
+
+    n = len(records) or 1
+
+    def total(name: str) -> int:
+        return sum(r["counters"].get(name, 0) for r in records)
+
+    hits, misses = total("cache_hit"), total("cache_miss")
+    # Mỗi request được phục vụ bởi tối đa 1 tier: answer cache → khớp chính xác → semantic.
+    tiers = {
+        "answer":   {"hits": total("answer_cache_hit"), "misses": total("answer_cache_miss")},
+        "exact":    {"hits": total("cache_exact_hit")},
+        "semantic": {"hits": hits, "misses": misses},
+    }
+    served = sum(1 for r in records
+                 if any(r["counters"].get(c, 0) for c in ("answer_cache_hit", "cache_exact_hit", "cache_hit")))
+    return {
+        "requests": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "total_ms": _percentiles([r["total"] for r in records]),
+        "stages_ms": stages,
+        "llm_calls_per_request": round(sum(r["counters"].get("llm_calls", 0) for r in records) / n, 3),
+        "prompt_tokens_per_request": round(sum(r["counters"].get("prompt_tokens", 0) for r in records) / n, 1),
+        "completion_tokens_per_request": round(sum(r["counters"].get("completion_tokens", 0) for r in records) / n, 1),
+        "semantic_cache_hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        "cache_tiers": tiers,
+        "served_from_cache_rate": round(served / len(records), 4) if records else 0.0,
+        "global": global_stats,
+    }
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Danh sách regression: percentile chậm hơn baseline quá `tolerance` (tỉ lệ), hoặc tốn thêm LLM call."""
+    regressions = []
+
+    def check(label, current, base):
+        for key in (f"p{p}" for p in PERCENTILES):
+            cur, ref = current.get(key, 0.0), base.get(key, 0.0)
+            if ref > 0 and cur > ref * (1 + tolerance):
+                regressions.append(f"{label} {key}: {ref:.1f} → {cur:.1f} ms (+{(cur / ref - 1) * 100:.0f}%)")
+
+    check("total", summary["total_ms"], baseline.get("total_ms", {}))
+    for name, current in summary["stages_ms"].items():
+        if name in baseline.get("stages_ms", {}):
+            check(name, current, baseline["stages_ms"][name])
+
+    cur_calls = summary["llm_calls_per_request"]
+    ref_calls = baseline.get("llm_calls_per_request", cur_calls)
+    if cur_calls > ref_calls + 1e-9:
+        regressions.append(f"llm_calls_per_request: {ref_calls} → {cur_calls}")
+    return regressions
+
+
+def save_results(records: list, summary: dict, out_dir: str, tag: str) -> tuple:
+    os.makedirs(out_dir, exist_ok=True)
+    stage_names = sorted({name for r in records for name in r["stages"]})
+    counter_names = sorted({name for r in records for name in r["counters"]})
+
+    csv_path = os.path.join(out_dir, f"requests_{tag}.csv")
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["round", "index", "question", "total_ms"]
+                        + [f"{s}_ms" for s in stage_names] + counter_names + ["error"])
+        for r in records:
+            writer.writerow(
+                [r["round"], r["index"], r["question"], round(r["total"] * 1000, 2)]
+                + [round(r["stages"].get(s, 0.0) * 1000, 2) for s in stage_names]
+                + [r["counters"].get(c, 0) for c in counter_names]
+                + [r["error"]]
+            )
+
+    json_path = os.path.join(out_dir, f"summary_{tag}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return csv_path, json_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark latency theo stage của pipeline")
+    parser.add_argument("--file", type=str, default=None,
+                        help="CSV câu hỏi (cột question_text hoặc Question; mặc định data/eval/data.csv)")
+    parser.add_argument("--limit", type=int, default=None, help="Số câu tối đa")
+    parser.add_argument("--repeat", type=int, default=1, help="Số vòng chạy lại toàn bộ câu hỏi")
+    parser.add_argument("--provider", type=str, default="groq_llama", choices=["groq_llama", "gemini"])
+    parser.add_argument("--llm", type=str, default="fake", choices=["fake", "live", "record", "replay"],
+                        help="fake: LLM giả lập offline (mặc định); live: gọi API thật; "
+                             "record/replay: ghi/phát lại cassette (LLM_CASSETTE_PATH)")
+    parser.add_argument("--out-dir", type=str, default=OUT_DIR)
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Thư mục cache trên đĩa cho lần chạy (mặc định: thư mục tạm, không đụng cache của app)")
+    parser.add_argument("--baseline", type=str, default=None, help="summary JSON để so sánh")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Ngưỡng regression (tỉ lệ, mặc định 0.2 = chậm hơn 20%%)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Ghi summary lần chạy này ra <out-dir>/baseline.json")
+    args = parser.parse_args()
+
+    # Phải đặt trước khi import main: các LLM và cache được tạo lúc import.
+    os.environ["LLM_BACKEND"] = args.llm
+    os.environ["SEMANTIC_CACHE_DIR"] = args.cache_dir or tempfile.mkdtemp(prefix="benchmark_cache_")
+
+    questions = load_questions(args.file, args.limit)
+    print(f"Benchmark {len(questions)} câu × {args.repeat} vòng | LLM: {os.environ['LLM_BACKEND']}")
+
+    records, global_stats = run_benchmark(questions, args.provider, args.repeat)
+    summary = summarize(records, global_stats)
+    summary["evaluated_at"] = datetime.now().isoformat()
+    summary["llm_backend"] = os.environ["LLM_BACKEND"]
+    summary["provider"] = args.provider
+
+    tag = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_path, json_path = save_results(records, summary, args.out_dir, tag)
+
+    print(f"\n{'='*60}")
+    print(f"  Tổng: " + " | ".join(f"{k}={v:.1f}ms" for k, v in summary["total_ms"].items()))
+    for name, s in summary["stages_ms"].items():
+        print(f"  {name:<18} n={s['count']:<4} " + " | ".join(f"p{p}={s[f'p{p}']:.1f}" for p in PERCENTILES))
+    print(f"  LLM calls/req: {summary['llm_calls_per_request']} | "
+          f"Phục vụ từ cache: {summary['served_from_cache_rate'] * 100:.1f}% "
+          f"(answer {summary['cache_tiers']['answer']['hits']} | exact {summary['cache_tiers']['exact']['hits']}"
+          f" | semantic {summary['cache_tiers']['semantic']['hits']})")
+    print(f"  Đã lưu: {os.path.relpath(csv_path, project_root)}, {os.path.relpath(json_path, project_root)}")
+
+    if args.save_baseline:
+        baseline_path = os.path.join(args.out_dir, "baseline.json")
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"  Đã lưu baseline: {os.path.relpath(baseline_path, project_root)}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline, args.tolerance)
+        if regressions:
+            print(f"\n  ❌ {len(regressions)} regression so với baseline:")
+            for line in regressions:
+                print(f"     - {line}")
+            sys.exit(1)
+        print("\n  ✅ Không có regression so với baseline.")
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@ import os
 import shutil
 import json
 import re
-import unicodedata
+import hashlib
+import argparse
 
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
 os.environ["CHROMA_ANONYMIZED_TELEMETRY"] = "False"
@@ -10,12 +11,15 @@ os.environ["CHROMA_ANONYMIZED_TELEMETRY"] = "False"
 import sys
 from dotenv import load_dotenv
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
+import chromadb
 
 _APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
 if _APP_DIR not in sys.path:
     sys.path.insert(0, _APP_DIR)
-from embeddings import E5Embeddings, get_shared_embedding_model
+from embeddings import get_ingestion_embedding_model
+from lexical_index import build_index_from_collection
+from text_normalize import fold_diacritics
+import store_versions
 
 load_dotenv()
 
@@ -31,15 +35,12 @@ STORES = {
     "GENERAL_DB": os.path.join(PROCESSED_DIR, 'general_db'),
 }
 
+MANIFEST_NAME = "build_manifest.json"
+_EMBED_BATCH_SIZE = 64
+
 
 def _normalize_text(text: str) -> str:
-    if not text:
-        return ""
-    normalized = unicodedata.normalize("NFKD", text)
-    no_diacritics = "".join(ch for ch in normalized if not unicodedata.combining(ch))
-    lowered = no_diacritics.lower()
-    cleaned = re.sub(r"[^a-z0-9]+", " ", lowered)
-    return re.sub(r"\s+", " ", cleaned).strip()
+    return re.sub(r"[^a-z0-9]+", " ", fold_diacritics(text).lower()).strip()
 
 
 _URL_ADMISSION_KEYWORDS = [
@@ -144,21 +145,126 @@ def load_stdportal_jsonl(docs_map):
     for db, n in dist.items():
         if n: print(f"      {db}: {n} docs")
 
-def main():
-    print("--- REBUILDING DATA FOR GROQ STACK ---")
-    
-    if os.path.exists(PROCESSED_DIR):
-        try:
-            shutil.rmtree(PROCESSED_DIR)
-        except: pass
-    os.makedirs(PROCESSED_DIR, exist_ok=True)
+def _clean_metadata(meta: dict) -> dict:
+    # Chroma không nhận giá trị None trong metadata.
+    return {k: v for k, v in meta.items() if v is not None}
+
+
+def _content_hash(text: str, metadata: dict) -> str:
+    payload = json.dumps({"text": text, "metadata": metadata}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _assign_chunk_ids(docs: list) -> dict:
+    """
+    ID tất định cho từng chunk, suy ra từ nội dung (text + metadata); chỉ các chunk trùng
+    hệt nhau mới cần thêm số thứ tự. Chèn/xoá/sửa 1 chunk chỉ ảnh hưởng ID của chính nó
+    (chunk sửa = xoá ID cũ + thêm ID mới), các chunk khác trong trang giữ nguyên.
+    Trả về {chunk_id: {"text", "metadata", "hash"}}.
+    """
+    seen = {}
+    chunks = {}
+    for d in docs:
+        meta = _clean_metadata(d["metadata"])
+        content_hash = _content_hash(d["text"], meta)
+        n = seen.get(content_hash, 0)
+        seen[content_hash] = n + 1
+        chunk_id = hashlib.sha1(f"{content_hash}#{n}".encode("utf-8")).hexdigest()
+        chunks[chunk_id] = {"text": d["text"], "metadata": meta, "hash": content_hash}
+    return chunks
+
+
+def _load_manifest(store_path: str) -> dict:
+    path = os.path.join(store_path, MANIFEST_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _save_manifest(store_path: str, manifest: dict):
+    path = os.path.join(store_path, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def sync_store(db_name: str, docs: list, embedding_model, full: bool = False) -> tuple:
+    """Đồng bộ 1 store với danh sách chunk mong muốn; chỉ embed chunk mới/đổi. Trả về (upserted, deleted)."""
+    save_path = STORES[db_name]
+    if full and os.path.exists(save_path):
+        shutil.rmtree(save_path)
+    if not docs and not os.path.exists(save_path):
+        return 0, 0
+    os.makedirs(save_path, exist_ok=True)
+
+    desired = _assign_chunk_ids(docs)
+    client = chromadb.PersistentClient(path=save_path)
+    collection = client.get_or_create_collection(name="langchain", metadata={"hnsw:space": "cosine"})
+
+    manifest = _load_manifest(save_path)
+    known = manifest.get("chunks")
+    # model_id gồm cả backend (torch / onnx / onnx-int8): đổi backend → embed lại toàn bộ store,
+    # kể cả chunk doc_manager thêm (xem bên dưới).
+    same_model = manifest.get("model") == embedding_model.model_id
+    existing_ids = set(collection.get(include=[])["ids"])
+    # Chỉ xoá chunk do script này quản lý; tài liệu giảng viên thêm qua doc_manager được giữ lại.
+    # Store cũ chưa có manifest (ID ngẫu nhiên) → coi toàn bộ là do build tạo ra.
+    managed = set(known) if known is not None else existing_ids
+    known = known or {}
+
+    to_upsert = [
+        cid for cid, c in desired.items()
+        if cid not in existing_ids or not same_model or known.get(cid) != c["hash"]
+    ]
+    to_delete = sorted((managed & existing_ids) - desired.keys())
+
+    for i in range(0, len(to_upsert), _EMBED_BATCH_SIZE):
+        batch = to_upsert[i:i + _EMBED_BATCH_SIZE]
+        texts = [desired[cid]["text"] for cid in batch]
+        collection.upsert(
+            ids=batch,
+            embeddings=embedding_model.embed_documents(texts),
+            documents=texts,
+            metadatas=[desired[cid]["metadata"] for cid in batch],
+        )
+        print(f"   Embedded {min(i + _EMBED_BATCH_SIZE, len(to_upsert))}/{len(to_upsert)}")
+    for i in range(0, len(to_delete), 5000):
+        collection.delete(ids=to_delete[i:i + 5000])
+
+    # Đổi backend: chunk ngoài manifest (doc_manager thêm) cũng phải embed lại,
+    # đọc lại nội dung/metadata từ collection vì script không có bản gốc.
+    foreign = sorted(existing_ids - managed) if not same_model else []
+    for i in range(0, len(foreign), _EMBED_BATCH_SIZE):
+        got = collection.get(ids=foreign[i:i + _EMBED_BATCH_SIZE], include=["documents", "metadatas"])
+        collection.upsert(
+            ids=got["ids"],
+            embeddings=embedding_model.embed_documents(got["documents"]),
+            documents=got["documents"],
+            metadatas=got["metadatas"],
+        )
+        print(f"   Re-embedded {min(i + _EMBED_BATCH_SIZE, len(foreign))}/{len(foreign)} tài liệu ngoài manifest")
+    to_upsert += foreign
+
+    index_meta = os.path.join(save_path, "lexical_index", "meta.json")
+    if to_upsert or to_delete or not os.path.exists(index_meta):
+        build_index_from_collection(save_path, collection)
+    if to_upsert or to_delete or full:
+        store_versions.bump(save_path)
 
-    print("   Loading Embedding Model (intfloat/multilingual-e5-base)...")
-    embedding_model = get_shared_embedding_model()
+    _save_manifest(save_path, {
+        "model":  embedding_model.model_id,
+        "chunks": {cid: c["hash"] for cid, c in desired.items()},
+    })
+    return len(to_upsert), len(to_delete)
 
+
+def collect_documents() -> dict:
     docs_map = {key: [] for key in STORES.keys()}
 
-    files = [f for f in os.listdir(RAW_DATA_DIR) if f.endswith('.json')]
+    files = sorted(f for f in os.listdir(RAW_DATA_DIR) if f.endswith('.json'))
     print(f"   [Nguồn 1] Found {len(files)} raw JSON files.")
     
     for filename in files:
@@ -192,24 +298,34 @@ def main():
 
     print("\n   [Nguồn 2] Nạp data.jsonl từ stdportal...")
     load_stdportal_jsonl(docs_map)
+    return docs_map
+
+
+def main(full: bool = False):
+    print(f"--- {'REBUILDING' if full else 'SYNCING'} DATA FOR GROQ STACK ---")
+    # Chỉ đụng tới thư mục của 5 vector store; student_data.db / users.db giữ nguyên.
+    os.makedirs(PROCESSED_DIR, exist_ok=True)
+
+    # Model E5 chỉ được load khi có chunk chưa nằm trong embedding cache.
+    embedding_model = get_ingestion_embedding_model()
+
+    docs_map = collect_documents()
 
     total = sum(len(v) for v in docs_map.values())
     print(f"\n   Tổng chunks toàn bộ nguồn: {total}")
     for db_name, docs in docs_map.items():
-        if not docs: continue
-        print(f"\n--- Building {db_name} ({len(docs)} chunks)... ---")
-        save_path = STORES[db_name]
-        
-        Chroma.from_texts(
-            texts=[d['text'] for d in docs],
-            embedding=embedding_model,
-            metadatas=[d['metadata'] for d in docs],
-            persist_directory=save_path,
-            collection_metadata={"hnsw:space": "cosine"}, 
-        )
-        print(f"   Saved {db_name}")
+        print(f"\n--- Syncing {db_name} ({len(docs)} chunks)... ---")
+        upserted, deleted = sync_store(db_name, docs, embedding_model, full=full)
+        print(f"   {db_name}: {upserted} chunk mới/đổi, {deleted} chunk bị xoá")
+
+    print(f"\n   Embedding cache: {embedding_model.stats['cached']} lấy từ cache, "
+          f"{embedding_model.stats['computed']} tính mới")
 
     print("\n=== DATA READY ===")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build/sync các vector store chuyên biệt")
+    parser.add_argument("--full", action="store_true",
+                        help="Xoá và dựng lại toàn bộ 5 vector store (mặc định: incremental)")
+    args = parser.parse_args()
+    main(full=args.full)
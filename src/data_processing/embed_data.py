@@ -1,6 +1,7 @@
 
 import json
 import os
+import sys
 import shutil
 import time 
 from dotenv import load_dotenv
@@ -9,6 +10,11 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings 
 from langchain_community.vectorstores import Chroma
 
+_APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+if _APP_DIR not in sys.path:
+    sys.path.insert(0, _APP_DIR)
+from embeddings import with_embedding_cache
+
 print("--- HUNKING & EMBEDDING (LOCAL) ---")
 
 load_dotenv()
@@ -61,11 +67,13 @@ try:
     model_kwargs = {'device': 'cpu'}
     encode_kwargs = {'normalize_embeddings': False}
     
-    embedding_model = HuggingFaceEmbeddings(
+    hf_model = HuggingFaceEmbeddings(
         model_name=model_name,
         model_kwargs=model_kwargs,
         encode_kwargs=encode_kwargs
     )
+    # Đọc qua embedding cache trên đĩa: chạy lại script không phải embed lại text cũ.
+    embedding_model = with_embedding_cache(lambda: hf_model, model_id=f"{model_name}|norm=False")
     
     print(f"   Đã cấu hình model: {model_name}")
     print("   (Lần chạy đầu tiên sẽ mất 1-2 phút để TẢI model về máy...)")
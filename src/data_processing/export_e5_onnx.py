@@ -0,0 +1,223 @@
+"""
+Xuất E5 (intfloat/multilingual-e5-base) sang ONNX + bản int8 cho EMBEDDING_BACKEND=onnx / onnx-int8,
+và báo cáo parity retrieval so với backend torch trên các vector store hiện có.
+
+    python src/data_processing/export_e5_onnx.py                 # export + parity report
+    python src/data_processing/export_e5_onnx.py --report-only   # chỉ chạy report
+    python src/data_processing/export_e5_onnx.py --queries data/eval/data.csv --k 5
+
+Report (evaluate/embedding_parity/report.json), cho từng backend ONNX:
+  - query_cosine: cosine giữa vector query ONNX và torch
+  - recall@k: tỉ lệ top-k (theo embedding đã lưu trong store) giữ nguyên khi đổi backend query
+  - passage_cosine: vector passage ONNX so với vector đã lưu trong store
+    (thấp → phải rebuild store nếu dùng ONNX cho ingestion)
+  - latency query (ms/câu) và ingestion (ms/chunk)
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+os.environ["ANONYMIZED_TELEMETRY"] = "False"
+os.environ["CHROMA_ANONYMIZED_TELEMETRY"] = "False"
+
+_APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+if _APP_DIR not in sys.path:
+    sys.path.insert(0, _APP_DIR)
+from embeddings import DEFAULT_MODEL_NAME, ONNX_FILES, get_embedding_model, onnx_model_path
+from vector_store_pool import get_store_pool
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROCESSED_DIR = os.path.join(BASE_DIR, 'data', 'processed')
+DEFAULT_QUERIES = os.path.join(BASE_DIR, 'data', 'eval', 'data.csv')
+REPORT_DIR = os.path.join(BASE_DIR, 'evaluate', 'embedding_parity')
+STORE_NAMES = ['academic_db', 'financial_db', 'admission_db', 'student_life_db', 'general_db']
+OPSET = 14
+
+
+def export(model_name=DEFAULT_MODEL_NAME):
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    fp32_path = onnx_model_path(model_name, "onnx")
+    int8_path = onnx_model_path(model_name, "onnx-int8")
+    out_dir = os.path.dirname(fp32_path)
+    os.makedirs(out_dir, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(out_dir)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    sample = tokenizer(["query: học phí ngành CNTT"], return_tensors="pt")
+
+    print(f"   Export ONNX (opset {OPSET}) → {fp32_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=OPSET,
+        )
+    print(f"   Lượng tử hoá int8 (dynamic) → {int8_path}")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    for path in (fp32_path, int8_path):
+        print(f"      {os.path.basename(path)}: {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+
+
+def load_queries(path, limit):
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+        queries = [(r.get('question_text') or r.get('Question') or '').strip() for r in rows]
+        queries = [q for q in queries if q]
+        if queries:
+            return queries[:limit]
+    print(f"   [CẢNH BÁO] Không đọc được câu hỏi từ {path} — dùng câu đầu của các chunk làm query.")
+    return []
+
+
+def load_store(name, sample_passages):
+    path = os.path.join(PROCESSED_DIR, name)
+    if not os.path.exists(path):
+        return None
+    col = get_store_pool().get_client(path).get_collection("langchain")
+    got = col.get(include=["embeddings", "documents"])
+    if not got["ids"]:
+        return None
+    rng = np.random.default_rng(42)
+    sample = rng.choice(len(got["ids"]), size=min(sample_passages, len(got["ids"])), replace=False)
+    return {
+        "matrix": np.asarray(got["embeddings"], dtype=np.float32),
+        "documents": got["documents"],
+        "sample": sample,
+    }
+
+
+def _cosine_rows(a, b):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+
+
+def _timed_queries(model, queries):
+    t0 = time.perf_counter()
+    vectors = [model._encode([f"query: {q}"])[0] for q in queries]  # không qua LRU để đo đúng latency
+    return np.asarray(vectors, dtype=np.float32), (time.perf_counter() - t0) / max(len(queries), 1) * 1000
+
+
+def _timed_passages(model, texts):
+    t0 = time.perf_counter()
+    vectors = model.embed_documents(texts)
+    return np.asarray(vectors, dtype=np.float32), (time.perf_counter() - t0) / max(len(texts), 1) * 1000
+
+
+def parity_report(queries_path, k, limit, sample_passages, backends):
+    reference = get_embedding_model(backend="torch")
+    candidates = {}
+    for backend in backends:
+        if not os.path.isfile(onnx_model_path(DEFAULT_MODEL_NAME, backend)):
+            print(f"   Bỏ qua {backend}: chưa export.")
+            continue
+        candidates[backend] = get_embedding_model(backend=backend)
+
+    queries = load_queries(queries_path, limit)
+    report = {"generated_at": datetime.now().isoformat(), "k": k, "stores": {}, "summary": {}}
+    totals = {b: {"query_cos": [], "recall": [], "passage_cos": [], "query_ms": [], "passage_ms": []}
+              for b in ["torch", *candidates]}
+
+    for name in STORE_NAMES:
+        store = load_store(name, sample_passages)
+        if store is None:
+            print(f"   {name}: không có dữ liệu, bỏ qua.")
+            continue
+        store_queries = queries or [store["documents"][i].split('.')[0][:200] for i in store["sample"]]
+        passages = [store["documents"][i] for i in store["sample"]]
+        stored = store["matrix"][store["sample"]]
+
+        ref_q, ref_q_ms = _timed_queries(reference, store_queries)
+        ref_p, ref_p_ms = _timed_passages(reference, passages)
+        ref_top = np.argsort(-(ref_q @ store["matrix"].T), axis=1)[:, :k]
+        totals["torch"]["query_ms"].append(ref_q_ms)
+        totals["torch"]["passage_ms"].append(ref_p_ms)
+        totals["torch"]["passage_cos"].extend(_cosine_rows(ref_p, stored).tolist())
+
+        entry = {"chunks": int(len(store["matrix"])), "queries": len(store_queries),
+                 "torch": {"query_ms": ref_q_ms, "passage_ms": ref_p_ms}}
+        for backend, model in candidates.items():
+            q, q_ms = _timed_queries(model, store_queries)
+            p, p_ms = _timed_passages(model, passages)
+            top = np.argsort(-(q @ store["matrix"].T), axis=1)[:, :k]
+            recall = [len(set(a) & set(b)) / k for a, b in zip(top.tolist(), ref_top.tolist())]
+            query_cos = _cosine_rows(q, ref_q)
+            passage_cos = _cosine_rows(p, stored)
+            entry[backend] = {
+                "query_cosine_mean": float(query_cos.mean()),
+                f"recall@{k}": float(np.mean(recall)),
+                "passage_cosine_mean": float(passage_cos.mean()),
+                "passage_cosine_min": float(passage_cos.min()),
+                "query_ms": q_ms,
+                "passage_ms": p_ms,
+            }
+            t = totals[backend]
+            t["query_cos"].extend(query_cos.tolist())
+            t["recall"].extend(recall)
+            t["passage_cos"].extend(passage_cos.tolist())
+            t["query_ms"].append(q_ms)
+            t["passage_ms"].append(p_ms)
+        report["stores"][name] = entry
+
+    print(f"\n   {'backend':<10} {'q cos':>7} {f'R@{k}':>7} {'p cos':>7} {'q ms':>7} {'p ms':>7}")
+    for backend, t in totals.items():
+        summary = {
+            "query_cosine_mean": float(np.mean(t["query_cos"])) if t["query_cos"] else 1.0,
+            f"recall@{k}": float(np.mean(t["recall"])) if t["recall"] else 1.0,
+            "passage_cosine_mean": float(np.mean(t["passage_cos"])) if t["passage_cos"] else 0.0,
+            "query_ms": float(np.mean(t["query_ms"])) if t["query_ms"] else 0.0,
+            "passage_ms": float(np.mean(t["passage_ms"])) if t["passage_ms"] else 0.0,
+        }
+        report["summary"][backend] = summary
+        print(f"   {backend:<10} {summary['query_cosine_mean']:7.4f} {summary[f'recall@{k}']:7.3f} "
+              f"{summary['passage_cosine_mean']:7.4f} {summary['query_ms']:7.1f} {summary['passage_ms']:7.1f}")
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    out_file = os.path.join(REPORT_DIR, 'report.json')
+    with open(out_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"   Đã lưu: {os.path.relpath(out_file, BASE_DIR)}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export E5 sang ONNX/int8 và báo cáo parity retrieval")
+    parser.add_argument("--report-only", action="store_true", help="Không export, chỉ chạy report")
+    parser.add_argument("--queries", type=str, default=DEFAULT_QUERIES,
+                        help="CSV câu hỏi (cột question_text hoặc Question)")
+    parser.add_argument("--limit", type=int, default=100, help="Số câu hỏi tối đa")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--sample-passages", type=int, default=100,
+                        help="Số chunk mỗi store dùng để so sánh embedding passage")
+    args = parser.parse_args()
+
+    if not args.report_only:
+        print(f"--- EXPORT {DEFAULT_MODEL_NAME} ---")
+        export()
+    print("\n--- PARITY REPORT (so với torch) ---")
+    parity_report(args.queries, args.k, args.limit, args.sample_passages, list(ONNX_FILES))
+
+
+if __name__ == "__main__":
+    main()
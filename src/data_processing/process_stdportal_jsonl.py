@@ -1,18 +1,16 @@
 
 import json
 import os
+import sys
 from pathlib import Path
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 from langchain.schema import Document
 
-
-class E5Embeddings(HuggingFaceEmbeddings):
-    def embed_documents(self, texts: list) -> list:
-        return super().embed_documents([f"passage: {t}" for t in texts])
-
-    def embed_query(self, text: str) -> list:
-        return super().embed_query(f"query: {text}")
+_APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+if _APP_DIR not in sys.path:
+    sys.path.insert(0, _APP_DIR)
+from embeddings import get_ingestion_embedding_model
+import store_versions
 
 def load_jsonl(file_path):
     """Đọc file JSONL (mỗi dòng 1 JSON object)"""
@@ -89,11 +87,7 @@ def create_chromadb_by_category(documents, base_dir='data/processed'):
         categorized_docs[category].append(doc)
     
     print("\nKhởi tạo embedding model (intfloat/multilingual-e5-base)...")
-    embeddings = E5Embeddings(
-        model_name="intfloat/multilingual-e5-base",
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': True}
-    )
+    embeddings = get_ingestion_embedding_model()
     print("     Lưu ý: Chề nên chạy script này độc lập khi test.")
     print("     Để rebuild toàn bộ DB, chạy: python build_specialized_dbs.py")
     
@@ -117,6 +111,7 @@ def create_chromadb_by_category(documents, base_dir='data/processed'):
             )
             
             print(f"    Đã lưu {vectordb._collection.count()} vectors")
+            store_versions.bump(db_path)
             
         except Exception as e:
             print(f"    Lỗi: {e}")
@@ -1,5 +1,6 @@
 
 import os
+import sys
 import csv
 import json
 import time
@@ -9,6 +10,7 @@ from dotenv import load_dotenv
 
 ROOT = Path(__file__).resolve().parent.parent
 load_dotenv(ROOT / ".env")
+sys.path.insert(0, str(ROOT / "src" / "app"))
 
 DEFAULT_TEST_FILE = ROOT / "data" / "eval" / "data_labels.csv"
 OUT_DIR = ROOT / "evaluate" / "layer_evaluation"
@@ -70,18 +72,14 @@ def extract_agents_from_json(output: str) -> set:
 def evaluate(test_file: Path = DEFAULT_TEST_FILE):
     from langchain_core.prompts import ChatPromptTemplate
     from langchain_core.output_parsers import StrOutputParser
-    from langchain_groq import ChatGroq
+    from llm_backend import get_chat_model
 
     # Đọc dữ liệu
     with open(test_file, encoding="utf-8") as f:
         rows = list(csv.DictReader(f))
 
-    # Khởi tạo LLaMA chain
-    llm = ChatGroq(
-        model=os.getenv("LLM_MODEL", "llama-3.1-8b-instant"),
-        api_key=os.getenv("API_KEY"),
-        temperature=0,
-    )
+    # Khởi tạo LLaMA chain (LLM_BACKEND=record/replay để chạy lại offline)
+    llm = get_chat_model("groq_llama")
     chain = ChatPromptTemplate.from_template(ROUTER_PROMPT) | llm | StrOutputParser()
 
     print(f"\n{'='*60}")
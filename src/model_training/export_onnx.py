@@ -0,0 +1,133 @@
+# src/model_training/export_onnx.py
+#
+# Xuất model phân loại intent (PhoBERT) sang ONNX + bản lượng tử hoá int8 (dynamic),
+# rồi kiểm tra parity với PyTorch trên tập test (cùng split với train_classifier.py).
+#
+#   python src/model_training/export_onnx.py                  # export + parity
+#   python src/model_training/export_onnx.py --skip-parity
+#
+# Dùng trong app: INTENT_BACKEND=onnx-int8 (hoặc onnx).
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+os.environ["PYTORCH_ALLOW_INSECURE_LOAD"] = "1"
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATA_FILE = os.path.join(BASE_DIR, 'data', 'training', 'final_dataset.csv')
+MODEL_DIR = os.path.join(BASE_DIR, 'data', 'models', 'intent_classifier')
+APP_DIR = os.path.join(BASE_DIR, 'src', 'app')
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from intent_classifier import IntentClassifier, ONNX_DIRNAME, ONNX_FILES
+from segmentation import reserve_segmentation_capacity, segment_batch
+
+OPSET = 14
+
+
+def export_onnx(model_dir=MODEL_DIR):
+    """Ghi <model_dir>/onnx/model.onnx và model.int8.onnx; trả về đường dẫn 2 file."""
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    out_dir = os.path.join(model_dir, ONNX_DIRNAME)
+    os.makedirs(out_dir, exist_ok=True)
+    fp32_path = os.path.join(out_dir, ONNX_FILES["onnx"])
+    int8_path = os.path.join(out_dir, ONNX_FILES["onnx-int8"])
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+    sample = tokenizer(["Học_phí ngành CNTT bao_nhiêu ?"], return_tensors="pt")
+
+    print(f"   Export ONNX (opset {OPSET}) → {fp32_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=OPSET,
+        )
+
+    print(f"   Lượng tử hoá int8 (dynamic) → {int8_path}")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    for path in (fp32_path, int8_path):
+        print(f"      {os.path.basename(path)}: {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+    return fp32_path, int8_path
+
+
+def load_eval_texts():
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+    df = pd.read_csv(DATA_FILE)
+    _, test_df = train_test_split(df, test_size=0.2, random_state=42, stratify=df['label'])
+    return list(test_df['text']), list(test_df['label'])
+
+
+def parity_check(model_dir=MODEL_DIR, backends=("onnx", "onnx-int8")):
+    """So sánh nhãn/độ tin cậy/latency của từng backend ONNX với PyTorch trên tập test."""
+    texts, labels = load_eval_texts()
+    print(f"   Tập test: {len(texts)} câu")
+    # Tách từ cả tập test 1 lần trước khi đo: mọi backend (kể cả torch chạy đầu tiên)
+    # dùng chung memo đã ấm, latency chỉ còn phản ánh model.
+    reserve_segmentation_capacity(len(texts))
+    segment_batch(texts)
+
+    def run(backend):
+        clf = IntentClassifier(model_dir, micro_batch=False, backend=backend)
+        clf.predict_batch(texts[:8])  # warm-up
+        t0 = time.perf_counter()
+        preds = clf.predict_batch(texts)
+        batch_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for t in texts[:50]:
+            clf.predict(t)
+        single_ms = (time.perf_counter() - t0) / min(len(texts), 50) * 1000
+        return preds, batch_s, single_ms
+
+    reference, ref_batch_s, ref_single_ms = run("torch")
+    ref_acc = np.mean([p[0] == y for p, y in zip(reference, labels)]) * 100
+    print(f"\n   {'backend':<10} {'acc %':>7} {'agree %':>8} {'max Δconf':>10} {'batch s':>8} {'1 câu ms':>9}")
+    print(f"   {'torch':<10} {ref_acc:7.2f} {100.0:8.2f} {0.0:10.2f} {ref_batch_s:8.2f} {ref_single_ms:9.1f}")
+
+    report = {}
+    for backend in backends:
+        preds, batch_s, single_ms = run(backend)
+        agree = np.mean([p[0] == r[0] for p, r in zip(preds, reference)]) * 100
+        delta = max(abs(p[1] - r[1]) for p, r in zip(preds, reference))
+        acc = np.mean([p[0] == y for p, y in zip(preds, labels)]) * 100
+        print(f"   {backend:<10} {acc:7.2f} {agree:8.2f} {delta:10.2f} {batch_s:8.2f} {single_ms:9.1f}")
+        report[backend] = {"accuracy": acc, "agreement": agree, "max_conf_delta": delta,
+                           "speedup_single": ref_single_ms / single_ms if single_ms else 0.0}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export PhoBERT intent classifier sang ONNX/int8")
+    parser.add_argument("--model-dir", type=str, default=MODEL_DIR)
+    parser.add_argument("--skip-parity", action="store_true", help="Bỏ qua kiểm tra parity")
+    args = parser.parse_args()
+
+    print(f"--- EXPORT ONNX: {args.model_dir} ---")
+    export_onnx(args.model_dir)
+    if not args.skip_parity:
+        print("\n--- KIỂM TRA PARITY (so với PyTorch) ---")
+        parity_check(args.model_dir)
+
+
+if __name__ == "__main__":
+    main()
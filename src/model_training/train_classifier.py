@@ -14,15 +14,21 @@ from transformers import (
     Trainer,
     DataCollatorWithPadding
 )
+import sys
 import torch
-from underthesea import word_tokenize
 
 os.environ["PYTORCH_ALLOW_INSECURE_LOAD"] = "1"
 
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+from segmentation import SegmentationMemo
+
 MODEL_NAME = "vinai/phobert-base"
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DATA_FILE = os.path.join(BASE_DIR, 'data', 'training', 'final_dataset.csv')
+SEGMENTATION_CACHE = os.path.join(BASE_DIR, 'data', 'training', 'segmentation_cache.json')
 OUTPUT_DIR = os.path.join(BASE_DIR, 'data', 'models', 'intent_classifier')
 
 # Hyperparameters
@@ -78,16 +84,22 @@ def main():
     print("   Đang tải Tokenizer...")
     tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
 
+    # Memo tách từ lưu trên đĩa: train lại / đánh giá lại không phải tách từ lần nữa
+    memo = SegmentationMemo(capacity=max(len(df) * 2, 4096))
+    print(f"   Memo tách từ: nạp {memo.load(SEGMENTATION_CACHE)} câu từ cache")
+
     def tokenize_function(examples):
         # Bước 1: Tách từ tiếng Việt (Word Segmentation)
         # Ví dụ: "Học phí bao nhiêu" -> "Học_phí bao_nhiêu"
-        segmented_texts = [word_tokenize(text, format="text") for text in examples["text"]]
+        segmented_texts = memo.segment_batch(examples["text"])
         
         # Bước 2: Tokenize bằng PhoBERT tokenizer
         return tokenizer(segmented_texts, padding="max_length", truncation=True, max_length=128)
     
     print("   Đang mã hóa dữ liệu (Tokenizing)...")
     tokenized_datasets = dataset.map(tokenize_function, batched=True)
+    memo.save(SEGMENTATION_CACHE)
+    print(f"   Memo tách từ: {memo.stats['hits']} hit / {memo.stats['misses']} miss")
     
     # Xóa các cột không cần thiết, chỉ giữ lại input_ids, attention_mask, labels
     tokenized_datasets = tokenized_datasets.remove_columns(["text", "label", "__index_level_0__"])
@@ -148,5 +160,14 @@ def main():
     with open(os.path.join(OUTPUT_DIR, 'label_map.json'), 'w', encoding='utf-8') as f:
         json.dump(id2label, f, ensure_ascii=False, indent=4)
 
+    # Export ONNX + int8 cho backend suy luận CPU (INTENT_BACKEND=onnx-int8)
+    print("\n--- EXPORT ONNX ---")
+    try:
+        from export_onnx import export_onnx, parity_check
+        export_onnx(OUTPUT_DIR)
+        parity_check(OUTPUT_DIR)
+    except ImportError as e:
+        print(f"   Bỏ qua export ONNX (thiếu thư viện: {e}). Cài: pip install onnx onnxruntime")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
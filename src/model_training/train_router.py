@@ -0,0 +1,135 @@
+# src/model_training/train_router.py
+#
+# Dựng index kNN cho router cục bộ (src/app/local_router.py) từ:
+#   - data/eval/data_labels.csv          (Question, Expected Agents)
+#   - data/training/train_data_*.csv     (text, label — chỉ lấy nhãn là agent)
+#   - data/processed/router_log.jsonl    (quyết định của LLM router khi chạy app)
+#
+#   python src/model_training/train_router.py
+#   python src/model_training/train_router.py --holdout-eval   # đo trên data_labels.csv (không dùng để dựng)
+
+import os
+import sys
+import csv
+import argparse
+import unicodedata
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+APP_DIR = os.path.join(BASE_DIR, 'src', 'app')
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from local_router import (
+    INDEX_DIR, LocalRouter, build_index, normalize_labels, read_decision_log,
+)
+
+EVAL_LABELS_FILE = os.path.join(BASE_DIR, 'data', 'eval', 'data_labels.csv')
+TRAINING_FILES = [
+    os.path.join(BASE_DIR, 'data', 'training', 'train_data_auto.csv'),
+    os.path.join(BASE_DIR, 'data', 'training', 'train_data_general_fix.csv'),
+]
+
+
+def read_csv_samples(path, text_col, label_col):
+    if not os.path.exists(path):
+        print(f"   [CẢNH BÁO] Không tìm thấy file: {path}")
+        return []
+    samples = []
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            text = (row.get(text_col) or '').strip()
+            labels = normalize_labels(row.get(label_col) or '')
+            if text and labels:
+                samples.append((text, labels))
+    print(f"   -> {os.path.basename(path)}: {len(samples)} câu")
+    return samples
+
+
+def merge_samples(groups):
+    """Gộp câu trùng nhau: hợp các tập nhãn, giữ thứ tự xuất hiện."""
+    merged = {}
+    for samples in groups:
+        for text, labels in samples:
+            current = merged.setdefault(text, [])
+            current.extend(l for l in labels if l not in current)
+    return list(merged.items())
+
+
+def _question_key(text):
+    return " ".join(unicodedata.normalize("NFC", text).split()).casefold()
+
+
+def drop_questions(samples, excluded):
+    """Bỏ các câu có trong excluded (so sánh sau khi chuẩn hoá khoảng trắng / hoa thường)."""
+    keys = {_question_key(t) for t, _ in excluded}
+    return [(t, labels) for t, labels in samples if _question_key(t) not in keys]
+
+
+def embed(texts):
+    from embeddings import get_shared_embedding_model
+    model = get_shared_embedding_model()
+    vectors = []
+    for i in range(0, len(texts), 64):
+        vectors.extend(model.embed_queries(texts[i:i + 64]))
+    return vectors
+
+
+def holdout_eval(router, samples):
+    """Điểm giống eval_layers.py: đúng hoàn toàn = 1, đúng 1 phần = tp/|expected|."""
+    vectors = embed([t for t, _ in samples])
+    confident, score_local, score_all = 0, 0.0, 0.0
+    for (text, expected), vec in zip(samples, vectors):
+        agents, similarity, vote = router.predict(vec)
+        expected, predicted = set(expected), set(agents)
+        score = 1.0 if expected == predicted else len(expected & predicted) / len(expected)
+        score_all += score
+        if router.is_confident(agents, similarity, vote):
+            confident += 1
+            score_local += score
+    n = len(samples)
+    print(f"   Accuracy (mọi câu):          {score_all / n * 100:.2f}%")
+    print(f"   Tỉ lệ router cục bộ tự tin:  {confident / n * 100:.2f}% ({confident}/{n})")
+    if confident:
+        print(f"   Accuracy khi tự tin:         {score_local / confident * 100:.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dựng index kNN cho router cục bộ")
+    parser.add_argument("--holdout-eval", action="store_true",
+                        help="Không đưa data_labels.csv vào index, dùng nó để đo accuracy")
+    args = parser.parse_args()
+
+    print("--- DỰNG INDEX ROUTER CỤC BỘ ---")
+    eval_samples = read_csv_samples(EVAL_LABELS_FILE, 'Question', 'Expected Agents')
+    training = [read_csv_samples(p, 'text', 'label') for p in TRAINING_FILES]
+    logged = read_decision_log()
+    print(f"   -> router_log.jsonl: {len(logged)} câu")
+    if args.holdout_eval:
+        # Log có thể chứa chính các câu eval (vd. lúc chạy eval_layers.py) → không còn là holdout.
+        kept = drop_questions(logged, eval_samples)
+        print(f"      bỏ {len(logged) - len(kept)} câu trùng data_labels.csv")
+        logged = kept
+
+    groups = training + [logged] + ([] if args.holdout_eval else [eval_samples])
+    samples = merge_samples(groups)
+    if not samples:
+        print("Lỗi: Không có dữ liệu nào để dựng index!")
+        return
+    print(f"   Tổng: {len(samples)} câu (sau khi gộp trùng)")
+
+    vectors = embed([t for t, _ in samples])
+    sources = {
+        "data_labels": 0 if args.holdout_eval else len(eval_samples),
+        "training": sum(len(g) for g in training),
+        "router_log": len(logged),
+    }
+    build_index(INDEX_DIR, [labels for _, labels in samples], vectors, sources)
+    print(f"   Đã lưu index: {INDEX_DIR}")
+
+    if args.holdout_eval and eval_samples:
+        print("\n--- ĐÁNH GIÁ TRÊN data_labels.csv ---")
+        holdout_eval(LocalRouter.load(INDEX_DIR), eval_samples)
+
+
+if __name__ == "__main__":
+    main()
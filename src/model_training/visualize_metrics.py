@@ -1,24 +1,29 @@
 # src/model_training/visualize_metrics.py
 
 import os
+import sys
 import pandas as pd
 import numpy as np
-import torch
 import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import confusion_matrix, classification_report
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from underthesea import word_tokenize
-import torch.nn.functional as F
 from tqdm import tqdm
 
 os.environ["PYTORCH_ALLOW_INSECURE_LOAD"] = "1"
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+APP_DIR = os.path.join(BASE_DIR, 'src', 'app')
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from intent_classifier import IntentClassifier
+from segmentation import load_segmentation_cache
+
 DATA_FILE = os.path.join(BASE_DIR, 'data', 'training', 'final_dataset.csv')
 MODEL_PATH = os.path.join(BASE_DIR, 'data', 'models', 'intent_classifier')
 REPORT_DIR = os.path.join(BASE_DIR, 'data', 'reports')
+SEGMENTATION_CACHE = os.path.join(BASE_DIR, 'data', 'training', 'segmentation_cache.json')
 
 os.makedirs(REPORT_DIR, exist_ok=True)
 
@@ -33,45 +38,35 @@ def main():
 
     # Load Model
     print(f"2. Đang load model từ: {MODEL_PATH}")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
     try:
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-        model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH)
-        model.to(device)
-        model.eval()
+        classifier = IntentClassifier(MODEL_PATH)
     except Exception as e:
         print(f"❌ Lỗi load model: {e}")
         return
 
-    id2label = model.config.id2label
+    id2label = classifier.id2label
     label_list = [id2label[i] for i in range(len(id2label))]
 
-    # Chạy dự đoán
+    # Chạy dự đoán theo batch (padding động, 1 forward pass / batch)
     print("3. Đang chạy dự đoán (Inference)...")
     
     results = [] # Lưu kết quả chi tiết để phân tích
 
-    for text, true_label in tqdm(zip(test_df['text'], test_df['label']), total=len(test_df)):
-        # Pre-process
-        text_segmented = word_tokenize(text, format="text")
-        inputs = tokenizer(text_segmented, return_tensors="pt", truncation=True, max_length=128)
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-        
-        with torch.no_grad():
-            outputs = model(**inputs)
-            probs = F.softmax(outputs.logits, dim=-1)
-            confidence, predicted_id = torch.max(probs, dim=-1)
-            
-        pred_label = id2label[predicted_id.item()]
-        score = confidence.item()
-        
-        results.append({
-            "text": text,
-            "true_label": true_label,
-            "pred_label": pred_label,
-            "confidence": score,
-            "is_correct": true_label == pred_label
-        })
+    texts = list(test_df['text'])
+    true_labels = list(test_df['label'])
+    # Dùng lại memo tách từ của lần train (cùng dataset) để bỏ qua underthesea
+    load_segmentation_cache(SEGMENTATION_CACHE, min_capacity=len(texts) * 2)
+    chunk = 256
+    for start in tqdm(range(0, len(texts), chunk)):
+        predictions = classifier.predict_batch(texts[start:start + chunk])
+        for text, true_label, (pred_label, score) in zip(texts[start:start + chunk], true_labels[start:start + chunk], predictions):
+            results.append({
+                "text": text,
+                "true_label": true_label,
+                "pred_label": pred_label,
+                "confidence": score / 100,
+                "is_correct": true_label == pred_label
+            })
 
     # Chuyển kết quả sang DataFrame để dễ xử lý
     res_df = pd.DataFrame(results)
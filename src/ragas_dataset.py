@@ -11,6 +11,8 @@ Chạy:
     python eval/ragas_dataset.py              # Toàn bộ dataset (99 câu)
     python eval/ragas_dataset.py --limit 10   # Chỉ 10 câu đầu (demo nhanh)
     python eval/ragas_dataset.py --start 5 --limit 10  # Câu 5→14
+    LLM_BACKEND=record python eval/ragas_dataset.py     # ghi cassette LLM
+    LLM_BACKEND=replay python eval/ragas_dataset.py     # chạy lại offline từ cassette
 """
 
 import os
@@ -30,6 +32,11 @@ for path in [app_path, project_root]:
         sys.path.insert(0, path)
 
 # ── Import RAG system ────────────────────────────────────────────────────────
+# Đánh giá phải chạy đủ pipeline cho mọi câu: tắt semantic cache, answer cache và tier trên đĩa
+# của app (đặt trước khi import main; đặt biến môi trường =1 để đo cả cache).
+os.environ.setdefault("SEMANTIC_CACHE", "0")
+os.environ.setdefault("ANSWER_CACHE", "0")
+os.environ.setdefault("SEMANTIC_CACHE_PERSIST", "0")
 print("Đang khởi động hệ thống RAG...")
 try:
     from main import process_query_with_context